@@ -1,34 +1,79 @@
+import time
+_started_at = time.perf_counter()  # Taken before the other imports, to report how long they take
+import logging
 import os
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from dotenv import load_dotenv
 from src.main import ask_for_help
+from src.config import REINDEX_INTERVAL_SECONDS, SLACK_STREAMING_ENABLED
+from src.dispatcher import SessionDispatcher
+from src.slack_streaming import SlackMessageStreamer
+from src.ingester import start_background_sync
+from src.warm_up import start_warm_up
+from src.logging_config import SAMPLED, configure_logging
+from src.metrics import start_metrics_exporters
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
 
+BUSY_MESSAGE = "יש כרגע עומס רב, אנא שלח את ההודעה שוב בעוד מספר דקות."
+ERROR_MESSAGE = "מצטער, לא הצלחתי לענות על ההודעה. אנא נסה שוב בעוד מספר דקות."
 
-# Message handler for Slack
-@app.event({"type": "message", "subtype": None})
-def handle_message_events(message, say):
-    session_id = message['user']
-    print(message)
-    output = ask_for_help(message['text'] , session_id=session_id)
-    print(output)
 
-    say(output)
+def _answer(text, session_id, stream=None):
+    if stream is None:
+        return ask_for_help(text, session_id=session_id)
+    # Post a placeholder right away and edit it as the answer is generated
+    stream.start()
+    return ask_for_help(text, session_id=session_id, on_token=stream.update)
 
-@app.event("app_mention")
-def handle_mention(message, say):
+
+# Runs different users' turns in parallel and each user's messages in order
+dispatcher = SessionDispatcher(_answer)
+
+
+def _dispatch(message, say, client):
     session_id = message['user']
-    print(message)
-    output = ask_for_help(message['text'], session_id=session_id)
-    print(output)
+    logger.info("Message from %s in %s: %s", message['user'], message['channel'], message['text'], extra=SAMPLED)
+
+    stream = SlackMessageStreamer(client, message['channel']) if SLACK_STREAMING_ENABLED else None
+    send = stream.finish if stream is not None else say
 
-    say(output)
+    def reply(output):
+        logger.info("Reply to %s: %s", session_id, output, extra=SAMPLED)
+        send(output)
+
+    def on_error(error):
+        # Replaces the streaming placeholder, which would otherwise stay up forever
+        send(ERROR_MESSAGE)
+
+    if not dispatcher.submit(session_id, message['text'], reply, stream=stream, on_error=on_error):
+        say(BUSY_MESSAGE)
+
+
+# Message handler for Slack
+@app.event({"type": "message", "subtype": None})
+def handle_message_events(message, say, client):
+    _dispatch(message, say, client)
+
+@app.event("app_mention")
+def handle_mention(message, say, client):
+    _dispatch(message, say, client)
 
 
 if __name__ == "__main__":
+    configure_logging()
+    start_metrics_exporters()
+    logger.info("Modules imported in %.1fs, connecting to Slack.", time.perf_counter() - _started_at)
+    # Index the documents and build the graph in the background; tool requests are answered meanwhile
+    start_warm_up(_started_at)
+
+    # Pick up added, edited and removed PDFs without restarting the bot
+    if REINDEX_INTERVAL_SECONDS > 0:
+        start_background_sync(REINDEX_INTERVAL_SECONDS)
 
     SocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN")).start()
@@ -0,0 +1,103 @@
+import time
+_started_at = time.perf_counter()  # Taken before the other imports, to report how long they take
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from dotenv import load_dotenv
+from src.main import aask_for_help
+from src.config import REINDEX_INTERVAL_SECONDS, SLACK_STREAMING_ENABLED
+from src.ingester import start_background_sync
+from src.warm_up import start_warm_up
+from src.logging_config import SAMPLED, configure_logging
+from src.metrics import start_metrics_exporters
+from src.slack_streaming import AsyncSlackMessageStreamer
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+# Async variant of slack_app.py: handlers await the graph, so one user's LLM calls
+# no longer hold up every other conversation
+app = AsyncApp(token=os.environ.get("SLACK_BOT_TOKEN"))
+
+ERROR_MESSAGE = "מצטער, לא הצלחתי לענות על ההודעה. אנא נסה שוב בעוד מספר דקות."
+
+# One lock per session with turns running or waiting, and the number of turns holding or awaiting it
+_session_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def _session_turn(session_id):
+    """
+    Runs a session's turns one at a time, in the order their messages arrived (asyncio locks are
+    first come, first served), so two turns never run against the same conversation checkpoint at once.
+    """
+    lock, users = _session_locks.get(session_id, (None, 0))
+    lock = lock or asyncio.Lock()
+    _session_locks[session_id] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _session_locks[session_id]
+        if users == 1:
+            del _session_locks[session_id]
+        else:
+            _session_locks[session_id] = (lock, users - 1)
+
+
+async def _answer(message, say, client):
+    session_id = message['user']
+    logger.info("Message from %s in %s: %s", message['user'], message['channel'], message['text'], extra=SAMPLED)
+    async with _session_turn(session_id):
+        await _answer_turn(message, say, client, session_id)
+
+
+async def _answer_turn(message, say, client, session_id):
+    stream = AsyncSlackMessageStreamer(client, message['channel']) if SLACK_STREAMING_ENABLED else None
+    send = stream.finish if stream is not None else say
+    try:
+        if stream is not None:
+            # Post a placeholder right away and edit it as the answer is generated
+            await stream.start()
+            output = await aask_for_help(message['text'], session_id=session_id, on_token=stream.update)
+        else:
+            output = await aask_for_help(message['text'], session_id=session_id)
+    except Exception as e:
+        logger.exception("Turn for session '%s' failed: %s", session_id, e)
+        # Replaces the streaming placeholder, which would otherwise stay up forever
+        await send(ERROR_MESSAGE)
+        return
+    logger.info("Reply to %s: %s", session_id, output, extra=SAMPLED)
+    await send(output)
+
+
+# Message handler for Slack
+@app.event({"type": "message", "subtype": None})
+async def handle_message_events(message, say, client):
+    await _answer(message, say, client)
+
+@app.event("app_mention")
+async def handle_mention(message, say, client):
+    await _answer(message, say, client)
+
+
+async def main():
+    await AsyncSocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN")).start_async()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    start_metrics_exporters()
+    logger.info("Modules imported in %.1fs, connecting to Slack.", time.perf_counter() - _started_at)
+    # Index the documents and build the graph in the background; tool requests are answered meanwhile
+    start_warm_up(_started_at)
+
+    # Pick up added, edited and removed PDFs without restarting the bot
+    if REINDEX_INTERVAL_SECONDS > 0:
+        start_background_sync(REINDEX_INTERVAL_SECONDS)
+
+    asyncio.run(main())
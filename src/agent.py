@@ -1,12 +1,27 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+import numpy as np
 from langchain.agents import create_tool_calling_agent, AgentExecutor
+from langchain_core.agents import AgentStep
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from src.tools import add_vendor_tool, update_user_tool
-from src.config import LLM
+from src.config import get_llm, AGENT_VERBOSE, TOOL_FAST_PATH_ENABLED, NODE_TIMINGS_WINDOW
+from src.intent_parser import parse_tool_command, format_tool_reply
+from src.tool_store import WriteGroup
+from src.metrics import TOOL_TURNS
 from src.models import State
 
 # Define the tools to be used
 tools = [add_vendor_tool, update_user_tool]
+tools_by_name = {tool.name: tool for tool in tools}
 
 # Define the prompt template
 prompt = ChatPromptTemplate.from_messages([
@@ -15,20 +30,175 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="agent_scratchpad"),
 ])
 
-# Create the tool-aware agent
-agent = create_tool_calling_agent(
-    llm=LLM,
-    tools=tools,
-    prompt=prompt
-)
+# A placeholder observation for a tool call that ParallelToolsAgentExecutor runs after the others are known
+_DEFERRED = object()
+_deferred_actions: ContextVar[Optional[list]] = ContextVar("deferred_agent_actions", default=None)
+
+
+class ParallelToolsAgentExecutor(AgentExecutor):
+    """
+    An AgentExecutor that runs the tool calls the model makes in one step concurrently, instead
+    of one after the other. Their writes to the tool data store are committed together in a
+    single transaction, and the observations are returned in the order of the calls.
+    """
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        deferred = _deferred_actions.get()
+        if deferred is None:
+            return super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        deferred.append(agent_action)
+        return AgentStep(action=agent_action, observation=_DEFERRED)
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        deferred = _deferred_actions.get()
+        if deferred is None:
+            return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        deferred.append(agent_action)
+        return AgentStep(action=agent_action, observation=_DEFERRED)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # Let the base class plan the step, collecting its tool calls instead of running them
+        deferred = []
+        token = _deferred_actions.set(deferred)
+        try:
+            outputs = list(super()._iter_next_step(name_to_tool_map, color_mapping, inputs,
+                                                   intermediate_steps, run_manager))
+        finally:
+            _deferred_actions.reset(token)
+        if not deferred:
+            yield from outputs
+            return
+
+        group = WriteGroup(len(deferred))
+
+        def perform(agent_action):
+            with group.participant():
+                return AgentExecutor._perform_agent_action(self, name_to_tool_map, color_mapping,
+                                                           agent_action, run_manager)
+
+        with ContextThreadPoolExecutor(max_workers=len(deferred)) as pool:
+            steps = iter(list(pool.map(perform, deferred)))
+        for output in outputs:
+            yield next(steps) if isinstance(output, AgentStep) and output.observation is _DEFERRED else output
+
+    async def _aiter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        deferred = []
+        token = _deferred_actions.set(deferred)
+        try:
+            outputs = [output async for output in super()._aiter_next_step(
+                name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)]
+        finally:
+            _deferred_actions.reset(token)
+
+        steps = iter(())
+        if deferred:
+            group = WriteGroup(len(deferred))
+
+            async def perform(agent_action):
+                with group.participant():
+                    return await AgentExecutor._aperform_agent_action(self, name_to_tool_map, color_mapping,
+                                                                      agent_action, run_manager)
+
+            steps = iter(await asyncio.gather(*(perform(agent_action) for agent_action in deferred)))
+        for output in outputs:
+            yield next(steps) if isinstance(output, AgentStep) and output.observation is _DEFERRED else output
+
+
+def build_agent_executor(llm: Optional[BaseChatModel] = None) -> AgentExecutor:
+    """
+    Creates the tool-calling agent and wraps it in an executor.
+
+    Args:
+        llm: The chat model that chooses the tool calls and writes the reply. Defaults to config.get_llm().
+
+    Returns:
+        The executor, which runs the tool calls of each step in parallel.
+    """
+    # Create the tool-aware agent
+    agent = create_tool_calling_agent(
+        llm=llm or get_llm(),
+        tools=tools,
+        prompt=prompt
+    )
+
+    # Wrap the agent in an executor
+    return ParallelToolsAgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=AGENT_VERBOSE,
+        handle_parsing_errors=True,  # Optional: for robustness
+    )
+
+
+_agent_executor: Optional[AgentExecutor] = None
+_agent_executor_lock = threading.Lock()
+
+
+def get_agent_executor() -> AgentExecutor:
+    """Returns the agent executor, building it on first use."""
+    global _agent_executor
+    with _agent_executor_lock:
+        if _agent_executor is None:
+            _agent_executor = build_agent_executor()
+        return _agent_executor
+
+
+# Durations of the turns answered by the fast path and by the agent, for fast_path_summary()
+_turn_timings = {"fast_path": deque(maxlen=NODE_TIMINGS_WINDOW), "agent": deque(maxlen=NODE_TIMINGS_WINDOW)}
+_turn_counts = {"fast_path": 0, "agent": 0}
+_turn_timings_lock = threading.Lock()
+
+
+def _record_turn(path: str, seconds: float) -> None:
+    with _turn_timings_lock:
+        _turn_counts[path] += 1
+        _turn_timings[path].append(seconds)
+    TOOL_TURNS.inc(path=path)
 
-# Wrap the agent in an executor
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True,
-    handle_parsing_errors=True,  # Optional: for robustness
-)
+
+def fast_path_summary() -> dict:
+    """
+    Summarizes how many tool turns the fast path answered and the latency it saved.
+
+    Returns:
+        The number of turns answered by the fast path and by the agent, the fast path's hit
+        rate, the p50 latency of each in milliseconds, and the estimated time saved in seconds
+        (fast path turns times the difference between the two p50s).
+    """
+    with _turn_timings_lock:
+        counts = dict(_turn_counts)
+        timings = {path: list(durations) for path, durations in _turn_timings.items()}
+    p50_ms = {path: float(np.percentile(durations, 50)) * 1000 if durations else None
+              for path, durations in timings.items()}
+    turns = counts["fast_path"] + counts["agent"]
+    saved = None
+    if p50_ms["fast_path"] is not None and p50_ms["agent"] is not None:
+        saved = counts["fast_path"] * (p50_ms["agent"] - p50_ms["fast_path"]) / 1000
+    return {
+        "fast_path_turns": counts["fast_path"],
+        "agent_turns": counts["agent"],
+        "hit_rate": counts["fast_path"] / turns if turns else 0.0,
+        "fast_path_p50_ms": p50_ms["fast_path"],
+        "agent_p50_ms": p50_ms["agent"],
+        "estimated_saved_seconds": saved,
+    }
+
+
+def _fast_path_reply(state: State, last_human: HumanMessage) -> Optional[str]:
+    """
+    Runs a common tool command without the agent: when the message parses confidently into a
+    tool's arguments, the tool is called directly and the reply comes from a template.
+
+    Returns:
+        The reply, or None when the message should go to the agent.
+    """
+    if not TOOL_FAST_PATH_ENABLED:
+        return None
+    command = parse_tool_command(last_human.content)
+    if command is None:
+        return None
+    result = tools_by_name[command.tool_name].invoke(command.args.model_dump(exclude_none=True))
+    return format_tool_reply(command, result, state.get("language", "Hebrew"))
 
 
 # Function to run the agent with LangGraph-compatible state
@@ -38,13 +208,82 @@ def run_agent(state: State) -> dict:
     if last_human is None:
         raise ValueError("No HumanMessage found in messages")
 
-    result = agent_executor.invoke({"messages": state["messages"]})
+    start = time.perf_counter()
+    reply = _fast_path_reply(state, last_human)
+    if reply is not None:
+        _record_turn("fast_path", time.perf_counter() - start)
+        return {"messages": state["messages"] + [AIMessage(content=reply)]}
+
+    result = get_agent_executor().invoke({"messages": state["messages"]})
+    _record_turn("agent", time.perf_counter() - start)
 
     return {
         "messages": state["messages"] + [AIMessage(content=result["output"])]
     }
 
 
+async def arun_agent(state: State) -> dict:
+    """Async version of run_agent(), for graphs driven with ainvoke()."""
+    last_human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
+
+    if last_human is None:
+        raise ValueError("No HumanMessage found in messages")
+
+    start = time.perf_counter()
+    # The tool's write waits for a disk commit, so it runs off the event loop
+    reply = await asyncio.to_thread(_fast_path_reply, state, last_human)
+    if reply is not None:
+        _record_turn("fast_path", time.perf_counter() - start)
+        return {"messages": state["messages"] + [AIMessage(content=reply)]}
+
+    result = await get_agent_executor().ainvoke({"messages": state["messages"]})
+    _record_turn("agent", time.perf_counter() - start)
+
+    return {
+        "messages": state["messages"] + [AIMessage(content=result["output"])]
+    }
+
+
+# --- Multi-call turns from a scripted model: parallel tool calls against sequential ones ---
 if __name__ == '__main__':
-    response = run_agent({"messages": [HumanMessage(content="Please update user 1 to status closed.")]})
-    print(response['messages'][-1].content)
+    import tempfile
+    from pathlib import Path
+
+    from src.load_test import ScriptedChatModel
+    from src.tool_store import ToolDataStore, set_tool_store
+
+    # Each tool call waits for its own commit, as on a slow disk
+    class SlowCommitStore(ToolDataStore):
+        def _commit(self, batch):
+            time.sleep(0.05)
+            super()._commit(batch)
+
+    scratch_dir = Path(tempfile.mkdtemp())
+    no_file = scratch_dir / "missing.json"
+    # "Add vendors A, B and C to user 5 and update their phone"
+    calls = [{"name": "add_vendor_to_user", "args": {"user_id": 5, "vendor_name": name}, "id": f"call-{name}"}
+             for name in ("A", "B", "C")]
+    calls.append({"name": "update_user_details", "args": {"user_id": 5, "phone": "052-1111111"}, "id": "call-phone"})
+    script = [AIMessage(content="", tool_calls=calls), AIMessage(content="Done.")]
+    message = {"messages": [HumanMessage(content="Add vendors A, B and C to user 5 and update their phone")]}
+
+    for name, executor_class in (("sequential", AgentExecutor), ("parallel", ParallelToolsAgentExecutor)):
+        store = SlowCommitStore(scratch_dir / f"{name}.sqlite", no_file, no_file)
+        set_tool_store(store)
+        store.put_user(5, {"name": "Dana", "phone": "050-0000000"})
+        commits_before = store.commits
+        executor = executor_class(agent=create_tool_calling_agent(ScriptedChatModel(responses=script), tools, prompt),
+                                  tools=tools, return_intermediate_steps=True)
+        start = time.perf_counter()
+        result = executor.invoke(message)
+        elapsed = time.perf_counter() - start
+        observations = [observation for _, observation in result["intermediate_steps"]]
+        in_order = [action.tool_call_id for action, _ in result["intermediate_steps"]] == [call["id"] for call in calls]
+        print(f"{name:>10}: {elapsed * 1000:.0f} ms, {store.commits - commits_before} commits, results in call order: "
+              f"{in_order}, vendors {store.get_vendors(5)}, phone {store.get_user(5)['phone']}")
+        print(f"            {observations}")
+
+    commits_before = store.commits
+    result = asyncio.run(executor.ainvoke(message))
+    print(f"  parallel ainvoke: {store.commits - commits_before} commits, "
+          f"{[observation for _, observation in result['intermediate_steps']]}")
@@ -0,0 +1,183 @@
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+# Rows scored per block when assigning vectors to centroids, to bound temporary memory
+_ASSIGN_BLOCK_SIZE = 16_384
+
+
+class IVFIndex:
+    """
+    An inverted-file (IVF) index for approximate nearest-neighbour search over unit-length vectors.
+
+    The vectors are clustered with spherical k-means; a query is then only compared with the
+    vectors of its `nprobe` nearest clusters. A larger nprobe raises recall and latency.
+    The vector store keeps the cluster of each of its rows. The index is saved with the centroids
+    and the cluster of each chunk text, so that a restart only assigns the vectors of chunks added
+    or edited since.
+    """
+
+    def __init__(self, centroids: np.ndarray,
+                 assignments: Optional[tuple[Sequence[str], np.ndarray]] = None):
+        """
+        Args:
+            centroids: The (n_lists, dim) matrix of unit-length centroids.
+            assignments: The content keys of the chunks and the cluster of each, as saved with the index; used
+                by NumpyVectorStore.set_ann_index() instead of assigning those vectors again.
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = assignments
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, n_lists: int, iterations: int = 10,
+              max_training_points: int = 64, seed: int = 0) -> "IVFIndex":
+        """
+        Clusters unit-length vectors with spherical k-means.
+
+        Args:
+            vectors: The (n, dim) matrix of normalized vectors to cluster.
+            n_lists: The number of clusters (inverted lists).
+            iterations: The number of k-means iterations.
+            max_training_points: The sample size per cluster used for training.
+            seed: The random seed, so the same corpus always yields the same index.
+
+        Returns:
+            The trained index.
+        """
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, min(n_lists, len(vectors)))
+        sample_size = min(len(vectors), n_lists * max_training_points)
+        sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assignments, minlength=n_lists)
+            order = np.argsort(assignments, kind="stable")
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            non_empty = counts > 0
+            sums[non_empty] = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            # Re-seed empty clusters with random sample points
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        return cls(centroids)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Returns the index of the nearest centroid of each vector."""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), _ASSIGN_BLOCK_SIZE):
+            block = vectors[start:start + _ASSIGN_BLOCK_SIZE]
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Returns the indices of the `nprobe` centroids nearest to the query."""
+        scores = self.centroids @ query
+        nprobe = min(nprobe, self.n_lists)
+        if nprobe == self.n_lists:
+            return np.arange(self.n_lists)
+        return np.argpartition(-scores, nprobe - 1)[:nprobe]
+
+    def save(self, path: Path, assignments: Optional[tuple[Sequence[str], np.ndarray]] = None) -> None:
+        """
+        Saves the centroids to a .npz file.
+
+        Args:
+            path: The file to write.
+            assignments: The content keys and the cluster of each chunk (see NumpyVectorStore.ann_assignments()),
+                saved along so that loading the index does not assign every vector again.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {"centroids": self.centroids}
+        if assignments is not None:
+            keys, lists = assignments
+            arrays["keys"] = np.asarray(list(keys), dtype=str)
+            arrays["lists"] = np.asarray(lists, dtype=np.int32)
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        """Loads an index saved with save(), with its assignments if they were saved."""
+        with np.load(Path(path)) as data:
+            assignments = None
+            if "keys" in data and "lists" in data:
+                assignments = (data["keys"].tolist(), data["lists"])
+            return cls(data["centroids"], assignments)
+
+
+def default_n_lists(corpus_size: int) -> int:
+    """The usual IVF rule of thumb: about 4 * sqrt(n) lists."""
+    return max(1, int(4 * np.sqrt(corpus_size)))
+
+
+# --- Recall and latency benchmark against exact search ---
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from src.vector_store import NumpyVectorStore
+
+    dim, k, n_queries = 256, 10, 200
+    rng = np.random.default_rng(42)
+
+    def clustered_vectors(count: int, n_topics: int = 500) -> np.ndarray:
+        """Synthetic embeddings grouped around topics, like chunks of related documents."""
+        topics = rng.normal(size=(n_topics, dim))
+        points = topics[rng.integers(n_topics, size=count)] + rng.normal(scale=1.5, size=(count, dim))
+        return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+    for corpus_size in (10_000, 50_000, 200_000):
+        vectors = clustered_vectors(corpus_size + n_queries)
+        corpus, queries = vectors[:corpus_size], vectors[corpus_size:]
+
+        store = NumpyVectorStore(DeterministicFakeEmbedding(size=dim))
+        store.add_vectors([Document(page_content=f"chunk {i}") for i in range(corpus_size)], corpus,
+                          ids=[str(i) for i in range(corpus_size)])
+        start = time.perf_counter()
+        store.build_ann_index(default_n_lists(corpus_size))
+        print(f"{corpus_size} vectors: IVF with {store.ann_index.n_lists} lists built in "
+              f"{time.perf_counter() - start:.2f}s")
+
+        # A restart: the saved index is loaded into a store holding the same chunks
+        path = Path(tempfile.mkdtemp()) / "ann_index.npz"
+        store.ann_index.save(path, store.ann_assignments())
+        for label, loaded in (("with saved assignments", IVFIndex.load(path)),
+                              ("centroids only", IVFIndex(store.ann_index.centroids))):
+            start = time.perf_counter()
+            store.set_ann_index(loaded)
+            print(f"  attached after a restart, {label}: {time.perf_counter() - start:.2f}s")
+
+        def run(nprobe):
+            latencies, results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                hits = store.similarity_search_with_score_by_vector(query, k=k, nprobe=nprobe)
+                latencies.append((time.perf_counter() - start) * 1000)
+                results.append({doc.id for doc, _ in hits})
+            return results, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+        exact, p50, p99 = run(nprobe=0)
+        print(f"  exact:      recall@{k} 1.000  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+        for nprobe in (4, 16, 64):
+            approximate, p50, p99 = run(nprobe=nprobe)
+            recall = np.mean([len(a & e) / k for a, e in zip(approximate, exact)])
+            print(f"  nprobe={nprobe:<3} recall@{k} {recall:.3f}  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
@@ -0,0 +1,227 @@
+"""
+Replays many questions through the chatbot in batches, e.g. historical Slack questions to evaluate a change.
+
+Usage: python -m src.batch questions.jsonl answers.jsonl [--batch-size N] [--max-concurrency N]
+
+Each input line holds {"query": ..., "session_id": ..., "language": ...}; only the query is required.
+One line per question is appended to the output file as soon as its batch step is done. Running the
+same command again after a crash (or Ctrl+C) resumes after the last answered question and retries
+the ones that failed.
+
+A replay has no side effects on the running bot: questions are never added to the human service
+queue, tool requests are routed (and parsed) but not run against the user data, and neither the
+conversation checkpoints nor the response cache are read or written. The conversation history of
+each session is kept by the replay itself, from the questions and answers it replayed.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Iterator
+
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+
+from src.config import BATCH_SIZE, BATCH_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+def read_rows(path: Path) -> Iterator[tuple[int, dict]]:
+    """
+    Streams the questions of a JSONL file.
+
+    Yields:
+        A (row number, row) tuple per non-empty line; the row number is the line's index among
+        the non-empty lines, and identifies the question in the output file.
+    """
+    with open(path, encoding="utf-8") as f:
+        row_number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield row_number, {
+                "query": row["query"],
+                "session_id": str(row.get("session_id") or f"replay-{row_number}"),
+                "language": row.get("language") or "Hebrew",
+            }
+            row_number += 1
+
+
+def _load_progress(output_path: Path) -> tuple[set[int], dict[str, list[BaseMessage]]]:
+    """
+    Reads the questions already answered by an earlier run of the same replay.
+
+    A line cut off by a crash is removed from the file first, so that new results start on a line of their own.
+
+    Returns:
+        The row numbers answered without an error, and the conversation history of each session so far.
+    """
+    if not output_path.exists():
+        return set(), {}
+    with open(output_path, "rb+") as f:
+        content = f.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            f.truncate(complete)
+
+    results = {}
+    for line in content[:complete].decode("utf-8").splitlines():
+        if line.strip():
+            result = json.loads(line)
+            if result.get("error") is None:
+                results[result["row"]] = result
+
+    histories: dict[str, list[BaseMessage]] = {}
+    for row_number in sorted(results):
+        _record_turn(histories, results[row_number])
+    return set(results), histories
+
+
+def _record_turn(histories: dict[str, list[BaseMessage]], result: dict) -> None:
+    """Adds a replayed question (and its answer, if it got one) to the history of its session."""
+    history = histories.setdefault(result["session_id"], [])
+    history.append(HumanMessage(content=result["query"]))
+    if result.get("answer") is not None:
+        history.append(AIMessage(content=result["answer"]))
+
+
+def _batches(rows: Iterator[tuple[int, dict]], size: int) -> Iterator[list[tuple[int, dict]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _session_waves(rows: list[tuple[int, dict]]) -> list[list[tuple[int, dict]]]:
+    """
+    Splits rows into waves with at most one question per session, in row order, so that each
+    question is answered after the earlier questions of its session.
+    """
+    waves: list[list[tuple[int, dict]]] = []
+    turns: dict[str, int] = {}
+    for row_number, row in rows:
+        wave = turns.get(row["session_id"], 0)
+        turns[row["session_id"]] = wave + 1
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append((row_number, row))
+    return waves
+
+
+def ask_for_help_batch(input_path: Path, output_path: Path, batch_size: int = BATCH_SIZE,
+                       max_concurrency: int = BATCH_MAX_CONCURRENCY) -> dict:
+    """
+    Answers the questions of a JSONL file like ask_for_help() would, a batch at a time: the
+    queries of a batch are embedded together, retrieved with one vectorized top-k, and routed
+    and answered through the chat model's batch interface.
+
+    Args:
+        input_path: The questions, one JSON object per line (see the module docstring).
+        output_path: The results file. Questions already answered in it are skipped.
+        batch_size: The number of questions handled together.
+        max_concurrency: The maximum number of LLM calls in flight.
+
+    Returns:
+        A summary with the number of questions replayed and skipped, and of answers,
+        escalations, tool requests and errors among the replayed ones.
+    """
+    # Imported here, so that a caller can swap in other models first (see load_test.install_stub_models())
+    from src.graph_builder import embed_queries, route_batch, retrieve_batch, generate_batch
+    from src.ingester import wait_for_index
+    from src.intent_parser import parse_tool_command
+
+    start = time.perf_counter()
+    done, histories = _load_progress(output_path)
+    summary = {"replayed": 0, "skipped": len(done), "answered": 0, "escalated": 0, "tool_requests": 0, "errors": 0}
+    wait_for_index()
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        def write(results: list[dict]) -> None:
+            for result in sorted(results, key=lambda result: result["row"]):
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                summary["replayed"] += 1
+                if result.get("error") is not None:
+                    summary["errors"] += 1
+                elif result["route"] == "tool_agent":
+                    summary["tool_requests"] += 1
+                else:
+                    summary["answered"] += 1
+                    summary["escalated"] += result["escalated"]
+            output.flush()
+            os.fsync(output.fileno())
+
+        pending_rows = ((row_number, row) for row_number, row in read_rows(input_path) if row_number not in done)
+        for batch in _batches(pending_rows, batch_size):
+            queries = [row["query"] for _, row in batch]
+            embed_queries(queries)
+            routes = dict(zip((row_number for row_number, _ in batch), route_batch(queries, max_concurrency)))
+
+            results, routed = [], []
+            for row_number, row in batch:
+                result = {"row": row_number, **row, "route": routes[row_number]}
+                if isinstance(result["route"], Exception):
+                    results.append({**result, "route": None, "error": repr(result["route"])})
+                    continue
+                routed.append((row_number, row))
+                if result["route"] == "tool_agent":
+                    # Running the tool would change the real user data
+                    command = parse_tool_command(row["query"])
+                    results.append({**result, "answer": None,
+                                    "tool_call": command and {"tool": command.tool_name,
+                                                              "args": command.args.model_dump(exclude_none=True)}})
+            write(results)
+
+            to_answer = [(row_number, row) for row_number, row in routed if routes[row_number] == "retrieve"]
+            contexts = dict(zip((row_number for row_number, _ in to_answer),
+                                retrieve_batch([row["query"] for _, row in to_answer])))
+            for wave in _session_waves(routed):
+                wave_to_answer = [(row_number, row) for row_number, row in wave if row_number in contexts]
+                states = [{
+                    "messages": histories.get(row["session_id"], []) + [HumanMessage(content=row["query"])],
+                    "language": row["language"],
+                    "context": contexts[row_number],
+                    "session_id": row["session_id"],
+                } for row_number, row in wave_to_answer]
+                answers = dict(zip((row_number for row_number, _ in wave_to_answer),
+                                   generate_batch(states, max_concurrency)))
+
+                results = []
+                for row_number, row in wave:
+                    if row_number not in answers:
+                        _record_turn(histories, row)  # A tool request
+                        continue
+                    result = {"row": row_number, **row, "route": "retrieve",
+                              "context_ids": [doc.id for doc in contexts[row_number]]}
+                    if isinstance(answers[row_number], Exception):
+                        results.append({**result, "error": repr(answers[row_number])})
+                    else:
+                        results.append({**result, **answers[row_number]})
+                        _record_turn(histories, results[-1])
+                write(results)
+            logger.info("Replayed %d questions (%d errors) in %.1fs.",
+                        summary["replayed"], summary["errors"], time.perf_counter() - start)
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from src.logging_config import configure_logging
+
+    parser = argparse.ArgumentParser(description="Replay questions from a JSONL file through the chatbot.")
+    parser.add_argument("input", type=Path, help="The questions, one JSON object per line.")
+    parser.add_argument("output", type=Path, help="The results file; an existing one is resumed.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-concurrency", type=int, default=BATCH_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    configure_logging()
+    print(ask_for_help_batch(args.input, args.output, args.batch_size, args.max_concurrency))
@@ -0,0 +1,475 @@
+"""
+Offline end-to-end benchmarks: fake chat and embedding models with a fixed latency, a
+synthetic PDF corpus and synthetic tool data, so they run without OpenAI credentials and
+give the same workload on every run.
+
+Usage: python -m src.benchmark [--quick] [--output FILE] [--compare BASELINE_FILE]
+
+Measures ingestion time per corpus size, retrieval latency, ask_for_help latency, throughput
+with concurrent sessions, memory growth per session, queue operations per second and tool
+store latency per number of users. The results are written as JSON, one entry per metric
+with its unit and whether lower or higher is better. With --compare, every metric is shown
+next to its baseline value, and the exit status is 1 when one got worse by more than
+--tolerance.
+
+All data (corpora, indexes, caches, checkpoints, tool data and queues) goes to a temporary
+directory; the real files under Data/ are never read or written.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+import numpy as np
+from langchain_core.messages import HumanMessage
+
+import src.config as config
+from src.load_test import StubChatModel, StubEmbeddings, install_stub_models
+from src.metrics import registry, CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED
+
+CORPUS_SIZES = [10, 50, 200]  # PDF files per synthetic corpus; the largest one is served end to end
+PAGES_PER_FILE = 5
+WORDS_PER_PAGE = 400
+TOOL_USER_COUNTS = [1_000, 10_000, 100_000]
+QUERIES = 100  # Retrievals, questions and tool commands measured one at a time
+CONCURRENT_SESSIONS = [1, 10, 50]
+TURNS_PER_SESSION = 3
+MEMORY_SESSIONS = 200
+QUEUE_OPERATIONS = 10_000
+LLM_LATENCY_SECONDS = 0.05
+EMBEDDING_LATENCY_SECONDS = 0.01
+REGRESSION_TOLERANCE = 0.2  # Relative change of a metric, in its worse direction, reported as a regression
+DEFAULT_OUTPUT_FILE = "benchmark_results.json"
+
+# Smaller workload for a quick check (--quick)
+QUICK_SETTINGS = {
+    "corpus_sizes": [5, 20],
+    "tool_user_counts": [1_000, 10_000],
+    "queries": 20,
+    "sessions": [1, 10],
+    "memory_sessions": 50,
+    "queue_operations": 2_000,
+}
+
+_TOPICS = ["vacation", "salary", "pension", "insurance", "overtime", "training", "equipment", "travel",
+           "parking", "security", "onboarding", "holidays", "expenses", "benefits", "remote work", "privacy"]
+
+
+def _quiet():
+    """Hides the progress messages of the code being measured."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _metric(value: float, unit: str, better: str = "lower") -> dict:
+    return {"value": round(float(value), 6), "unit": unit, "better": better}
+
+
+def _latency_metrics(metrics: dict, name: str, seconds: list[float]) -> None:
+    """Adds the p50 and p99 of a list of durations, in milliseconds."""
+    metrics[f"{name}.p50_ms"] = _metric(np.percentile(seconds, 50) * 1000, "ms")
+    metrics[f"{name}.p99_ms"] = _metric(np.percentile(seconds, 99) * 1000, "ms")
+
+
+def _time_each(func: Callable[[Any], Any], args: Iterable) -> list[float]:
+    """Calls func with each argument in turn and returns the duration of each call."""
+    durations = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# --- Synthetic data ---
+
+def _vocabulary(rng: random.Random, size: int = 2_000) -> list[str]:
+    """Pronounceable made-up words, so that BM25 and the fake embeddings see many distinct terms."""
+    return ["".join(rng.choice("bcdfghklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(2, 4)))
+            for _ in range(size)]
+
+
+def write_synthetic_pdf(path: Path, pages: list[str]) -> None:
+    """
+    Writes a minimal PDF with one page of ASCII text (Helvetica) per string, readable by pypdf.
+
+    Args:
+        path: The file to write.
+        pages: The text of each page.
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in textwrap.wrap(text, 90)]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_number + 1} 0 R >>".encode())
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def generate_corpus(directory: Path, files: int, pages_per_file: int = PAGES_PER_FILE, seed: int = 0) -> Path:
+    """
+    Writes a synthetic policy corpus: each file covers one topic, in made-up words.
+
+    Args:
+        directory: The directory to write the PDF files to (created if needed).
+        files: The number of PDF files.
+        pages_per_file: The number of pages in each file.
+        seed: The random seed; the same seed gives the same corpus.
+
+    Returns:
+        The directory.
+    """
+    rng = random.Random(seed)
+    words = _vocabulary(rng)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        topic = _TOPICS[i % len(_TOPICS)]
+        pages = []
+        for page in range(pages_per_file):
+            sentences = []
+            while sum(len(sentence.split()) for sentence in sentences) < WORDS_PER_PAGE:
+                sentences.append(f"The {topic} policy, section {page + 1}: "
+                                 + " ".join(rng.choices(words, k=rng.randint(8, 16))) + ".")
+            pages.append(" ".join(sentences))
+        write_synthetic_pdf(directory / f"policy_{i:04d}.pdf", pages)
+    return directory
+
+
+def generate_questions(count: int, seed: int = 1) -> list[str]:
+    """Distinct questions about the synthetic corpus, in English."""
+    rng = random.Random(seed)
+    words = _vocabulary(random.Random(0))  # The corpus vocabulary
+    return [f"What does the {rng.choice(_TOPICS)} policy say about {' '.join(rng.sample(words, 2))} (question {i})?"
+            for i in range(count)]
+
+
+def write_tool_data(directory: Path, users: int, seed: int = 0) -> tuple[Path, Path]:
+    """
+    Writes users_data.json and users_vendors.json files in the tools' format.
+
+    Args:
+        directory: The directory to write the files to.
+        users: The number of users; every user has one to three vendors.
+        seed: The random seed.
+
+    Returns:
+        The paths of the users file and of the vendors file.
+    """
+    rng = random.Random(seed)
+    users_data = {str(i): {"name": f"User {i}", "phone": f"05{i % 10}-{i % 10_000_000:07d}",
+                           "address": f"{i} Main St", "email": f"user{i}@example.com"} for i in range(users)}
+    vendors = {str(i): [f"Vendor {v}" for v in rng.sample(range(500), rng.randint(1, 3))] for i in range(users)}
+    users_file, vendors_file = directory / f"users_data_{users}.json", directory / f"users_vendors_{users}.json"
+    with open(users_file, "w", encoding="utf-8") as f:
+        json.dump({"users": users_data}, f)
+    with open(vendors_file, "w", encoding="utf-8") as f:
+        json.dump({"vendors": vendors}, f)
+    return users_file, vendors_file
+
+
+def use_scratch_data(scratch_dir: Path, corpus_dir: Path, users_file: Path, vendors_file: Path) -> None:
+    """
+    Points the data paths in src.config at the scratch directory. Must run before the modules
+    that read them (the ingester, the graph, the tool store and the queue) are imported.
+    """
+    config.PDF_DATA_PATH = str(corpus_dir) + "/"
+    config.ANN_INDEX_FILE = corpus_dir / ".ann_index.npz"
+    config.LEXICAL_INDEX_FILE = corpus_dir / ".lexical_index.pkl"
+    config.USERS_DATA_FILE, config.USER_VENDORS_FILE = users_file, vendors_file
+    config.TOOLS_DB_FILE = scratch_dir / "tools_data.sqlite"
+    config.QUEUE_DB_FILE = str(scratch_dir / "global_service_queue.sqlite")
+    config.QUEUE_FILE = str(scratch_dir / "global_service_queue.json")
+    config.QUEUE_LOG_FILE = str(scratch_dir / "global_service_queue.log")
+
+
+# --- Benchmarks ---
+
+def bench_ingestion(metrics: dict, corpus_dirs: dict[int, Path]) -> None:
+    """Indexes each corpus into a new vector store and lexical index, without the embedding cache."""
+    from src.embedding_pipeline import BatchedEmbeddings
+    from src.ingester import _sync_into
+    from src.lexical_index import LexicalIndex
+    from src.vector_store import NumpyVectorStore
+
+    for files, corpus_dir in corpus_dirs.items():
+        store = NumpyVectorStore(BatchedEmbeddings(config.get_embeddings()))
+        start = time.perf_counter()
+        with _quiet():
+            _sync_into(store, {}, str(corpus_dir), LexicalIndex())
+        elapsed = time.perf_counter() - start
+        metrics[f"ingestion.{files}_files.seconds"] = _metric(elapsed, "s")
+        metrics[f"ingestion.{files}_files.chunks_per_s"] = _metric(len(store) / elapsed, "chunks/s", "higher")
+        print(f"Ingestion, {files} files: {len(store)} chunks in {elapsed:.2f}s")
+
+
+def bench_tool_store(metrics: dict, scratch_dir: Path, user_counts: list[int], operations: int) -> None:
+    """Imports synthetic tool data of each size into a new store, then times single reads and writes."""
+    from src.tool_store import ToolDataStore
+
+    rng = random.Random(2)
+    for users in user_counts:
+        users_file, vendors_file = write_tool_data(scratch_dir, users)
+        start = time.perf_counter()
+        store = ToolDataStore(scratch_dir / f"tools_{users}.sqlite", vendors_file, users_file)
+        metrics[f"tools.{users}_users.import_seconds"] = _metric(time.perf_counter() - start, "s")
+        user_ids = [rng.randrange(users) for _ in range(operations)]
+        _latency_metrics(metrics, f"tools.{users}_users.get_user", _time_each(store.get_user, user_ids))
+        _latency_metrics(metrics, f"tools.{users}_users.update_user", _time_each(
+            lambda user_id: store.update_user(user_id, {"email": f"new{user_id}@example.org"}), user_ids))
+        _latency_metrics(metrics, f"tools.{users}_users.add_vendor", _time_each(
+            lambda user_id: store.add_vendor(user_id, f"Benchmark Vendor {user_id}"), user_ids))
+        store.close()
+        print(f"Tool store, {users} users: update p50 {metrics[f'tools.{users}_users.update_user.p50_ms']['value']:.2f} ms")
+
+
+def bench_queue(metrics: dict, scratch_dir: Path, operations: int) -> None:
+    """Enqueues and then dequeues `operations` users with each queue backend."""
+    from src.global_queue import FileServiceQueue, SQLiteServiceQueue
+
+    no_file = str(scratch_dir / "missing.json")
+    backends = {
+        "sqlite": SQLiteServiceQueue(str(scratch_dir / "bench_queue.sqlite"), no_file, no_file),
+        "file": FileServiceQueue(str(scratch_dir / "bench_queue.json"), str(scratch_dir / "bench_queue.log")),
+    }
+    for name, service_queue in backends.items():
+        with _quiet():
+            start = time.perf_counter()
+            for i in range(operations):
+                service_queue.add(f"user-{i}")
+            enqueue_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(operations):
+                service_queue.pop()
+            dequeue_seconds = time.perf_counter() - start
+            service_queue.close()
+        metrics[f"queue.{name}.enqueue_ops_per_s"] = _metric(operations / enqueue_seconds, "ops/s", "higher")
+        metrics[f"queue.{name}.dequeue_ops_per_s"] = _metric(operations / dequeue_seconds, "ops/s", "higher")
+        print(f"Queue, {name} backend: {operations / enqueue_seconds:,.0f} enqueues/s, "
+              f"{operations / dequeue_seconds:,.0f} dequeues/s")
+
+
+async def _run_sessions(aask_for_help, questions: list[str], sessions: int, turns: int,
+                        prefix: str) -> list[float]:
+    """Runs `sessions` conversations at once, each sending `turns` questions in order."""
+    latencies: list[float] = []
+
+    async def session(index: int) -> None:
+        for turn in range(turns):
+            start = time.perf_counter()
+            await aask_for_help(questions[(index * turns + turn) % len(questions)],
+                                session_id=f"{prefix}-{index}", language="English")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return latencies
+
+
+def _mean_observation(histogram) -> float:
+    """The mean of the values observed by an unlabelled histogram."""
+    series = registry.snapshot()[histogram.name]["series"]
+    return series[0]["sum"] / series[0]["count"] if series and series[0]["count"] else 0.0
+
+
+def bench_end_to_end(metrics: dict, corpus_files: int, queries: int, session_levels: list[int],
+                     memory_sessions: int, tool_users: int) -> None:
+    """Serves the largest corpus through the full graph, as the Slack bots do."""
+    from src.graph_builder import retrieve
+    from src.ingester import wait_for_index
+    from src.main import aask_for_help, ask_for_help
+    from src.response_cache import response_cache
+
+    response_cache.enabled = False  # Every message should run the full pipeline
+    start = time.perf_counter()
+    with _quiet():
+        wait_for_index()
+    metrics[f"startup.{corpus_files}_files.index_seconds"] = _metric(time.perf_counter() - start, "s")
+
+    questions = generate_questions(queries * 4)
+    _latency_metrics(metrics, "retrieval", _time_each(
+        lambda question: retrieve({"messages": [HumanMessage(content=question)]}), questions[:queries]))
+
+    CONTEXT_TOKENS.clear()
+    CONTEXT_TOKENS_SAVED.clear()
+    with _quiet():
+        _latency_metrics(metrics, "ask_for_help.question", _time_each(
+            lambda i: ask_for_help(questions[queries + i], session_id=f"bench-question-{i}", language="English"),
+            range(queries)))
+        _latency_metrics(metrics, "ask_for_help.tool_command", _time_each(
+            lambda i: ask_for_help(f"Add vendor 'Bench {i}' to user {i % tool_users}", session_id=f"bench-tool-{i}",
+                                   language="English"),
+            range(queries)))
+    print(f"ask_for_help: question p50 {metrics['ask_for_help.question.p50_ms']['value']:.1f} ms, "
+          f"tool command p50 {metrics['ask_for_help.tool_command.p50_ms']['value']:.1f} ms")
+    metrics["context.tokens_per_question"] = _metric(_mean_observation(CONTEXT_TOKENS), "tokens")
+    metrics["context.tokens_saved_per_question"] = _metric(_mean_observation(CONTEXT_TOKENS_SAVED), "tokens", "higher")
+    print(f"RAG prompt context: {metrics['context.tokens_per_question']['value']:.0f} tokens per question, "
+          f"{metrics['context.tokens_saved_per_question']['value']:.0f} saved")
+
+    for sessions in session_levels:
+        start = time.perf_counter()
+        with _quiet():
+            latencies = asyncio.run(_run_sessions(aask_for_help, questions, sessions, TURNS_PER_SESSION,
+                                                  f"bench-load-{sessions}"))
+        elapsed = time.perf_counter() - start
+        metrics[f"throughput.{sessions}_sessions.messages_per_s"] = _metric(len(latencies) / elapsed,
+                                                                            "messages/s", "higher")
+        _latency_metrics(metrics, f"throughput.{sessions}_sessions.latency", latencies)
+        print(f"Throughput, {sessions} concurrent sessions: {len(latencies) / elapsed:.1f} messages/s")
+
+    # Offline replay of the same number of questions in batches (src/batch.py)
+    from src.batch import ask_for_help_batch
+    replay_dir = Path(tempfile.mkdtemp())
+    with open(replay_dir / "questions.jsonl", "w", encoding="utf-8") as f:
+        for i, question in enumerate(questions[2 * queries:3 * queries]):
+            f.write(json.dumps({"query": question, "session_id": f"bench-replay-{i}", "language": "English"}) + "\n")
+    with _quiet():
+        replay = ask_for_help_batch(replay_dir / "questions.jsonl", replay_dir / "answers.jsonl")
+    metrics["batch_replay.questions_per_s"] = _metric(replay["replayed"] / replay["seconds"], "questions/s", "higher")
+    print(f"Batch replay: {metrics['batch_replay.questions_per_s']['value']:.1f} questions/s")
+
+    # Python memory held after new conversations, per conversation (checkpoints, caches, ...)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    with _quiet():
+        asyncio.run(_run_sessions(aask_for_help, questions, memory_sessions, 1, "bench-memory"))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    metrics["memory.bytes_per_session"] = _metric((after - before) / memory_sessions, "bytes")
+    print(f"Memory growth: {(after - before) / memory_sessions / 1024:.1f} KiB per session")
+
+
+# --- Results ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = REGRESSION_TOLERANCE) -> list[str]:
+    """
+    Prints every metric next to its baseline value.
+
+    Args:
+        baseline: The results of an earlier run.
+        current: The results of this run.
+        tolerance: The relative change, in a metric's worse direction, above which it is a regression.
+
+    Returns:
+        The names of the metrics that regressed.
+    """
+    if baseline.get("run", {}).get("settings") != current["run"]["settings"]:
+        print("Warning: The baseline was run with different settings; the metrics may not be comparable.")
+    regressions = []
+    for name, metric in current["metrics"].items():
+        old = baseline.get("metrics", {}).get(name)
+        if old is None or old["value"] == 0:
+            continue
+        change = (metric["value"] - old["value"]) / old["value"]
+        regressed = change > tolerance if metric["better"] == "lower" else change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<55} {old['value']:>12.4g} -> {metric['value']:>12.4g} {metric['unit']:<10} "
+              f"{change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def run_benchmarks(corpus_sizes: list[int], tool_user_counts: list[int], queries: int, sessions: list[int],
+                   memory_sessions: int, queue_operations: int, llm_latency: float,
+                   embedding_latency: float) -> dict:
+    """
+    Runs every benchmark in a temporary directory, with stub models.
+
+    Returns:
+        The results: the run's settings and environment, and the metrics by name.
+    """
+    settings = {key: value for key, value in locals().items()}
+    install_stub_models(StubChatModel(latency_seconds=llm_latency),
+                        StubEmbeddings(size=256, latency_seconds=embedding_latency))
+    scratch_dir = Path(tempfile.mkdtemp(prefix="chatbot-benchmark-"))
+    corpus_dirs = {files: generate_corpus(scratch_dir / f"corpus_{files}", files) for files in corpus_sizes}
+    served_files = max(corpus_sizes)
+    use_scratch_data(scratch_dir, corpus_dirs[served_files], *write_tool_data(scratch_dir, min(tool_user_counts)))
+
+    metrics: dict[str, dict] = {}
+    bench_ingestion(metrics, corpus_dirs)
+    bench_tool_store(metrics, scratch_dir, tool_user_counts, queries)
+    bench_queue(metrics, scratch_dir, queue_operations)
+    bench_end_to_end(metrics, served_files, queries, sessions, memory_sessions, min(tool_user_counts))
+    metrics["process.peak_rss_mb"] = _metric(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "MB")
+
+    return {
+        "run": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": settings,
+        },
+        "metrics": metrics,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the chatbot with stub models.")
+    parser.add_argument("--quick", action="store_true", help="run a smaller workload")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE, help="the JSON file to write the results to")
+    parser.add_argument("--compare", help="a results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                        help="relative change reported as a regression")
+    parser.add_argument("--llm-latency", type=float, default=LLM_LATENCY_SECONDS, help="seconds per LLM call")
+    parser.add_argument("--embedding-latency", type=float, default=EMBEDDING_LATENCY_SECONDS,
+                        help="seconds per embeddings request")
+    args = parser.parse_args()
+
+    workload = QUICK_SETTINGS if args.quick else {
+        "corpus_sizes": CORPUS_SIZES,
+        "tool_user_counts": TOOL_USER_COUNTS,
+        "queries": QUERIES,
+        "sessions": CONCURRENT_SESSIONS,
+        "memory_sessions": MEMORY_SESSIONS,
+        "queue_operations": QUEUE_OPERATIONS,
+    }
+    results = run_benchmarks(**workload, llm_latency=args.llm_latency, embedding_latency=args.embedding_latency)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), results, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
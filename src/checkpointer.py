@@ -0,0 +1,499 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.types import TASKS
+
+from src.config import (
+    CHECKPOINT_DB_FILE,
+    CHECKPOINTS_PER_THREAD,
+    SESSION_TTL_SECONDS,
+    CHECKPOINT_HOT_SESSIONS,
+    CHECKPOINT_FLUSH_INTERVAL_SECONDS,
+    CHECKPOINT_WRITE_QUEUE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Expired sessions are purged at most this often
+_TTL_SWEEP_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    checkpoint_type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    value_type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+"""
+
+
+@dataclass
+class _Session:
+    """The retained checkpoints of one thread, as stored (serialized)."""
+    # checkpoint_ns -> checkpoint_id -> (checkpoint, metadata, parent checkpoint ID), oldest first
+    checkpoints: dict[str, dict[str, tuple]] = field(default_factory=dict)
+    # (checkpoint_ns, checkpoint_id) -> (task_id, idx) -> (task_id, channel, value, task_path)
+    writes: dict[tuple[str, str], dict[tuple[str, int], tuple]] = field(default_factory=dict)
+    last_access: float = field(default_factory=time.monotonic)
+    unflushed: int = 0  # Queued database operations; the session stays in memory until they are written
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """
+    A LangGraph checkpointer that keeps conversations in a SQLite database (in WAL mode).
+
+    Only the latest `checkpoints_per_thread` checkpoints of each thread are kept, threads that
+    were not updated for `session_ttl_seconds` are deleted, and only the `hot_sessions` most
+    recently used threads are held in memory. Writes are applied to memory at once and queued
+    for a background thread that commits them to the database in batches, so the request path
+    never waits for the disk; at most `flush_interval_seconds` of writes are lost on a crash.
+    """
+
+    def __init__(self, db_file: Path = CHECKPOINT_DB_FILE,
+                 checkpoints_per_thread: int = CHECKPOINTS_PER_THREAD,
+                 session_ttl_seconds: float = SESSION_TTL_SECONDS,
+                 hot_sessions: int = CHECKPOINT_HOT_SESSIONS,
+                 flush_interval_seconds: float = CHECKPOINT_FLUSH_INTERVAL_SECONDS,
+                 write_queue_size: int = CHECKPOINT_WRITE_QUEUE_SIZE):
+        """
+        Args:
+            db_file: The SQLite database file.
+            checkpoints_per_thread: The number of checkpoints kept per thread (and namespace).
+            session_ttl_seconds: Threads idle for longer than this are deleted.
+            hot_sessions: The number of threads kept in memory.
+            flush_interval_seconds: How often queued writes are committed to the database.
+            write_queue_size: The maximum number of queued writes; writers block beyond it.
+        """
+        super().__init__()
+        self.checkpoints_per_thread = max(1, checkpoints_per_thread)
+        self.session_ttl_seconds = session_ttl_seconds
+        self.hot_sessions = hot_sessions
+        self.flush_interval_seconds = flush_interval_seconds
+
+        db_file = Path(db_file)
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._read_connection = self._connect(db_file)
+        self._read_connection.executescript(_SCHEMA)
+        self._write_connection = self._connect(db_file)
+
+        self._lock = threading.RLock()
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()  # Least recently used first
+        self._queue: queue.Queue = queue.Queue(maxsize=write_queue_size)
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="checkpoint-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _connect(db_file: Path) -> sqlite3.Connection:
+        connection = sqlite3.connect(db_file, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # --- In-memory sessions ---
+
+    def _load_session_unlocked(self, thread_id: str) -> _Session:
+        """Returns the session of a thread, loading it from the database if it is not in memory."""
+        session = self._sessions.get(thread_id)
+        if session is None:
+            session = _Session()
+            rows = self._read_connection.execute(
+                "SELECT checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, "
+                "metadata_type, metadata FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id",
+                (thread_id,),
+            )
+            for ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata in rows:
+                session.checkpoints.setdefault(ns, {})[checkpoint_id] = (
+                    (checkpoint_type, checkpoint), (metadata_type, metadata), parent_id
+                )
+            rows = self._read_connection.execute(
+                "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path "
+                "FROM writes WHERE thread_id = ?",
+                (thread_id,),
+            )
+            for ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path in rows:
+                session.writes.setdefault((ns, checkpoint_id), {})[(task_id, idx)] = (
+                    task_id, channel, (value_type, value), task_path
+                )
+            self._sessions[thread_id] = session
+        else:
+            self._sessions.move_to_end(thread_id)
+        session.last_access = time.monotonic()
+        self._evict_unlocked()
+        return session
+
+    def _evict_unlocked(self) -> None:
+        """
+        Drops the least recently used sessions beyond the limit, except the most recent one
+        and those with unwritten changes.
+        """
+        excess = len(self._sessions) - self.hot_sessions
+        if excess <= 0:
+            return
+        for thread_id in list(self._sessions)[:-1]:
+            if excess <= 0:
+                break
+            if self._sessions[thread_id].unflushed == 0:
+                del self._sessions[thread_id]
+                excess -= 1
+
+    def _enqueue(self, session: _Session, operation: tuple) -> None:
+        """
+        Queues a database operation. The caller counts it in `session.unflushed` while holding the
+        lock and calls this after releasing it, since a full queue blocks until the writer catches up.
+        """
+        self._queue.put((session, operation))
+
+    # --- Reads ---
+
+    def _tuple_unlocked(self, session: _Session, thread_id: str, ns: str, checkpoint_id: str) -> CheckpointTuple:
+        checkpoint, metadata, parent_id = session.checkpoints[ns][checkpoint_id]
+        writes = session.writes.get((ns, checkpoint_id), {}).values()
+        sends = []
+        if parent_id:
+            sends = sorted(
+                ((*write, key[1]) for key, write in session.writes.get((ns, parent_id), {}).items()
+                 if write[1] == TASKS),
+                key=lambda write: (write[3], write[0], write[4]),
+            )
+        checkpoint_ = self.serde.loads_typed(checkpoint)
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint_, "pending_sends": [self.serde.loads_typed(send[2]) for send in sends]},
+            metadata=self.serde.loads_typed(metadata),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(value)) for task_id, channel, value, _ in writes],
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            session = self._load_session_unlocked(thread_id)
+            checkpoints = session.checkpoints.get(ns)
+            if not checkpoints:
+                return None
+            checkpoint_id = get_checkpoint_id(config) or max(checkpoints)
+            if checkpoint_id not in checkpoints:
+                return None
+            return self._tuple_unlocked(session, thread_id, ns, checkpoint_id)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        if config:
+            thread_ids = [config["configurable"]["thread_id"]]
+        else:
+            with self._lock:
+                thread_ids = set(self._sessions)
+                thread_ids.update(row[0] for row in self._read_connection.execute("SELECT thread_id FROM threads"))
+        config_ns = config["configurable"].get("checkpoint_ns") if config else None
+        config_checkpoint_id = get_checkpoint_id(config) if config else None
+        before_checkpoint_id = get_checkpoint_id(before) if before else None
+
+        results = []
+        with self._lock:
+            for thread_id in thread_ids:
+                session = self._load_session_unlocked(thread_id)
+                for ns, checkpoints in session.checkpoints.items():
+                    if config_ns is not None and ns != config_ns:
+                        continue
+                    for checkpoint_id in sorted(checkpoints, reverse=True):
+                        if config_checkpoint_id and checkpoint_id != config_checkpoint_id:
+                            continue
+                        if before_checkpoint_id and checkpoint_id >= before_checkpoint_id:
+                            continue
+                        checkpoint_tuple = self._tuple_unlocked(session, thread_id, ns, checkpoint_id)
+                        if filter and not all(checkpoint_tuple.metadata.get(key) == value
+                                              for key, value in filter.items()):
+                            continue
+                        results.append(checkpoint_tuple)
+                        if limit is not None and len(results) >= limit:
+                            break
+        yield from results
+
+    # --- Writes ---
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+        stored = checkpoint.copy()
+        stored.pop("pending_sends", None)
+        checkpoint_typed = self.serde.dumps_typed(stored)
+        metadata_typed = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self._lock:
+            session = self._load_session_unlocked(thread_id)
+            checkpoints = session.checkpoints.setdefault(ns, {})
+            checkpoints[checkpoint["id"]] = (checkpoint_typed, metadata_typed, parent_id)
+            # Keep only the latest checkpoints (and the writes that belong to them)
+            while len(checkpoints) > self.checkpoints_per_thread:
+                oldest = min(checkpoints)
+                del checkpoints[oldest]
+                session.writes.pop((ns, oldest), None)
+            session.unflushed += 1
+        self._enqueue(session, ("checkpoint", thread_id, ns, checkpoint["id"], parent_id,
+                                checkpoint_typed, metadata_typed))
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            session = self._load_session_unlocked(thread_id)
+            stored = session.writes.setdefault((ns, checkpoint_id), {})
+            rows = []
+            for idx, (channel, value) in enumerate(writes):
+                key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                if key[1] >= 0 and key in stored:
+                    continue
+                stored[key] = (task_id, channel, self.serde.dumps_typed(value), task_path)
+                rows.append((key[1], *stored[key]))
+            if not rows:
+                return
+            session.unflushed += 1
+        self._enqueue(session, ("writes", thread_id, ns, checkpoint_id, rows))
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            # An empty session shadows the database rows until the deletion is written
+            session = self._sessions[thread_id] = _Session()
+            session.unflushed += 1
+        self._enqueue(session, ("delete", thread_id))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.delete_thread(thread_id)
+
+    # --- Background writer ---
+
+    def _apply(self, operation: tuple, now: float, touched: set) -> None:
+        connection = self._write_connection
+        kind, thread_id = operation[0], operation[1]
+        if kind == "checkpoint":
+            _, _, ns, checkpoint_id, parent_id, (checkpoint_type, checkpoint), (metadata_type, metadata) = operation
+            connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata),
+            )
+            touched.add((thread_id, ns))
+        elif kind == "writes":
+            _, _, ns, checkpoint_id, rows = operation
+            connection.executemany(
+                "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(thread_id, ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path)
+                 for idx, task_id, channel, (value_type, value), task_path in rows],
+            )
+        elif kind == "delete":
+            for table in ("checkpoints", "writes", "threads"):
+                connection.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            return
+        connection.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, now))
+
+    def _prune(self, touched: set) -> None:
+        """Deletes all but the latest checkpoints (and their writes) of the updated threads."""
+        connection = self._write_connection
+        for thread_id, ns in touched:
+            connection.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, ns, thread_id, ns, self.checkpoints_per_thread),
+            )
+            connection.execute(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < "
+                "(SELECT MIN(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                (thread_id, ns, thread_id, ns),
+            )
+
+    def _expire(self) -> None:
+        """Deletes the threads that were idle for longer than the TTL, from memory and the database."""
+        cutoff = time.time() - self.session_ttl_seconds
+        connection = self._write_connection
+        with connection:
+            for table in ("checkpoints", "writes"):
+                connection.execute(
+                    f"DELETE FROM {table} WHERE thread_id IN (SELECT thread_id FROM threads WHERE updated_at < ?)",
+                    (cutoff,),
+                )
+            connection.execute("DELETE FROM threads WHERE updated_at < ?", (cutoff,))
+
+        idle_since = time.monotonic() - self.session_ttl_seconds
+        with self._lock:
+            for thread_id, session in list(self._sessions.items()):
+                if session.last_access < idle_since and session.unflushed == 0:
+                    del self._sessions[thread_id]
+
+    def _write_loop(self) -> None:
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval_seconds)]
+            except queue.Empty:
+                batch = []
+            if batch and batch[0] is None:
+                return
+            # Gather everything queued meanwhile into the same transaction
+            time.sleep(self.flush_interval_seconds if batch else 0)
+            stop = False
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            if batch:
+                now, touched = time.time(), set()
+                try:
+                    with self._write_connection:
+                        for _, operation in batch:
+                            self._apply(operation, now, touched)
+                        self._prune(touched)
+                except sqlite3.Error as e:
+                    logger.warning("Could not write %d checkpoint operations (%s).", len(batch), e)
+                with self._lock:
+                    for session, _ in batch:
+                        session.unflushed -= 1
+                    self._evict_unlocked()
+
+            if stop:
+                return
+            if time.monotonic() - last_sweep >= _TTL_SWEEP_INTERVAL_SECONDS:
+                last_sweep = time.monotonic()
+                try:
+                    self._expire()
+                except sqlite3.Error as e:
+                    logger.warning("Could not delete expired sessions (%s).", e)
+
+    def flush(self) -> None:
+        """Waits until every queued write is committed to the database."""
+        while True:
+            with self._lock:
+                if not any(session.unflushed for session in self._sessions.values()) and self._queue.empty():
+                    return
+            time.sleep(self.flush_interval_seconds / 4)
+
+    def close(self) -> None:
+        """Commits the queued writes and stops the background writer."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+
+# --- Memory use while replaying many messages from synthetic users ---
+if __name__ == "__main__":
+    # Usage: python -m src.checkpointer [messages] [--memory-saver]
+    import random
+    import sys
+    import tempfile
+    from typing import Annotated, TypedDict
+
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import StateGraph, add_messages
+
+    def rss_mb() -> float:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096 / 2 ** 20
+
+    class ChatState(TypedDict):
+        messages: Annotated[list, add_messages]
+
+    def echo(state: ChatState) -> dict:
+        return {"messages": [AIMessage(content=f"Answer to: {state['messages'][-1].content}")]}
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    total_messages = int(args[0]) if args else 1_000_000
+    if "--memory-saver" in sys.argv:
+        saver = MemorySaver()
+    else:
+        saver = SQLiteCheckpointSaver(Path(tempfile.mkdtemp()) / "checkpoints.sqlite")
+
+    builder = StateGraph(ChatState)
+    builder.add_node("echo", echo)
+    builder.set_entry_point("echo")
+    builder.set_finish_point("echo")
+    graph = builder.compile(checkpointer=saver)
+
+    rng = random.Random(0)
+    report_every = max(1, total_messages // 10)
+    start = time.perf_counter()
+    print(f"{type(saver).__name__}: start RSS {rss_mb():.0f} MB")
+    for n in range(1, total_messages + 1):
+        # Most messages come from a few thousand active users, the rest from a long tail
+        user = rng.randrange(2_000) if rng.random() < 0.8 else rng.randrange(1_000_000)
+        graph.invoke({"messages": [HumanMessage(content=f"question {n} " + "x" * 200)]},
+                     config={"configurable": {"thread_id": f"user-{user}"}})
+        if n % report_every == 0:
+            print(f"{n:>9} messages: RSS {rss_mb():.0f} MB, {n / (time.perf_counter() - start):.0f} messages/s")
@@ -1,14 +1,37 @@
+import threading
 from pathlib import Path
 
 from dotenv import load_dotenv
-from langchain.chat_models import init_chat_model
-from langchain_openai import OpenAIEmbeddings
 
 load_dotenv()
 
-# LLM and Embeddings models
-LLM = init_chat_model("gpt-4o-mini", model_provider="openai")
-EMBEDDINGS_MODEL = OpenAIEmbeddings(model="text-embedding-3-large")
+# LLM and Embeddings models, created on first use (see get_llm() and get_embeddings()), so that importing
+# the chatbot needs no API key. Setting LLM or EMBEDDINGS_MODEL first swaps in other models, e.g. stubs.
+LLM_MODEL_NAME = "gpt-4o-mini"
+EMBEDDINGS_MODEL_NAME = "text-embedding-3-large"
+LLM = None
+EMBEDDINGS_MODEL = None
+_models_lock = threading.Lock()
+
+
+def get_llm():
+    """Returns the chat model, creating it on first use."""
+    global LLM
+    with _models_lock:
+        if LLM is None:
+            from langchain.chat_models import init_chat_model
+            LLM = init_chat_model(LLM_MODEL_NAME, model_provider="openai", stream_usage=True)  # Token usage also when streaming
+        return LLM
+
+
+def get_embeddings():
+    """Returns the embeddings model, creating it on first use."""
+    global EMBEDDINGS_MODEL
+    with _models_lock:
+        if EMBEDDINGS_MODEL is None:
+            from langchain_openai import OpenAIEmbeddings
+            EMBEDDINGS_MODEL = OpenAIEmbeddings(model=EMBEDDINGS_MODEL_NAME)
+        return EMBEDDINGS_MODEL
 
 
 project_dir = './'
@@ -18,6 +41,107 @@ project_dir = './'
 PDF_DATA_PATH = project_dir + "Data/Rag/"
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+# Number of worker processes that parse and split PDFs in parallel (1 = serial, 0 = one per CPU)
+INGEST_WORKERS = 4
+
+# Persistent embedding cache (chunk embeddings keyed by text, model and chunking settings)
+EMBEDDINGS_CACHE_FILE = Path(project_dir + "Data/DB/embeddings_cache.sqlite")
+
+# Embedding pipeline: token-budgeted batches, embedded a few at a time with retries
+EMBEDDING_BATCH_MAX_TOKENS = 100_000
+EMBEDDING_BATCH_MAX_SIZE = 1000
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 5
+EMBEDDING_RETRY_BACKOFF_SECONDS = 1.0
+
+# Optional approximate nearest-neighbour (IVF) index for large corpora.
+# The trained index is saved next to the PDFs and loaded at startup instead of being rebuilt.
+ANN_INDEX_ENABLED = False
+ANN_INDEX_FILE = Path(PDF_DATA_PATH + ".ann_index.npz")
+ANN_MIN_VECTORS = 50_000  # Smaller corpora are searched exactly
+ANN_NPROBE = 16  # Clusters searched per query: higher means better recall but slower queries
+
+# Hybrid retrieval: BM25 over a local inverted index fused with vector search (reciprocal-rank fusion)
+HYBRID_SEARCH_ENABLED = True
+LEXICAL_INDEX_FILE = Path(PDF_DATA_PATH + ".lexical_index.pkl")
+RETRIEVAL_K = 4  # Documents passed to the LLM
+RETRIEVAL_CANDIDATES = 20  # Candidates taken from each of the two searches before fusion
+RRF_K = 60
+
+# Context assembly: the RETRIEVAL_K documents are picked among the best CONTEXT_CANDIDATES by maximal
+# marginal relevance (MMR_LAMBDA = 1 ranks by relevance alone, lower values favour diverse chunks).
+# Neighbouring chunks of the same file are merged without their overlapping text, and the context is
+# packed into what the trimmed chat history leaves of PROMPT_TOKEN_BUDGET (but at least CONTEXT_MIN_TOKENS)
+CONTEXT_ASSEMBLY_ENABLED = True
+CONTEXT_CANDIDATES = 12
+MMR_LAMBDA = 0.7
+PROMPT_TOKEN_BUDGET = 5000
+CONTEXT_MIN_TOKENS = 1000
+
+# Semantic response cache in front of the RAG generate node
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = 0.95  # Minimum cosine similarity between two questions
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_TTL_SECONDS = 3600
+RESPONSE_CACHE_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Local router: keyword/regex and embedding-similarity signals decide most messages without an LLM call
+LOCAL_ROUTER_ENABLED = True
+ROUTER_EMBEDDING_MARGIN = 0.05  # Minimum similarity gap between tool and retrieve examples to decide locally
+
+# Batch replays of historical questions (see src/batch.py): rows handled per batch (their query embeddings
+# are memoized together, so at most 1024) and LLM calls in flight at once
+BATCH_SIZE = 256
+BATCH_MAX_CONCURRENCY = 8
+
+# Tool agent: common tool commands ("add vendor X to user N", "update user N's email to ...") are parsed
+# locally and run without the agent's LLM calls; other tool requests go to the agent
+TOOL_FAST_PATH_ENABLED = True
+AGENT_VERBOSE = False  # Log every step of the tool-calling agent
+
+# Speculative retrieval: start retrieval at the same time as routing instead of after it.
+# The retrieved context is discarded when the message is routed to the tool agent.
+SPECULATIVE_RETRIEVAL_ENABLED = False
+NODE_TIMINGS_WINDOW = 1000  # Most recent durations kept per graph node for node_timing_summary()
+
+# Metrics (see src/metrics.py): served in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics
+# and written as JSON to METRICS_DUMP_FILE every METRICS_DUMP_INTERVAL_SECONDS; 0 disables either one
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_DUMP_FILE = Path(project_dir + "Data/DB/metrics.json")
+METRICS_DUMP_INTERVAL_SECONDS = 60
+
+# Logging: records below LOG_LEVEL are dropped, and of the per-message records (e.g. every Slack
+# message received) only LOG_SAMPLE_RATE are kept; warnings and errors are always logged
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s"
+LOG_SAMPLE_RATE = 0.1
+
+# Slack event dispatcher: sessions run in parallel, each session's messages in order
+DISPATCHER_WORKERS = 8  # Sessions processed at once
+DISPATCHER_MAX_PENDING = 500  # Messages waiting across all sessions before new ones are rejected
+DISPATCHER_MAX_PENDING_PER_SESSION = 5  # Messages waiting per session before new ones are rejected
+DISPATCHER_COALESCE_SECONDS = 0.5  # Follow-ups sent during a turn, and within this window of each other, are answered in one turn
+
+# Streaming answers to Slack: a placeholder message is posted and edited as tokens arrive
+SLACK_STREAMING_ENABLED = False
+SLACK_STREAM_UPDATE_INTERVAL_SECONDS = 1.0  # Minimum time between two edits of the same message (Slack rate limits)
+
+# Conversation checkpoints: persisted to SQLite (False keeps them in process memory, without limits)
+PERSISTENT_CHECKPOINTS_ENABLED = True
+CHECKPOINT_DB_FILE = Path(project_dir + "Data/DB/checkpoints.sqlite")
+CHECKPOINTS_PER_THREAD = 3  # Latest checkpoints kept per conversation
+SESSION_TTL_SECONDS = 7 * 24 * 3600  # Conversations idle for longer than this are deleted
+CHECKPOINT_HOT_SESSIONS = 256  # Conversations kept in memory
+CHECKPOINT_FLUSH_INTERVAL_SECONDS = 0.5  # Checkpoint writes are committed in batches this often
+CHECKPOINT_WRITE_QUEUE_SIZE = 10_000
+
+# The documents are indexed in the background after startup; until then, questions wait up to this
+# many seconds for the index and then get a "warming up" reply (tool requests are answered meanwhile)
+INDEX_WAIT_SECONDS = 10
+
+# Interval (in seconds) between background incremental syncs of PDF_DATA_PATH; 0 disables them
+REINDEX_INTERVAL_SECONDS = 300
 
 # Trimmer settings (for chat history management)
 MAX_TOKENS_TRIMMER = 2000
@@ -25,11 +149,23 @@ TRIMMER_STRATEGY = "last"
 TRIMMER_INCLUDE_SYSTEM = True
 TRIMMER_ALLOW_PARTIAL = False
 TRIMMER_START_ON = "human"
+TRIMMER_ENCODING = "o200k_base"  # Local tokenizer used to count message tokens (gpt-4o family)
 
 # Path data files for tools
 USER_VENDORS_FILE = Path(project_dir + "Data/DB/users_vendors.json")
 USERS_DATA_FILE = Path(project_dir + "Data/DB/users_data.json")
+# The tools' data is kept in SQLite; the JSON files above are imported once into a new database
+TOOLS_DB_FILE = Path(project_dir + "Data/DB/tools_data.sqlite")
+TOOLS_STORE_MAX_BATCH = 256  # Maximum tool writes committed together in one transaction
+
 
+# Human service queue. "sqlite" keeps it in QUEUE_DB_FILE, shared by every bot process; "file" keeps it
+# in process memory, persisted to QUEUE_FILE and QUEUE_LOG_FILE (a single bot process only)
+QUEUE_BACKEND = "sqlite"
+QUEUE_DB_FILE = project_dir + "Data/DB/global_service_queue.sqlite"
+QUEUE_POLL_INTERVAL_SECONDS = 0.2  # How often agents waiting for a user check for users added by other processes
 
-# Path for human service queue
+# Path for human service queue (file backend; imported once into a new SQLite queue)
 QUEUE_FILE = project_dir + "Data/DB/global_service_queue.json"
+QUEUE_LOG_FILE = project_dir + "Data/DB/global_service_queue.log"  # Enqueues/dequeues since the last snapshot
+QUEUE_COMPACTION_THRESHOLD = 10_000  # Log records after which the snapshot is rewritten and the log emptied
@@ -0,0 +1,193 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.config import CHUNK_OVERLAP, TRIMMER_ENCODING
+from src.utils import count_tokens
+
+# Separator between two passages of the context
+_PASSAGE_SEPARATOR = "\n\n"
+# Separator between two neighbouring chunks that do not overlap (e.g. the last chunk of a page and the first of the next)
+_CHUNK_SEPARATOR = "\n"
+# A shorter match between the end of a chunk and the start of the next one is taken as coincidence, not overlap
+_MIN_OVERLAP_CHARS = 20
+
+
+def maximal_marginal_relevance(query_embedding: Sequence[float], embeddings: np.ndarray,
+                               k: int, lambda_mult: float, ranked: bool = False) -> list[int]:
+    """
+    Picks k embeddings that are relevant to the query but not to each other: each step takes the
+    candidate with the best lambda_mult * (relevance) - (1 - lambda_mult) * (highest similarity to
+    an already picked candidate).
+
+    Args:
+        query_embedding: The query embedding.
+        embeddings: The unit-length candidate embeddings, one per row.
+        k: The number of candidates to pick.
+        lambda_mult: The weight of relevance against diversity, between 0 and 1.
+        ranked: Whether the rows are already ranked best first, e.g. by hybrid search. If so, the
+            relevance follows that ranking: the n-th row gets the n-th highest similarity to the query,
+            which keeps the relevance on the scale of the similarities between candidates.
+            Otherwise the relevance of a row is its similarity to the query.
+
+    Returns:
+        The row indices of the picked candidates, in the order they were picked.
+    """
+    if not len(embeddings) or k <= 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm > 0:
+        query = query / norm
+
+    relevance = embeddings @ query
+    if ranked:
+        relevance = np.sort(relevance)[::-1]
+    similarity = embeddings @ embeddings.T
+    redundancy = np.zeros(len(embeddings), dtype=np.float32)
+    picked = []
+    for _ in range(min(k, len(embeddings))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[picked] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+def _chunk_position(document: Document) -> Optional[tuple[str, int]]:
+    """The file and position of a chunk, from its vector store ID ("<source>#<index>", see ingester._chunk_ids)."""
+    source, _, index = (document.id or "").rpartition("#")
+    if not source or not index.isdigit():
+        return None
+    return source, int(index)
+
+
+def _overlap_length(previous: str, following: str) -> int:
+    """The length of the text the splitter repeated from the end of `previous` at the start of `following`."""
+    for length in range(min(len(previous), len(following), CHUNK_OVERLAP), _MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent_chunks(documents: Sequence[Document]) -> list[tuple[str, int]]:
+    """
+    Merges chunks that are next to each other in the same file into one passage, keeping the
+    text the splitter repeated between them (CHUNK_OVERLAP) only once.
+
+    Args:
+        documents: The chunks, best first.
+
+    Returns:
+        A (text, number of chunks) tuple per passage, ordered by the best chunk of each passage.
+    """
+    runs: list[list[int]] = []
+    positions = {}
+    for rank, document in enumerate(documents):
+        position = _chunk_position(document)
+        if position is None:
+            runs.append([rank])
+        elif position not in positions:
+            positions[position] = rank
+
+    previous = None
+    for position in sorted(positions):
+        source, index = position
+        if previous is not None and previous == (source, index - 1):
+            runs[-1].append(positions[position])
+        else:
+            runs.append([positions[position]])
+        previous = position
+
+    passages = []
+    for run in sorted(runs, key=min):
+        text = documents[run[0]].page_content
+        for rank in run[1:]:
+            following = documents[rank].page_content
+            overlap = _overlap_length(text, following)
+            text += following[overlap:] if overlap else _CHUNK_SEPARATOR + following
+        passages.append((text, len(run)))
+    return passages
+
+
+@dataclass
+class AssembledContext:
+    text: str
+    tokens: int  # Tokens of the text
+    raw_tokens: int  # Tokens of all the chunks joined as they are, before merging and packing
+    chunks: int  # Chunks included in the text
+    dropped_chunks: int  # Chunks left out because they did not fit in the token budget
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.raw_tokens - self.tokens
+
+
+def assemble_context(documents: Sequence[Document], max_tokens: int) -> AssembledContext:
+    """
+    Builds the context of the RAG prompt from the retrieved chunks: the chunks are kept best first
+    as long as they fit in `max_tokens` (a chunk that does not fit is skipped, so a smaller one after
+    it may still be kept), then neighbouring chunks are merged (see merge_adjacent_chunks()).
+
+    Args:
+        documents: The retrieved chunks, best first.
+        max_tokens: The token budget of the context.
+
+    Returns:
+        The context text with its token counts.
+    """
+    separator_tokens = count_tokens(_PASSAGE_SEPARATOR, TRIMMER_ENCODING)
+    kept, used = [], 0
+    raw_tokens = 0
+    for document in documents:
+        cost = count_tokens(document.page_content, TRIMMER_ENCODING) + (separator_tokens if raw_tokens else 0)
+        raw_tokens += cost
+        # Overlapping text is still counted here, so the merged context is never over budget
+        if used + cost <= max_tokens:
+            kept.append(document)
+            used += cost
+
+    # The same text can also come from a copy of a file
+    passages = list(dict.fromkeys(text for text, _ in merge_adjacent_chunks(kept)))
+    text = _PASSAGE_SEPARATOR.join(passages)
+    return AssembledContext(text, count_tokens(text, TRIMMER_ENCODING) if text else 0, raw_tokens,
+                            len(kept), len(documents) - len(kept))
+
+
+# --- Prompt context for overlapping chunks: joined as they are vs assembled ---
+if __name__ == "__main__":
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from src.config import CHUNK_SIZE
+
+    words = [f"term{i % 37}" for i in range(2000)]
+    page = " ".join(words[i] + ("." if i % 12 == 11 else "") for i in range(len(words)))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks = [Document(id=f"manual.pdf#{index}", page_content=text)
+              for index, text in enumerate(splitter.split_text(page))]
+
+    # Three neighbouring chunks (as hits usually are) and one from elsewhere in the file
+    hits = [chunks[4], chunks[5], chunks[3], chunks[10]]
+    for budget in (5000, 600):
+        context = assemble_context(hits, budget)
+        print(f"budget {budget}: {context.raw_tokens} tokens as-is, {context.tokens} assembled "
+              f"({context.saved_tokens} saved), {context.chunks} chunks included, {context.dropped_chunks} dropped")
+    merged, merged_count = merge_adjacent_chunks(hits)[0]
+    print(f"{merged_count} merged chunks equal the original text: {merged in page}")
+
+    # Two candidates are near-copies of each other; the others cover other aspects of the question
+    rng = np.random.default_rng(0)
+    query = rng.normal(size=256)
+    aspects = [query + rng.normal(scale=1.4 + 0.1 * i, size=256) for i in range(4)]
+    candidates = np.stack([aspects[0], aspects[0] + rng.normal(scale=0.1, size=256)] + aspects[1:])
+    candidates /= np.linalg.norm(candidates, axis=1, keepdims=True)
+    print(f"Top 3 of 5 candidates (0 and 1 near-copies): by relevance {maximal_marginal_relevance(query, candidates, 3, 1.0)}, "
+          f"by MMR {maximal_marginal_relevance(query, candidates, 3, 0.7)}")
+    # A hybrid search ranked the candidate least similar to the query first (e.g. an exact keyword match): it stays first
+    least_similar = int(np.argmin(candidates @ query))
+    fused_order = [least_similar] + [i for i in range(len(candidates)) if i != least_similar]
+    picked = maximal_marginal_relevance(query, candidates[fused_order], 3, 0.7, ranked=True)
+    print(f"Same candidates in fused order {fused_order}: by MMR {[fused_order[i] for i in picked]}")
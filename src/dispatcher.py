@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from src.config import (
+    DISPATCHER_WORKERS,
+    DISPATCHER_MAX_PENDING,
+    DISPATCHER_MAX_PENDING_PER_SESSION,
+    DISPATCHER_COALESCE_SECONDS,
+    NODE_TIMINGS_WINDOW,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _PendingMessage:
+    text: str
+    reply: Callable[[str], None]
+    enqueued_at: float
+    stream: Any = None
+    on_error: Optional[Callable[[Exception], None]] = None
+
+
+@dataclass
+class _Session:
+    pending: deque = field(default_factory=deque)
+    scheduled: bool = False  # Waiting in the ready heap or being processed by a worker
+
+
+class SessionDispatcher:
+    """
+    Runs chatbot turns on a bounded pool of worker threads.
+
+    Different sessions are processed in parallel, but each session's messages are processed
+    strictly in order, one turn at a time, so two turns never run against the same
+    conversation checkpoint at once. A message to an idle session starts its turn right away.
+    Messages a user sends while their previous turn is still running (or within
+    `coalesce_seconds` after the last of them) are merged into a single turn, and only the last
+    one gets the reply (and its stream, if any), or its on_error callback if the turn fails.
+
+    Both the total number of pending messages and the number per session are bounded;
+    submit() rejects messages beyond those limits instead of queueing them without end.
+    """
+
+    def __init__(self, handler: Callable[[str, str], str],
+                 workers: int = DISPATCHER_WORKERS,
+                 max_pending: int = DISPATCHER_MAX_PENDING,
+                 max_pending_per_session: int = DISPATCHER_MAX_PENDING_PER_SESSION,
+                 coalesce_seconds: float = DISPATCHER_COALESCE_SECONDS,
+                 metrics_window: int = NODE_TIMINGS_WINDOW):
+        """
+        Args:
+            handler: Called as handler(text, session_id) for every turn, or as
+                handler(text, session_id, stream=...) when the message was submitted with a stream;
+                returns the reply text.
+            workers: The number of worker threads, i.e. of sessions processed at once.
+            max_pending: The maximum number of messages waiting across all sessions.
+            max_pending_per_session: The maximum number of messages waiting per session.
+            coalesce_seconds: How long a session whose messages arrived during its previous turn waits
+                for more follow-up messages before its next turn starts.
+            metrics_window: The number of recent queue wait and service times kept for stats().
+        """
+        self.handler = handler
+        self.max_pending = max_pending
+        self.max_pending_per_session = max_pending_per_session
+        self.coalesce_seconds = coalesce_seconds
+
+        self._condition = threading.Condition()
+        self._sessions: dict[str, _Session] = {}
+        self._ready: list[tuple[float, int, str]] = []  # (start not before, sequence, session ID)
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._stopping = False
+
+        self.submitted = 0
+        self.turns = 0
+        self.coalesced = 0
+        self.dropped_global = 0
+        self.dropped_session = 0
+        self.failures = 0
+        self._wait_times: deque = deque(maxlen=metrics_window)
+        self._service_times: deque = deque(maxlen=metrics_window)
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f"session-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, session_id: str, text: str, reply: Callable[[str], None], stream: Any = None,
+               on_error: Optional[Callable[[Exception], None]] = None) -> bool:
+        """
+        Queues a message for its session.
+
+        Args:
+            session_id: The conversation the message belongs to.
+            text: The message text.
+            reply: Called with the reply text once the message's turn is done.
+            stream: An optional object passed on to the handler, e.g. to stream the reply while
+                    it is generated.
+            on_error: Called with the exception if the message's turn fails, e.g. to tell the user
+                      instead of leaving them without an answer.
+
+        Returns:
+            True if the message was queued, False if it was rejected because a queue is full.
+        """
+        now = time.monotonic()
+        with self._condition:
+            if self._stopping:
+                return False
+            if self._pending >= self.max_pending:
+                self.dropped_global += 1
+                return False
+            session = self._sessions.setdefault(session_id, _Session())
+            if len(session.pending) >= self.max_pending_per_session:
+                self.dropped_session += 1
+                return False
+
+            session.pending.append(_PendingMessage(text, reply, now, stream, on_error))
+            self._pending += 1
+            self.submitted += 1
+            if not session.scheduled:
+                session.scheduled = True
+                # Nothing to merge with: the turn starts as soon as a worker is free
+                heapq.heappush(self._ready, (now, next(self._sequence), session_id))
+                self._condition.notify()
+            return True
+
+    def _next_batch(self) -> Optional[tuple[str, list[_PendingMessage]]]:
+        """Waits for a session that is due and takes all of its pending messages."""
+        with self._condition:
+            while True:
+                if self._stopping and not self._ready:
+                    return None
+                if self._ready:
+                    ready_at, _, session_id = self._ready[0]
+                    delay = ready_at - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self._ready)
+                        session = self._sessions[session_id]
+                        batch = list(session.pending)
+                        session.pending.clear()
+                        self._pending -= len(batch)
+                        return session_id, batch
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+    def _finish(self, session_id: str) -> None:
+        """Reschedules the session if messages arrived during its turn, otherwise forgets it."""
+        with self._condition:
+            session = self._sessions[session_id]
+            if session.pending:
+                # These arrived while the previous turn ran; more may follow while the user is still typing
+                ready_at = max(time.monotonic(), session.pending[-1].enqueued_at + self.coalesce_seconds)
+                heapq.heappush(self._ready, (ready_at, next(self._sequence), session_id))
+                self._condition.notify()
+            else:
+                session.scheduled = False
+                del self._sessions[session_id]
+
+    def _work(self) -> None:
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            session_id, batch = next_batch
+
+            start = time.monotonic()
+            try:
+                text = "\n".join(message.text for message in batch)
+                if batch[-1].stream is not None:
+                    response = self.handler(text, session_id, stream=batch[-1].stream)
+                else:
+                    response = self.handler(text, session_id)
+                batch[-1].reply(response)
+            except Exception as e:
+                logger.exception("Turn for session '%s' failed: %s", session_id, e)
+                with self._condition:
+                    self.failures += 1
+                if batch[-1].on_error is not None:
+                    try:
+                        batch[-1].on_error(e)
+                    except Exception:
+                        logger.exception("Error callback for session '%s' failed.", session_id)
+            finally:
+                service_time = time.monotonic() - start
+                with self._condition:
+                    self.turns += 1
+                    self.coalesced += len(batch) - 1
+                    self._wait_times.extend(start - message.enqueued_at for message in batch)
+                    self._service_times.append(service_time)
+                self._finish(session_id)
+
+    def stats(self) -> dict:
+        """Returns the message counters, queue depth, and p50/p95 queue wait and service times in seconds."""
+        with self._condition:
+            wait_times, service_times = list(self._wait_times), list(self._service_times)
+            stats = {
+                "submitted": self.submitted,
+                "turns": self.turns,
+                "coalesced": self.coalesced,
+                "dropped_global": self.dropped_global,
+                "dropped_session": self.dropped_session,
+                "failures": self.failures,
+                "pending": self._pending,
+                "active_sessions": len(self._sessions),
+            }
+        for name, values in (("queue_wait", wait_times), ("service_time", service_times)):
+            stats[f"{name}_p50"] = float(np.percentile(values, 50)) if values else 0.0
+            stats[f"{name}_p95"] = float(np.percentile(values, 95)) if values else 0.0
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops accepting messages; the workers exit once the queued sessions are processed."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+# --- Ordering, coalescing and backpressure with a stub handler ---
+if __name__ == "__main__":
+    import random
+
+    handled: dict[str, list[str]] = {}
+
+    def stub_handler(text: str, session_id: str) -> str:
+        time.sleep(random.uniform(0.05, 0.2))  # A graph turn
+        if session_id == "user-7":
+            raise TimeoutError("stub LLM timed out")
+        handled.setdefault(session_id, []).extend(text.split("\n"))
+        return f"reply to {text!r}"
+
+    dispatcher = SessionDispatcher(stub_handler, workers=4, max_pending=50,
+                                   max_pending_per_session=5, coalesce_seconds=0.1)
+    replies, errors = [], []
+    for i in range(40):
+        session_id = f"user-{i % 8}"
+        if not dispatcher.submit(session_id, f"{session_id} message {i // 8}", replies.append, on_error=errors.append):
+            print(f"Rejected {session_id} message {i // 8}")
+        time.sleep(random.uniform(0, 0.02))
+    # A burst from one user beyond the per-session limit is rejected
+    rejected = sum(not dispatcher.submit("user-0", f"user-0 message {n}", replies.append) for n in range(5, 15))
+    print(f"Burst of 10 messages from user-0: {rejected} rejected")
+    dispatcher.shutdown()
+
+    in_order = all(messages == sorted(messages, key=lambda m: int(m.rsplit(" ", 1)[1]))
+                   for messages in handled.values())
+    print(f"Per-session order kept: {in_order}, replies sent: {len(replies)}, "
+          f"failed turns reported to user-7: {len(errors)}")
+    print(dispatcher.stats())
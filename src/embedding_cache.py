@@ -0,0 +1,208 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from pathlib import Path
+
+from langchain_core.embeddings import Embeddings
+
+from src.config import CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDINGS_CACHE_FILE, EMBEDDINGS_MODEL_NAME
+from src.embedding_pipeline import PartialEmbeddingError
+
+# SQLite limits the number of bound parameters per statement, so lookups are chunked
+_LOOKUP_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    A content-addressed, on-disk store of chunk embeddings backed by SQLite.
+
+    Each vector is keyed by a hash of the chunk text together with the embedding model
+    name and the chunking settings, so changing any of them never returns a stale vector.
+    """
+
+    def __init__(self, cache_file: Path, model_name: str,
+                 chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        self.cache_file = Path(cache_file)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._namespace = f"{model_name}\x00{chunk_size}\x00{chunk_overlap}\x00"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.cache_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def key_for(self, text: str) -> str:
+        """
+        Returns the cache key of a chunk text under the current model and chunking settings.
+        """
+        return hashlib.sha256((self._namespace + text).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """
+        Looks up several keys at once.
+
+        Args:
+            keys: The cache keys to look up.
+
+        Returns:
+            A dictionary mapping every key found in the cache to its vector.
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        """
+        Stores several vectors in a single transaction.
+
+        Args:
+            items: A dictionary mapping cache keys to vectors.
+        """
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so that document embeddings are served from an EmbeddingCache
+    and only chunks that were never seen before are sent to the underlying model.
+    Query embeddings are always computed by the underlying model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [self.cache.key_for(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Embed each unseen text once, even if it occurs several times in this call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            try:
+                new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            except PartialEmbeddingError as e:
+                # Keep the batches that succeeded, so the next sync only embeds the failed ones
+                self.cache.put_many({key: vector for key, vector in zip(missing.keys(), e.vectors)
+                                     if vector is not None})
+                raise
+            computed = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embeds many queries with the underlying model's batched document call, without caching them."""
+        return self.embeddings.embed_documents(texts)
+
+
+def build_cached_embeddings(embeddings: Embeddings, cache_file: Path = EMBEDDINGS_CACHE_FILE,
+                            model_name: str = EMBEDDINGS_MODEL_NAME) -> CachedEmbeddings:
+    """
+    Creates a CachedEmbeddings wrapper around the given model using the configured cache file.
+
+    Args:
+        embeddings: The embeddings model that computes vectors for unseen chunks.
+        cache_file: The SQLite file holding the cached vectors.
+        model_name: The name of the embeddings model, used as part of every cache key.
+
+    Returns:
+        A CachedEmbeddings instance ready to be passed to a vector store.
+    """
+    return CachedEmbeddings(embeddings, EmbeddingCache(cache_file, model_name))
+
+
+# --- Cold vs. warm start measurement with an offline stub model ---
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.documents import Document
+    from src.vector_store import NumpyVectorStore
+
+    class SlowStubEmbeddings(DeterministicFakeEmbedding):
+        """A deterministic stub that sleeps per batch to imitate a remote embeddings API."""
+        latency_seconds: float = 0.05
+
+        def embed_documents(self, texts: list[str]) -> list[list[float]]:
+            time.sleep(self.latency_seconds)
+            return super().embed_documents(texts)
+
+    stub = SlowStubEmbeddings(size=3072)
+    chunks = [Document(page_content=f"Synthetic policy chunk number {i}. " * 20) for i in range(2000)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = Path(tmp_dir) / "embeddings_cache.sqlite"
+
+        for run in ("cold", "warm"):
+            cached = build_cached_embeddings(stub, cache_file=cache_path, model_name="stub-3072")
+            store = NumpyVectorStore(cached)
+            start = time.perf_counter()
+            store.add_documents(documents=chunks)
+            elapsed = time.perf_counter() - start
+            print(f"{run} start: {elapsed:.2f}s for {len(chunks)} chunks "
+                  f"(cache hits: {cached.hits}, embedded: {cached.misses})")
+
+        # A sync where one batch keeps failing: the other batches are cached and not embedded again
+        from src.embedding_pipeline import BatchedEmbeddings
+
+        class FailingBatchStub(SlowStubEmbeddings):
+            fail_on: str = ""
+
+            def embed_documents(self, texts: list[str]) -> list[list[float]]:
+                if self.fail_on in texts:
+                    raise ConnectionError("stub embeddings server unavailable")
+                return super().embed_documents(texts)
+
+        new_chunks = [f"New policy chunk {i}. " * 20 for i in range(1000)]
+        failing = FailingBatchStub(size=3072, latency_seconds=0.0, fail_on=new_chunks[-1])
+        cached = build_cached_embeddings(BatchedEmbeddings(failing, max_batch_size=100, max_retries=0),
+                                         cache_file=cache_path, model_name="stub-3072")
+        try:
+            cached.embed_documents(new_chunks)
+        except PartialEmbeddingError as e:
+            print(f"failed sync: {e}")
+        failing.fail_on = ""
+        cached.embed_documents(new_chunks)
+        print(f"next sync: {cached.hits} of {len(new_chunks)} chunks served from the cache")
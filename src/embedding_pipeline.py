@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from src.config import (
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_RETRY_BACKOFF_SECONDS,
+)
+from src.metrics import EXTERNAL_CALL_SECONDS
+from src.utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def make_batches(texts: list[str], max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                 max_size: int = EMBEDDING_BATCH_MAX_SIZE) -> list[list[int]]:
+    """
+    Groups texts into batches that stay within a token budget and a maximum number of inputs.
+    A single text larger than the budget gets a batch of its own.
+
+    Args:
+        texts: The texts to group.
+        max_tokens: The maximum total number of tokens per batch.
+        max_size: The maximum number of texts per batch.
+
+    Returns:
+        A list of batches, each a list of indices into `texts`, in the original order.
+    """
+    batches, current, current_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_size):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class PartialEmbeddingError(Exception):
+    """
+    Raised by BatchedEmbeddings.embed_documents() when some batches still failed after their retries.
+    `vectors` holds the embedding of every text whose batch succeeded, and None for the others,
+    so that the caller can keep what was already paid for.
+    """
+
+    def __init__(self, vectors: list, cause: Exception):
+        failed = sum(vector is None for vector in vectors)
+        super().__init__(f"{failed} of {len(vectors)} texts could not be embedded: {cause}")
+        self.vectors = vectors
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so that documents are embedded in token-budgeted batches,
+    with a bounded number of batches in flight at once on a thread pool.
+
+    Every batch (and every query) is retried with exponential backoff on its own,
+    so a failing batch never causes the batches that already succeeded to be embedded again.
+    """
+
+    def __init__(self, embeddings: Embeddings,
+                 max_tokens_per_batch: int = EMBEDDING_BATCH_MAX_TOKENS,
+                 max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+                 max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 max_retries: int = EMBEDDING_MAX_RETRIES,
+                 backoff_seconds: float = EMBEDDING_RETRY_BACKOFF_SECONDS):
+        self.embeddings = embeddings
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._stats_lock = threading.Lock()
+        self.retries = 0
+        self.last_chunks_per_second = 0.0
+
+    def _with_retries(self, func, *args):
+        """Calls func(*args), retrying with exponential backoff on failure."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                logger.warning("Embedding request failed (%s). Retrying in %.1fs...", e, delay)
+                with self._stats_lock:
+                    self.retries += 1
+                time.sleep(delay)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = make_batches(texts, self.max_tokens_per_batch, self.max_batch_size)
+        vectors: list = [None] * len(texts)
+
+        def _embed_batch(indices: list[int]) -> None:
+            with EXTERNAL_CALL_SECONDS.time(call="embed_documents"):
+                batch_vectors = self._with_retries(self.embeddings.embed_documents, [texts[i] for i in indices])
+            for index, vector in zip(indices, batch_vectors):
+                vectors[index] = vector
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as executor:
+            futures = [executor.submit(_embed_batch, batch) for batch in batches]
+        # Every batch has finished here; the ones that failed even after their retries are reported together
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise PartialEmbeddingError(vectors, errors[0]) from errors[0]
+
+        elapsed = time.perf_counter() - start
+        self.last_chunks_per_second = len(texts) / elapsed if elapsed > 0 else float("inf")
+        logger.info("Embedded %d chunks in %d batches in %.2fs (%.1f chunks/s).",
+                    len(texts), len(batches), elapsed, self.last_chunks_per_second)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        with EXTERNAL_CALL_SECONDS.time(call="embed_query"):
+            return self._with_retries(self.embeddings.embed_query, text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """Embeds a query with the underlying model's async API, retried like embed_query."""
+        with EXTERNAL_CALL_SECONDS.time(call="embed_query"):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await self.embeddings.aembed_query(text)
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.backoff_seconds * (2 ** attempt)
+                    logger.warning("Embedding request failed (%s). Retrying in %.1fs...", e, delay)
+                    with self._stats_lock:
+                        self.retries += 1
+                    await asyncio.sleep(delay)
+
+
+# --- Throughput and failure handling with an offline stub model ---
+if __name__ == "__main__":
+    import random
+    from collections import Counter
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    class FlakyStubEmbeddings(DeterministicFakeEmbedding):
+        """A stub that imitates a remote API: fixed latency per request and random failures."""
+        latency_seconds: float = 0.05
+        failure_rate: float = 0.0
+        calls: Counter = Counter()
+
+        def embed_documents(self, texts: list[str]) -> list[list[float]]:
+            time.sleep(self.latency_seconds)
+            self.calls[texts[0]] += 1
+            if random.random() < self.failure_rate:
+                raise ConnectionError("stub embeddings server unavailable")
+            return super().embed_documents(texts)
+
+    texts = [f"Synthetic chunk {i}. " + "policy text " * 150 for i in range(1000)]
+
+    for concurrency in (1, 4, 8):
+        stub = FlakyStubEmbeddings(size=256, calls=Counter())
+        pipeline = BatchedEmbeddings(stub, max_tokens_per_batch=20_000, max_concurrency=concurrency)
+        pipeline.embed_documents(texts)
+        print(f"  concurrency={concurrency}: {pipeline.last_chunks_per_second:.1f} chunks/s")
+
+    stub = FlakyStubEmbeddings(size=256, failure_rate=0.3, calls=Counter())
+    pipeline = BatchedEmbeddings(stub, max_tokens_per_batch=20_000, max_concurrency=4,
+                                 max_retries=10, backoff_seconds=0.01)
+    result = pipeline.embed_documents(texts)
+    expected = DeterministicFakeEmbedding(size=256).embed_documents(texts)
+    print(f"  failure_rate=0.3: {pipeline.retries} retries, results correct: {result == expected}, "
+          f"batch requests: {sum(stub.calls.values())} for {len(stub.calls)} batches")
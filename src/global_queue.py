@@ -1,77 +1,364 @@
 from collections import deque
+import logging
 import threading
+import sqlite3
 import json
 import os
+import time
 import atexit
-from src.config import QUEUE_FILE
+from typing import Optional
+from src.config import (
+    QUEUE_BACKEND,
+    QUEUE_DB_FILE,
+    QUEUE_FILE,
+    QUEUE_LOG_FILE,
+    QUEUE_COMPACTION_THRESHOLD,
+    QUEUE_POLL_INTERVAL_SECONDS,
+)
+from src.metrics import QUEUE_DEPTH
 
-def _load_queue_from_file() -> deque:
+logger = logging.getLogger(__name__)
+
+# The file backend persists the queue as a snapshot (QUEUE_FILE) plus an append-only log of the
+# enqueues and dequeues made since (QUEUE_LOG_FILE). Every log record carries a sequence number,
+# and the snapshot records the last one it includes, so replaying the log after a crash is idempotent.
+_ENQUEUE = "+"
+_DEQUEUE = "-"
+
+
+def _load_queue_from_file(queue_file: str, log_file: str) -> tuple[deque, int]:
     """
-    Loads the global service queue from a JSON file.
-    If the file does not exist or is corrupted, it initializes an empty queue.
+    Loads the global service queue from the snapshot file and replays the log on top of it.
+    If the snapshot does not exist or is corrupted, it starts from an empty queue; a torn
+    last log record (from a crash while writing it) is ignored.
+
+    Args:
+        queue_file: The path of the snapshot file.
+        log_file: The path of the log file.
 
     Returns:
-        A deque object populated with the queue data from the file, or an empty deque.
+        A deque populated with the queue data from the files (or an empty deque), and the
+        sequence number of the last record applied.
     """
-    if os.path.exists(QUEUE_FILE):
+    queue, sequence = deque(), 0
+    if os.path.exists(queue_file):
         try:
-            with open(QUEUE_FILE, "r") as f:
+            with open(queue_file, "r") as f:
                 data = json.load(f)
                 # Ensure 'queue' key exists in the loaded data, default to empty list
-                return deque(data.get("queue", []))
+                queue = deque(data.get("queue", []))
+                sequence = data.get("sequence", 0)
         except json.JSONDecodeError:
-            print(f"Warning: Could not decode JSON from {QUEUE_FILE}. Starting with empty queue.")
-            return deque()
-    # If file does not exist, return an empty deque
-    return deque()
+            logger.warning("Could not decode JSON from %s. Starting with empty queue.", queue_file)
 
-def _save_queue_to_file():
+    if os.path.exists(log_file):
+        queued = set(queue)
+        with open(log_file, "r") as f:
+            for line in f:
+                try:
+                    record_sequence, op, session_id = json.loads(line)
+                except (json.JSONDecodeError, ValueError):
+                    logger.warning("Ignoring a damaged record in %s.", log_file)
+                    continue
+                if record_sequence <= sequence:
+                    continue  # Already part of the snapshot
+                sequence = record_sequence
+                if op == _ENQUEUE and session_id not in queued:
+                    queue.append(session_id)
+                    queued.add(session_id)
+                elif op == _DEQUEUE and queue and queue[0] == session_id:
+                    queued.discard(queue.popleft())
+    return queue, sequence
+
+
+class FileServiceQueue:
     """
-    Saves the current state of the global service queue to a JSON file.
-    This function is called internally after modifications to the queue.
+    The service queue held in this process's memory and persisted to a snapshot file plus an
+    append-only log. Fast, but only safe for a single bot process: every process would keep
+    its own copy of the queue and overwrite the others' files.
     """
-    with open(QUEUE_FILE, "w") as f:
-        # Convert deque to a list for JSON serialization
-        json.dump({"queue": list(global_service_queue)}, f)
-    print(f"Global queue saved to {QUEUE_FILE}.")
 
-# Initialize the global service queue by loading from the file
-global_service_queue = _load_queue_from_file()
-# Create a lock to ensure thread-safe operations on the queue
-queue_lock = threading.Lock()
+    def __init__(self, queue_file: str = QUEUE_FILE, log_file: str = QUEUE_LOG_FILE,
+                 compaction_threshold: int = QUEUE_COMPACTION_THRESHOLD):
+        self.queue_file = queue_file
+        self.log_file = log_file
+        self.compaction_threshold = compaction_threshold
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(queue_file) or ".", exist_ok=True)
+        self._queue, self._sequence = _load_queue_from_file(queue_file, log_file)
+        # Index of the queued session IDs, for constant-time membership checks
+        self._queued_ids = set(self._queue)
+        self._log = open(log_file, "a")
+        self._log_records = 0
+        # Start from a compact snapshot, so the log only holds this run's changes
+        self._save()
+
+    def _save(self):
+        """
+        Compacts the queue's files: writes a new snapshot of the whole queue (atomically) and
+        empties the log. Called once the log grows past the compaction threshold, and on close.
+        """
+        tmp_file = self.queue_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            # Convert deque to a list for JSON serialization
+            json.dump({"queue": list(self._queue), "sequence": self._sequence}, f)
+        os.replace(tmp_file, self.queue_file)
+        self._log.seek(0)
+        self._log.truncate()
+        self._log_records = 0
+        logger.info("Global queue saved to %s (%d users).", self.queue_file, len(self._queue))
+
+    def _append_to_log(self, op: str, session_id: str):
+        """Appends one enqueue or dequeue record to the log, compacting the files when it grows too long."""
+        self._sequence += 1
+        self._log.write(json.dumps([self._sequence, op, session_id]) + "\n")
+        self._log.flush()
+        self._log_records += 1
+        if self._log_records >= max(self.compaction_threshold, len(self._queue)):
+            self._save()
+
+    def add(self, session_id: str) -> tuple[bool, int]:
+        """Enqueues a session ID unless it is already queued; returns (added, queue size)."""
+        with self._lock:
+            if session_id in self._queued_ids:
+                return False, len(self._queue)
+            self._queue.append(session_id)
+            self._queued_ids.add(session_id)
+            self._append_to_log(_ENQUEUE, session_id)
+            return True, len(self._queue)
+
+    def pop(self) -> tuple[Optional[str], int]:
+        """Dequeues the next session ID (None if the queue is empty); returns (session ID, queue size)."""
+        with self._lock:
+            if not self._queue:
+                return None, 0
+            session_id = self._queue.popleft()
+            self._queued_ids.discard(session_id)
+            self._append_to_log(_DEQUEUE, session_id)
+            return session_id, len(self._queue)
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def peek(self) -> list[str]:
+        with self._lock:
+            return list(self._queue)
+
+    def position(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            if session_id not in self._queued_ids:
+                return None
+            return self._queue.index(session_id) + 1
+
+    def close(self):
+        with self._lock:
+            if not self._log.closed:
+                self._save()
+                self._log.close()
+
+
+class SQLiteServiceQueue:
+    """
+    The service queue kept in a SQLite database, so every bot process (and the human agents'
+    tools) share one queue. Each operation is a single transaction: a session ID is unique in
+    the table, so concurrent enqueues cannot add it twice, and a dequeue deletes and returns
+    the first row in one statement, so two processes never get the same user.
+
+    Rows are ordered by an AUTOINCREMENT ticket, which is never reused; a user's position is
+    the number of tickets up to and including theirs, so it only ever moves forward.
+    """
+
+    def __init__(self, db_file: str = QUEUE_DB_FILE, queue_file: str = QUEUE_FILE,
+                 log_file: str = QUEUE_LOG_FILE):
+        """
+        Args:
+            db_file: The path of the SQLite database.
+            queue_file: The file backend's snapshot, imported once into a new database.
+            log_file: The file backend's log, imported together with the snapshot.
+        """
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS service_queue ("
+                    "ticket INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    "session_id TEXT NOT NULL UNIQUE, "
+                    "enqueued_at REAL NOT NULL)"
+                )
+                if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+                    # First start with this database: carry over the users waiting in the file backend
+                    queue, _ = _load_queue_from_file(queue_file, log_file)
+                    now = time.time()
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO service_queue (session_id, enqueued_at) VALUES (?, ?)",
+                        [(session_id, now) for session_id in queue],
+                    )
+                    conn.execute("PRAGMA user_version = 1")
+                    if queue:
+                        logger.info("Imported %d users from %s into %s.", len(queue), queue_file, db_file)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this process's connection; a connection inherited through fork() is never reused."""
+        if self._conn is None or self._pid != os.getpid():
+            # Autocommit mode: every statement is its own transaction unless BEGIN is issued
+            self._conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _size(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COUNT(*) FROM service_queue").fetchone()[0]
+
+    def add(self, session_id: str) -> tuple[bool, int]:
+        """Enqueues a session ID unless it is already queued; returns (added, queue size)."""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO service_queue (session_id, enqueued_at) VALUES (?, ?)",
+                (session_id, time.time()),
+            )
+            return cursor.rowcount == 1, self._size(conn)
+
+    def pop(self) -> tuple[Optional[str], int]:
+        """Dequeues the next session ID (None if the queue is empty); returns (session ID, queue size)."""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "DELETE FROM service_queue WHERE ticket = (SELECT MIN(ticket) FROM service_queue) "
+                "RETURNING session_id"
+            ).fetchone()
+            return (row[0] if row else None), self._size(conn)
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size(self._connection())
+
+    def peek(self) -> list[str]:
+        with self._lock:
+            rows = self._connection().execute("SELECT session_id FROM service_queue ORDER BY ticket")
+            return [session_id for (session_id,) in rows]
+
+    def position(self, session_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM service_queue WHERE ticket <= "
+                "(SELECT ticket FROM service_queue WHERE session_id = ?)",
+                (session_id,),
+            ).fetchone()
+            return row[0] or None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+def _open_queue(backend: str = QUEUE_BACKEND):
+    """Opens the service queue of the configured backend ("sqlite" or "file")."""
+    if backend == "sqlite":
+        return SQLiteServiceQueue()
+    if backend == "file":
+        return FileServiceQueue()
+    raise ValueError(f"Unknown QUEUE_BACKEND {backend!r}; expected 'sqlite' or 'file'.")
+
+
+# The global service queue of the configured backend, opened on first use (see get_service_queue())
+_service_queue = None
+_service_queue_lock = threading.Lock()
+# Wakes up agents waiting in this process as soon as a user is added here; users added by
+# other processes are noticed by polling every QUEUE_POLL_INTERVAL_SECONDS
+_user_added = threading.Condition()
+
+def get_service_queue():
+    """Returns the global service queue, opening it on first use."""
+    global _service_queue
+    with _service_queue_lock:
+        if _service_queue is None:
+            _service_queue = _open_queue()
+        return _service_queue
 
 def add_user_to_global_queue(session_id: str):
     """
-    Adds a user's session ID to the global service queue in a thread-safe manner.
-    The queue is saved to a file after the addition.
+    Adds a user's session ID to the global service queue. Safe to call from several threads
+    and, with the SQLite backend, from several processes.
 
     Args:
         session_id: The unique session ID of the user to be added.
     """
-    with queue_lock:
-        if session_id not in global_service_queue: # Prevent adding the same user multiple times
-            global_service_queue.append(session_id)
-            _save_queue_to_file() # Save the queue after modification
-            print(f"User '{session_id}' added to global service queue. Current queue: {list(global_service_queue)}")
-        else:
-            print(f"User '{session_id}' is already in the global service queue.")
+    added, size = get_service_queue().add(session_id) # Prevent adding the same user multiple times
+    if added:
+        with _user_added:
+            _user_added.notify()
+        logger.info("User '%s' added to global service queue. Queue size: %d", session_id, size)
+    else:
+        logger.info("User '%s' is already in the global service queue.", session_id)
 
 def get_next_user_from_global_queue() -> str | None:
     """
-    Retrieves and removes the next user's session ID from the global service queue
-    in a thread-safe manner. The queue is saved to a file after the removal.
+    Retrieves and removes the next user's session ID from the global service queue.
+    Safe to call from several threads and, with the SQLite backend, from several processes.
 
     Returns:
         The session ID of the next user in the queue, or None if the queue is empty.
     """
-    with queue_lock:
-        if global_service_queue:
-            user_id = global_service_queue.popleft() # Remove the user from the front of the queue
-            _save_queue_to_file() # Save the queue after modification
-            print(f"User '{user_id}' removed from global service queue. Remaining queue: {list(global_service_queue)}")
+    user_id, size = get_service_queue().pop() # Remove the user from the front of the queue
+    if user_id is not None:
+        logger.info("User '%s' removed from global service queue. Queue size: %d", user_id, size)
+        return user_id
+    logger.debug("Attempted to get user from empty queue.")
+    return None
+
+def wait_for_next_user_from_global_queue(timeout: float | None = None) -> str | None:
+    """
+    Like get_next_user_from_global_queue, but blocks until a user is waiting, for human
+    agents that take the next user as soon as there is one.
+
+    Args:
+        timeout: The maximum number of seconds to wait, or None to wait without limit.
+
+    Returns:
+        The session ID of the next user in the queue, or None if the timeout passed first.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        user_id, size = get_service_queue().pop()
+        if user_id is not None:
+            logger.info("User '%s' removed from global service queue. Queue size: %d", user_id, size)
             return user_id
-        print("DEBUG: Attempted to get user from empty queue.") # Added for debugging based on previous conversation
-        return None
+        wait_seconds = QUEUE_POLL_INTERVAL_SECONDS
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait_seconds = min(wait_seconds, remaining)
+        with _user_added:
+            _user_added.wait(wait_seconds)
+
+def get_user_position_in_global_queue(session_id: str) -> int | None:
+    """
+    Returns a user's place in the global service queue.
+
+    Args:
+        session_id: The session ID of the user.
+
+    Returns:
+        1 for the next user to be served, 2 for the one after, and so on, or None if the user
+        is not in the queue.
+    """
+    return get_service_queue().position(session_id)
 
 def get_current_global_queue_size() -> int:
     """
@@ -80,8 +367,7 @@ def get_current_global_queue_size() -> int:
     Returns:
         The number of items in the queue.
     """
-    with queue_lock:
-        return len(global_service_queue)
+    return get_service_queue().size()
 
 def peek_global_queue() -> list[str]:
     """
@@ -90,9 +376,142 @@ def peek_global_queue() -> list[str]:
     Returns:
         A list representing the current state of the queue.
     """
-    with queue_lock:
-        return list(global_service_queue)
+    return get_service_queue().peek()
+
+# The queue depth is read from the queue when the metrics are exported
+QUEUE_DEPTH.set_function(get_current_global_queue_size)
+
+# Close the queue when the script exits normally; for the file backend this compacts its files.
+# Other exits (e.g., kill -9) are covered by replaying the log (or by SQLite's journal) on the next start.
+atexit.register(lambda: _service_queue is not None and _service_queue.close())
+
+
+# --- Multi-process stress test of the SQLite backend, and throughput of both backends ---
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import io
+    import multiprocessing
+    from collections import Counter
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Stress test and throughput of the service queue backends.")
+    parser.add_argument("--waiting", type=int, default=100_000, help="users in the queue for the throughput measurement")
+    waiting = parser.parse_args().waiting
+
+    producers, consumers, users_per_producer = 4, 4, 2_000
+    scratch_dir = tempfile.mkdtemp()
+    db_file = os.path.join(scratch_dir, "global_service_queue.sqlite")
+    no_file = os.path.join(scratch_dir, "missing.json")
+
+    def producer_users(producer: int, round_name: str) -> list[str]:
+        # Neighbouring producers share half of their users, so duplicates race each other
+        return [f"{round_name}-user-{producer * users_per_producer // 2 + i}" for i in range(users_per_producer)]
+
+    def produce(producer: int, round_name: str, results):
+        shared = SQLiteServiceQueue(db_file, no_file, no_file)
+        added = []
+        for session_id in producer_users(producer, round_name):
+            if shared.add(session_id)[0]:
+                added.append(session_id)
+        results.put(("added", added))
+
+    def consume(results, producers_done):
+        global _service_queue
+        _service_queue = SQLiteServiceQueue(db_file, no_file, no_file)
+        served = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            while True:
+                user_id = wait_for_next_user_from_global_queue(timeout=0.5)
+                if user_id is not None:
+                    served.append(user_id)
+                elif producers_done.is_set():
+                    break
+        results.put(("served", served))
+
+    SQLiteServiceQueue(db_file, no_file, no_file)  # Create the table before the processes race
+    context = multiprocessing.get_context("fork")
+    results, producers_done = context.Queue(), context.Event()
+
+    # Round 1: producers race to add overlapping users; each user must be queued exactly once
+    start = time.perf_counter()
+    processes = [context.Process(target=produce, args=(p, "first", results)) for p in range(producers)]
+    for process in processes:
+        process.start()
+    first_added = [user for _ in range(producers) for user in results.get()[1]]
+    for process in processes:
+        process.join()
+    first_expected = {user for p in range(producers) for user in producer_users(p, "first")}
+    queued = SQLiteServiceQueue(db_file, no_file, no_file).peek()
+    print(f"Round 1, {producers} producer processes: {len(first_added)} users added, each once: "
+          f"{sorted(first_added) == sorted(first_expected) == sorted(queued)}")
+
+    # Round 2: consumers block on the queue, draining round 1 while producers add round 2. A
+    # user served before another producer reaches them is rightly queued again, so every
+    # successful add must be matched by exactly one dequeue
+    processes = ([context.Process(target=consume, args=(results, producers_done)) for _ in range(consumers)]
+                 + [context.Process(target=produce, args=(p, "second", results)) for p in range(producers)])
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in range(producers)]
+    producers_done.set()
+    outcomes += [results.get() for _ in range(consumers)]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    added = first_added + [user for kind, users in outcomes if kind == "added" for user in users]
+    served = [user for kind, users in outcomes if kind == "served" for user in users]
+    print(f"Round 2, {consumers} consumer and {producers} producer processes: {len(served)} users served; "
+          f"every add served exactly once: {Counter(served) == Counter(added)}, "
+          f"queue left empty: {SQLiteServiceQueue(db_file, no_file, no_file).size() == 0} ({elapsed:.2f}s in total)")
+
+    # Positions only move forward as users ahead are served
+    shared = SQLiteServiceQueue(db_file, no_file, no_file)
+    for i in range(5):
+        shared.add(f"waiting-{i}")
+    positions = [shared.position("waiting-4")]
+    for _ in range(3):
+        shared.pop()
+        positions.append(shared.position("waiting-4"))
+    print(f"Positions of the last user while the others are served: {positions}")
+
+    # Throughput at a given queue length, as in the snapshot + log measurement of the file backend
+    for name, queue in (("sqlite", SQLiteServiceQueue(os.path.join(scratch_dir, "throughput.sqlite"), no_file, no_file)),
+                        ("file", FileServiceQueue(os.path.join(scratch_dir, "throughput.json"),
+                                                  os.path.join(scratch_dir, "throughput.log")))):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for i in range(waiting):
+                queue.add(f"user-{i}")
+            enqueue_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(waiting):
+                queue.add(f"user-{i}")  # Duplicates
+            duplicate_seconds = time.perf_counter() - start
+
+            # Crash recovery: reload the queue from its files without a clean shutdown
+            expected = queue.peek()
+            if isinstance(queue, FileServiceQueue):
+                recovered = list(_load_queue_from_file(queue.queue_file, queue.log_file)[0])
+            else:
+                recovered = SQLiteServiceQueue(queue.db_file, no_file, no_file).peek()
+
+            start = time.perf_counter()
+            for _ in range(waiting):
+                queue.pop()
+            dequeue_seconds = time.perf_counter() - start
+            queue.close()
+        print(f"{name:>6} backend, {waiting:,} waiting users: enqueue {waiting / enqueue_seconds:,.0f} ops/s, "
+              f"duplicate check {waiting / duplicate_seconds:,.0f} ops/s, dequeue {waiting / dequeue_seconds:,.0f} ops/s, "
+              f"recovered after a crash: {recovered == expected}")
 
-# Register a cleanup function to save the queue state when the script exits normally.
-# Note: This might not catch all exit scenarios (e.g., forced termination like kill -9).
-atexit.register(_save_queue_to_file)
+    # The original implementation rewrote the whole JSON file on every operation
+    queue_copy = [f"user-{i}" for i in range(waiting)]
+    rewrites = 50
+    start = time.perf_counter()
+    for _ in range(rewrites):
+        "user-x" in queue_copy
+        with open(os.path.join(scratch_dir, "rewrite.json"), "w") as f:
+            json.dump({"queue": queue_copy}, f)
+    print(f"Rewriting the whole file per operation at {waiting:,} users: {rewrites / (time.perf_counter() - start):,.0f} ops/s")
@@ -1,14 +1,57 @@
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Optional, Union
+
+import numpy as np
+
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import StateGraph
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
 
 from src.models import State
-from src.ingester import vector_store
-from src.config import LLM
-from src.utils import trimmer
-from src.agent import run_agent  # Assuming run_agent can be called directly as a node
+from src.ingester import get_vector_store, get_lexical_index, index_ready, wait_for_index
+from src.lexical_index import reciprocal_rank_fusion
+from src.config import (
+    get_llm,
+    HYBRID_SEARCH_ENABLED,
+    RETRIEVAL_K,
+    RETRIEVAL_CANDIDATES,
+    RRF_K,
+    CONTEXT_ASSEMBLY_ENABLED,
+    CONTEXT_CANDIDATES,
+    MMR_LAMBDA,
+    PROMPT_TOKEN_BUDGET,
+    CONTEXT_MIN_TOKENS,
+    LOCAL_ROUTER_ENABLED,
+    SPECULATIVE_RETRIEVAL_ENABLED,
+    PERSISTENT_CHECKPOINTS_ENABLED,
+    NODE_TIMINGS_WINDOW,
+    INDEX_WAIT_SECONDS,
+)
+from src.utils import trimmer, count_message_tokens
+from src.context_builder import maximal_marginal_relevance, assemble_context
+from src.agent import run_agent, arun_agent  # Assuming run_agent can be called directly as a node
 from src.global_queue import add_user_to_global_queue  # Import the global queue function
+from src.response_cache import response_cache
+from src.router import LocalRouter, llm_route, allm_route, llm_route_batch
+from src.checkpointer import SQLiteCheckpointSaver
+from src.metrics import (
+    NODE_SECONDS,
+    EXTERNAL_CALL_SECONDS,
+    RETRIEVED_DOCUMENTS,
+    CONTEXT_TOKENS,
+    CONTEXT_TOKENS_SAVED,
+    ROUTES,
+    RESPONSE_CACHE_LOOKUPS,
+    ESCALATIONS,
+    metrics_callback,
+)
 
 
 # Define prompt for messages-answering
@@ -25,22 +68,218 @@ rag_chat_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
+# Recent durations (in seconds) of each graph node and of the routing decision, for
+# node_timing_summary(); all durations also go to the chatbot_node_duration_seconds histogram
+_node_timings: dict[str, deque] = {}
+_node_timings_lock = threading.Lock()
 
-tool_routing_prompt = PromptTemplate.from_template(
-    """Decide whether the following user message requires using tools (e.g., updating user details, adding vendors)
-or if it's a general question that can be answered based on existing documents.
 
-Respond only with one word: "tool" or "retrieve".
+def _record_timing(name: str, elapsed: float) -> None:
+    with _node_timings_lock:
+        _node_timings.setdefault(name, deque(maxlen=NODE_TIMINGS_WINDOW)).append(elapsed)
+    NODE_SECONDS.observe(elapsed, node=name)
+
+
+def _timed(name: str, func):
+    """Wraps a node (or routing function), sync or async, so that each call's duration is recorded under `name`."""
+    if asyncio.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _record_timing(name, time.perf_counter() - start)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_timing(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _node(name: str, func, afunc):
+    """A timed graph node with a sync implementation for invoke() and an async one for ainvoke()."""
+    return RunnableLambda(_timed(name, func), afunc=_timed(name, afunc), name=name)
+
+
+def node_timing_summary() -> dict[str, dict]:
+    """
+    Summarizes the recorded node durations.
+
+    Returns:
+        A dict mapping each node name to its call count and p50/p95 latency in milliseconds.
+    """
+    with _node_timings_lock:
+        timings = {name: list(durations) for name, durations in _node_timings.items()}
+    return {
+        name: {
+            "calls": len(durations),
+            "p50_ms": float(np.percentile(durations, 50)) * 1000,
+            "p95_ms": float(np.percentile(durations, 95)) * 1000,
+        }
+        for name, durations in timings.items()
+        if durations
+    }
+
+
+# Runs the BM25 search while the vector search waits for the query embedding, and (on the
+# async path) the vector search itself, so that the event loop is never blocked by a search
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+
+# Recent query embeddings, shared by the sync and async paths
+_QUERY_EMBEDDINGS_MAX_ENTRIES = 1024
+_query_embeddings: OrderedDict[str, list[float]] = OrderedDict()
+_query_embeddings_lock = threading.Lock()
+
+
+def _cached_query_embedding(query: str) -> Optional[list[float]]:
+    with _query_embeddings_lock:
+        embedding = _query_embeddings.get(query)
+        if embedding is not None:
+            _query_embeddings.move_to_end(query)
+        return embedding
+
+
+def _remember_query_embedding(query: str, embedding: list[float]) -> None:
+    with _query_embeddings_lock:
+        _query_embeddings[query] = embedding
+        if len(_query_embeddings) > _QUERY_EMBEDDINGS_MAX_ENTRIES:
+            _query_embeddings.popitem(last=False)
+
+
+def _embed_query(query: str) -> list[float]:
+    """
+    Embeds a user query. Recent queries are memoized, so the response cache, the router and
+    retrieval share one embedding call per turn (and repeated questions need none) without
+    storing the vector in the checkpointed graph state.
+    """
+    embedding = _cached_query_embedding(query)
+    if embedding is None:
+        embedding = get_vector_store().embeddings.embed_query(query)
+        _remember_query_embedding(query, embedding)
+    return embedding
+
+
+async def _aembed_query(query: str) -> list[float]:
+    """Async version of _embed_query(), sharing its memoized embeddings."""
+    embedding = _cached_query_embedding(query)
+    if embedding is None:
+        embedding = await get_vector_store().embeddings.aembed_query(query)
+        _remember_query_embedding(query, embedding)
+    return embedding
+
+
+# Search results kept for context assembly, which picks RETRIEVAL_K of them
+_candidate_count = CONTEXT_CANDIDATES if CONTEXT_ASSEMBLY_ENABLED else RETRIEVAL_K
+
+
+# Decides most messages locally; route_question falls back to the LLM when it is unsure
+local_router = LocalRouter(_embed_query, lambda texts: get_vector_store().embeddings.embed_documents(texts))
+
+
+def _vector_search(query: str, k: int) -> list:
+    """Runs the vector search for a query."""
+    return get_vector_store().similarity_search_by_vector(_embed_query(query), k=k)
+
+
+def _fuse(vector_docs: list, lexical_hits: list[tuple[str, float]]) -> list:
+    """Merges the vector and BM25 rankings with reciprocal-rank fusion and returns the top documents."""
+    lexical_ids = [doc_id for doc_id, _ in lexical_hits]
+    fused_ids = reciprocal_rank_fusion([[doc.id for doc in vector_docs], lexical_ids], k=RRF_K)[:_candidate_count]
+    docs_by_id = {doc.id: doc for doc in vector_docs}
+    missing_ids = [doc_id for doc_id in fused_ids if doc_id not in docs_by_id]
+    docs_by_id.update({doc.id: doc for doc in get_vector_store().get_by_ids(missing_ids)})
+    return [docs_by_id[doc_id] for doc_id in fused_ids if doc_id in docs_by_id]
+
+
+def _hybrid_search(query: str) -> list:
+    """
+    Runs BM25 and vector search together and merges their rankings with reciprocal-rank fusion.
+    """
+    lexical_future = _search_executor.submit(get_lexical_index().search, query, RETRIEVAL_CANDIDATES)
+    vector_docs = _vector_search(query, RETRIEVAL_CANDIDATES)
+    return _fuse(vector_docs, lexical_future.result())
+
+
+async def _asearch(query: str) -> list:
+    """
+    Async retrieval: the BM25 search starts right away, the vector search once the query is
+    embedded; both run on the search executor.
+    """
+    loop = asyncio.get_running_loop()
+    if HYBRID_SEARCH_ENABLED:
+        lexical_future = loop.run_in_executor(_search_executor, get_lexical_index().search, query, RETRIEVAL_CANDIDATES)
+        k = RETRIEVAL_CANDIDATES
+    else:
+        k = _candidate_count
+    embedding = await _aembed_query(query)
+    vector_docs = await loop.run_in_executor(_search_executor, get_vector_store().similarity_search_by_vector, embedding, k)
+    if not HYBRID_SEARCH_ENABLED:
+        return vector_docs
+    return await loop.run_in_executor(_search_executor, _fuse, vector_docs, await lexical_future)
+
+
+def _select_context(query_embedding: list[float], candidates: list) -> list:
+    """
+    Picks the RETRIEVAL_K documents passed to the LLM among the search candidates, by maximal
+    marginal relevance over their stored embeddings, so that near-duplicate chunks do not crowd
+    out the rest of the answer. The candidates' search order (the fused one, with hybrid search)
+    is kept as the relevance, so BM25 matches are not demoted to their vector similarity.
+    """
+    if not CONTEXT_ASSEMBLY_ENABLED:
+        return candidates
+    documents, vectors = get_vector_store().get_with_vectors([doc.id for doc in candidates])
+    picked = maximal_marginal_relevance(query_embedding, vectors, RETRIEVAL_K, MMR_LAMBDA, ranked=True)
+    return [documents[i] for i in picked]
+
+
+async def _await_index() -> bool:
+    """Async version of wait_for_index(INDEX_WAIT_SECONDS)."""
+    if index_ready.is_set():
+        return True
+    return await asyncio.to_thread(wait_for_index, INDEX_WAIT_SECONDS)
 
-User message:
-{message}
-"""
-)
 
 # Define application steps (nodes)
+def cache_lookup(state: State) -> dict:
+    """
+    Embeds the latest user query and looks it up in the semantic response cache.
+    On a hit the cached answer becomes the reply and retrieval and generation are skipped.
+    """
+    last_message = state["messages"][-1]
+    if not isinstance(last_message, HumanMessage):
+        raise ValueError("Expected the last message in state['messages'] to be a HumanMessage for cache lookup.")
+
+    cached_response = response_cache.lookup(_embed_query(last_message.content), state["language"])
+    RESPONSE_CACHE_LOOKUPS.inc(result="miss" if cached_response is None else "hit")
+    if cached_response is not None:
+        return {"messages": [AIMessage(content=cached_response)], "cache_hit": True}
+    return {"cache_hit": False}
+
+
+async def acache_lookup(state: State) -> dict:
+    """Async version of cache_lookup()."""
+    last_message = state["messages"][-1]
+    if not isinstance(last_message, HumanMessage):
+        raise ValueError("Expected the last message in state['messages'] to be a HumanMessage for cache lookup.")
+
+    cached_response = response_cache.lookup(await _aembed_query(last_message.content), state["language"])
+    RESPONSE_CACHE_LOOKUPS.inc(result="miss" if cached_response is None else "hit")
+    if cached_response is not None:
+        return {"messages": [AIMessage(content=cached_response)], "cache_hit": True}
+    return {"cache_hit": False}
+
+
 def retrieve(state: State) -> dict:
     """
-    Retrieves relevant documents from the vector store based on the latest user query.
+    Retrieves relevant documents based on the latest user query,
+    from the vector store alone or combined with the lexical (BM25) index,
+    and picks the ones passed to the LLM (see _select_context()).
     """
     last_message = state["messages"][-1]
     if isinstance(last_message, HumanMessage):
@@ -49,93 +288,370 @@ def retrieve(state: State) -> dict:
         # This case should ideally not happen if the previous node ensures HumanMessage
         raise ValueError("Expected the last message in state['messages'] to be a HumanMessage for retrieval.")
 
-    retrieved_docs = vector_store.similarity_search(user_query_text)
-    return {"context": retrieved_docs}
+    # Normally ready: routing already waited for it (in speculative mode this overlaps routing)
+    wait_for_index(INDEX_WAIT_SECONDS)
+    # Read before searching: a document sync that lands after it clears the cache and makes this answer stale
+    cache_generation = response_cache.generation
+    if HYBRID_SEARCH_ENABLED:
+        candidates = _hybrid_search(user_query_text)
+    else:
+        candidates = _vector_search(user_query_text, _candidate_count)
+    retrieved_docs = _select_context(_embed_query(user_query_text), candidates)
+    RETRIEVED_DOCUMENTS.observe(len(retrieved_docs))
+    return {"context": retrieved_docs, "cache_generation": cache_generation}
 
 
-def generate(state: State) -> dict:
+async def aretrieve(state: State) -> dict:
+    """Async version of retrieve()."""
+    last_message = state["messages"][-1]
+    if not isinstance(last_message, HumanMessage):
+        raise ValueError("Expected the last message in state['messages'] to be a HumanMessage for retrieval.")
+
+    await _await_index()
+    cache_generation = response_cache.generation
+    candidates = await _asearch(last_message.content)
+    embedding = await _aembed_query(last_message.content)
+    retrieved_docs = await asyncio.get_running_loop().run_in_executor(
+        _search_executor, _select_context, embedding, candidates)
+    RETRIEVED_DOCUMENTS.observe(len(retrieved_docs))
+    return {"context": retrieved_docs, "cache_generation": cache_generation}
+
+
+def _generation_prompt(state: State):
     """
-    Generates a response using the LLM based on retrieved context and chat history.
+    Builds the RAG prompt from the retrieved context and the trimmed chat history. The context gets
+    the part of PROMPT_TOKEN_BUDGET the history leaves (see assemble_context()).
     """
-    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
-
     # Apply the trimmer to the messages before passing them to the prompt
-    trimmed_messages = trimmer.invoke(state["messages"])
+    with EXTERNAL_CALL_SECONDS.time(call="trim_history"):
+        trimmed_messages = trimmer.invoke(state["messages"])
+
+    if CONTEXT_ASSEMBLY_ENABLED:
+        context_budget = max(CONTEXT_MIN_TOKENS, PROMPT_TOKEN_BUDGET - count_message_tokens(trimmed_messages))
+        context = assemble_context(state["context"], context_budget)
+        CONTEXT_TOKENS.observe(context.tokens)
+        CONTEXT_TOKENS_SAVED.observe(context.saved_tokens)
+        docs_content = context.text
+    else:
+        docs_content = "\n\n".join(doc.page_content for doc in state["context"])
 
-    full_messages_for_llm = rag_chat_prompt.invoke(
+    return rag_chat_prompt.invoke(
         {"messages": trimmed_messages, "context": docs_content, "language": state["language"]}
     )
 
-    response = LLM.invoke(full_messages_for_llm)
+
+def _is_dont_know(text: str) -> bool:
+    """Whether an answer says the LLM doesn't know (in English or Hebrew)."""
+    return "don't know" in text.lower() or "לא יודע" in text.lower()
+
+
+# The reply sent when the question is escalated to the human service queue
+_ESCALATION_MESSAGE = "אני לא בטוח לגבי התשובה, הפניתי אותך לנציג שירות. אנא המתן."
+
+
+def generate(state: State) -> dict:
+    """
+    Generates a response using the LLM based on retrieved context and chat history.
+    """
+    full_messages_for_llm = _generation_prompt(state)
+
+    response = get_llm().invoke(full_messages_for_llm)
 
     # Check if the LLM's response indicates it doesn't know the answer
     # Now checks for both English and Hebrew "don't know" phrases
-    if "don't know" in response.content.lower() or "לא יודע" in response.content.lower():
+    if _is_dont_know(response.content):
         user_session_id = state["session_id"]  # Get the session ID from the state
 
         # Add user to the global service queue
         add_user_to_global_queue(user_session_id)  # Use the global queue function
+        ESCALATIONS.inc()
         # Ensure the response is in Hebrew as per the user's language setting
-        return {"messages": [AIMessage(content="אני לא בטוח לגבי התשובה, הפניתי אותך לנציג שירות. אנא המתן.")]}
+        return {"messages": [AIMessage(content=_ESCALATION_MESSAGE)]}
     else:
+        # Only confident answers are cached; escalations to the human queue never are
+        last_human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
+        if last_human is not None:
+            response_cache.store(_embed_query(last_human.content), state["language"], response.content,
+                                 state.get("cache_generation"))
         return {"messages": [response]}
 
 
+async def agenerate(state: State) -> dict:
+    """Async version of generate()."""
+    response = await get_llm().ainvoke(_generation_prompt(state))
+
+    if _is_dont_know(response.content):
+        # The queue is saved to a file, so it is updated off the event loop
+        await asyncio.to_thread(add_user_to_global_queue, state["session_id"])
+        ESCALATIONS.inc()
+        return {"messages": [AIMessage(content=_ESCALATION_MESSAGE)]}
+
+    last_human = next((m for m in reversed(state["messages"]) if isinstance(m, HumanMessage)), None)
+    if last_human is not None:
+        response_cache.store(await _aembed_query(last_human.content), state["language"], response.content,
+                             state.get("cache_generation"))
+    return {"messages": [response]}
+
+
 def route_question(state: State) -> str:
     """
-    Uses an LLM to decide whether to route the user's query to the tool agent or to the RAG pipeline.
+    Decides whether to route the user's query to the tool agent or to the RAG pipeline.
+    The local router decides most messages; the LLM is only asked when it is not confident.
+    Questions that arrive while the documents are still being indexed go to "warming_up".
     """
     last_message = state["messages"][-1]
 
     if not isinstance(last_message, HumanMessage):
         raise ValueError("Expected last message to be a HumanMessage.")
 
-    routing_prompt = tool_routing_prompt.invoke({"message": last_message.content})
-    decision = LLM.invoke(routing_prompt).content.strip().lower()
+    if LOCAL_ROUTER_ENABLED:
+        decision = local_router.route(last_message.content)
+        route = decision.route if decision.route is not None else llm_route(last_message.content)
+    else:
+        route = llm_route(last_message.content)
+
+    # Until the documents are indexed, questions wait for a while and then get a "warming up" reply
+    if route == "retrieve" and not wait_for_index(INDEX_WAIT_SECONDS):
+        route = "warming_up"
+    ROUTES.inc(route=route)
+    return route
+
+
+async def aroute_question(state: State) -> str:
+    """Async version of route_question()."""
+    last_message = state["messages"][-1]
+
+    if not isinstance(last_message, HumanMessage):
+        raise ValueError("Expected last message to be a HumanMessage.")
+
+    if LOCAL_ROUTER_ENABLED:
+        if local_router.keyword_route(last_message.content) is None:
+            # Embed asynchronously first; the router then finds the embedding memoized
+            await _aembed_query(last_message.content)
+        decision = local_router.route(last_message.content)
+        route = decision.route if decision.route is not None else await allm_route(last_message.content)
+    else:
+        route = await allm_route(last_message.content)
+
+    if route == "retrieve" and not await _await_index():
+        route = "warming_up"
+    ROUTES.inc(route=route)
+    return route
+
+
+def route(state: State) -> dict:
+    """
+    Speculative mode only ("router" node): records the routing decision in the state. Runs in the same step
+    as the retrieve node, so routing and retrieval overlap.
+    """
+    return {"route": route_question(state)}
 
-    if "tool" in decision:
-        return "tool_agent"
-    return "retrieve"
 
+async def aroute(state: State) -> dict:
+    """Async version of route()."""
+    return {"route": await aroute_question(state)}
 
 
-def build_and_compile_graph():
+def dispatch(state: State) -> dict:
+    """
+    Speculative mode only: joins the route and retrieve branches. The speculatively retrieved
+    context is discarded when the message goes to the tool agent.
+    """
+    if state["route"] != "retrieve":
+        return {"context": []}
+    return {}
+
+
+# The reply to questions that arrive before the documents are indexed
+_WARMING_UP_MESSAGE = "אני עדיין טוען את המסמכים ואוכל לענות על שאלות בעוד מספר רגעים. אנא נסה שוב בקרוב."
+
+
+# --- Batch versions of the nodes, for offline replays of many questions (see src/batch.py) ---
+
+def embed_queries(queries: list[str]) -> list[list[float]]:
+    """
+    Embeds many queries at once: the ones not memoized yet are sent to the model together,
+    and all of them are memoized for the router and retrieval, as _embed_query() does.
+    """
+    embeddings = {query: _cached_query_embedding(query) for query in dict.fromkeys(queries)}
+    missing = [query for query, embedding in embeddings.items() if embedding is None]
+    if missing:
+        for query, embedding in zip(missing, get_vector_store().embeddings.embed_queries(missing)):
+            embeddings[query] = embedding
+            _remember_query_embedding(query, embedding)
+    return [embeddings[query] for query in queries]
+
+
+def route_batch(queries: list[str], max_concurrency: int) -> list[Union[str, Exception]]:
+    """
+    Batch version of route_question(), for queries whose embeddings were just computed with
+    embed_queries(). The messages the local router is not confident about are routed with one
+    batched LLM call (see llm_route_batch()). The document index is expected to be ready.
+
+    Returns:
+        Per query, "tool_agent" or "retrieve", or the exception its routing LLM call raised.
+    """
+    routes: list = [local_router.route(query).route if LOCAL_ROUTER_ENABLED else None for query in queries]
+    undecided = [i for i, route in enumerate(routes) if route is None]
+    for i, route in zip(undecided, llm_route_batch([queries[i] for i in undecided], max_concurrency)):
+        routes[i] = route
+    for route in routes:
+        if isinstance(route, str):
+            ROUTES.inc(route=route)
+    return routes
+
+
+def retrieve_batch(queries: list[str]) -> list[list]:
+    """
+    Batch version of retrieve(): the vector search of all the queries is one vectorized top-k
+    (see NumpyVectorStore.similarity_search_by_vectors()), and their BM25 searches run on the
+    search executor meanwhile.
+
+    Returns:
+        The documents passed to the LLM for each query.
+    """
+    wait_for_index()
+    embeddings = embed_queries(queries)
+    if HYBRID_SEARCH_ENABLED:
+        lexical_futures = [_search_executor.submit(get_lexical_index().search, query, RETRIEVAL_CANDIDATES)
+                           for query in queries]
+        vector_results = get_vector_store().similarity_search_by_vectors(embeddings, RETRIEVAL_CANDIDATES)
+        candidates = [_fuse(vector_docs, future.result()) for vector_docs, future in zip(vector_results, lexical_futures)]
+    else:
+        candidates = get_vector_store().similarity_search_by_vectors(embeddings, _candidate_count)
+
+    retrieved = [_select_context(embedding, docs) for embedding, docs in zip(embeddings, candidates)]
+    for docs in retrieved:
+        RETRIEVED_DOCUMENTS.observe(len(docs))
+    return retrieved
+
+
+def generate_batch(states: list[State], max_concurrency: int) -> list[Union[dict, Exception]]:
+    """
+    Batch version of generate(): the prompts go through the chat model's batch interface, with at
+    most `max_concurrency` calls in flight. Unlike generate(), it has no side effects: an answer
+    the LLM doesn't know is not escalated to the human service queue (only reported), and no
+    answer is stored in the response cache.
+
+    Returns:
+        Per state, {"answer": the reply the user would get, "escalated": whether the question
+        would have been escalated}, or the exception its LLM call raised.
+    """
+    if not states:
+        return []
+    prompts = [_generation_prompt(state) for state in states]
+    config = {"run_name": "generate", "max_concurrency": max_concurrency, "callbacks": [metrics_callback]}
+    results = []
+    for response in get_llm().batch(prompts, config=config, return_exceptions=True):
+        if isinstance(response, Exception):
+            results.append(response)
+        elif _is_dont_know(response.content):
+            results.append({"answer": _ESCALATION_MESSAGE, "escalated": True})
+        else:
+            results.append({"answer": response.content, "escalated": False})
+    return results
+
+
+def warming_up(state: State) -> dict:
+    """Answers a question that came in before the document index was ready (tool requests still run)."""
+    return {"messages": [AIMessage(content=_WARMING_UP_MESSAGE)]}
+
+
+def build_and_compile_graph(speculative_retrieval: bool = SPECULATIVE_RETRIEVAL_ENABLED):
+    """
+    Builds the chatbot graph.
+
+    Args:
+        speculative_retrieval: If True, retrieval starts in parallel with routing (see
+            SPECULATIVE_RETRIEVAL_ENABLED); otherwise it only starts once the message is routed.
+    """
     graph_builder = StateGraph(State)
 
     # Define the nodes (these are the actual processing steps)
     # The 'entry_point_router' node will simply pass the state along and immediately
     # trigger the conditional edge based on route_question.
     graph_builder.add_node("entry_point_router", lambda x: x)  # A simple pass-through node
-    graph_builder.add_node("retrieve", retrieve)
-    graph_builder.add_node("generate", generate)
-    graph_builder.add_node("tool_agent", run_agent)  # The node for running LangChain tools
+    # Every node has a sync and an async implementation, so the graph can be driven with
+    # invoke() as well as ainvoke()
+    graph_builder.add_node("cache_lookup", _node("cache_lookup", cache_lookup, acache_lookup))
+    graph_builder.add_node("retrieve", _node("retrieve", retrieve, aretrieve))
+    graph_builder.add_node("generate", _node("generate", generate, agenerate))
+    graph_builder.add_node("tool_agent", _node("tool_agent", run_agent, arun_agent))  # The node for running LangChain tools
+    graph_builder.add_node("warming_up", warming_up)
 
     # Set the 'entry_point_router' node as the initial entry point
     graph_builder.set_entry_point("entry_point_router")
 
-    # Add conditional edges from 'entry_point_router'
-    # The 'route_question' function is used here to define the routing logic.
+    if speculative_retrieval:
+        # Routing and retrieval run in the same step; 'dispatch' waits for both before continuing
+        graph_builder.add_node("router", _node("route", route, aroute))
+        graph_builder.add_node("dispatch", dispatch)
+        graph_builder.add_edge("entry_point_router", "router")
+        graph_builder.add_edge("entry_point_router", "retrieve")
+        graph_builder.add_edge(["router", "retrieve"], "dispatch")
+        graph_builder.add_conditional_edges(
+            "dispatch",
+            lambda state: state["route"],
+            {
+                "tool_agent": "tool_agent",
+                "retrieve": "cache_lookup",  # The query embedding is memoized, so this lookup is cheap
+                "warming_up": "warming_up"
+            }
+        )
+        # The context is already retrieved, so a cache miss goes straight to generation
+        after_cache_miss = "generate"
+    else:
+        # Add conditional edges from 'entry_point_router'
+        # The 'route_question' function is used here to define the routing logic.
+        graph_builder.add_conditional_edges(
+            "entry_point_router",  # FROM this node
+            _node("route", route_question, aroute_question),  # Use this function to decide WHERE to go
+            {
+                "tool_agent": "tool_agent",  # If route_question returns "tool_agent", go to tool_agent
+                "retrieve": "cache_lookup",  # If route_question returns "retrieve", check the response cache first
+                "warming_up": "warming_up"  # The document index is not ready yet
+            }
+        )
+        # Define the rest of the RAG flow (after retrieve)
+        graph_builder.add_edge("retrieve", "generate")
+        after_cache_miss = "retrieve"
+
+    # A cached answer ends the turn; otherwise continue with the RAG flow
     graph_builder.add_conditional_edges(
-        "entry_point_router",  # FROM this node
-        route_question,  # Use this function to decide WHERE to go
+        "cache_lookup",
+        lambda state: "hit" if state.get("cache_hit") else "miss",
         {
-            "tool_agent": "tool_agent",  # If route_question returns "tool_agent", go to tool_agent
-            "retrieve": "retrieve"  # If route_question returns "retrieve", go to retrieve
+            "hit": END,
+            "miss": after_cache_miss
         }
     )
 
-    # Define the rest of the RAG flow (after retrieve)
-    graph_builder.add_edge("retrieve", "generate")
-
     # Set finish points for both potential flows
     graph_builder.set_finish_point("generate")
     graph_builder.set_finish_point("tool_agent")
+    graph_builder.set_finish_point("warming_up")
 
     # Checkpoint for state persistence
-    checkpointer = MemorySaver()
+    checkpointer = SQLiteCheckpointSaver() if PERSISTENT_CHECKPOINTS_ENABLED else MemorySaver()
 
     return graph_builder.compile(checkpointer=checkpointer)
 
 
-# The compiled graph instance
-compiled_rag_graph = build_and_compile_graph()
+_compiled_graph = None
+_compiled_graph_lock = threading.Lock()
+
+
+def get_compiled_graph():
+    """Returns the compiled graph, building it on first use."""
+    global _compiled_graph
+    with _compiled_graph_lock:
+        if _compiled_graph is None:
+            _compiled_graph = build_and_compile_graph()
+        return _compiled_graph
+
+
+def __getattr__(name: str):
+    # `compiled_rag_graph` is built on first access rather than at import
+    if name == "compiled_rag_graph":
+        return get_compiled_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,30 +1,354 @@
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.vectorstores import InMemoryVectorStore
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePath
+from typing import Optional
 
-from src.config import PDF_DATA_PATH, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDINGS_MODEL
+from langchain_core.documents import Document
 
-def index_documents(vector_store_instance: InMemoryVectorStore) -> None:
+from src.config import PDF_DATA_PATH, REINDEX_INTERVAL_SECONDS, get_embeddings
+from src.config import ANN_INDEX_ENABLED, ANN_INDEX_FILE, ANN_MIN_VECTORS, ANN_NPROBE, LEXICAL_INDEX_FILE
+from src.ann_index import IVFIndex, default_n_lists
+from src.document_loader import load_and_split_files
+from src.embedding_cache import CachedEmbeddings, build_cached_embeddings
+from src.embedding_pipeline import BatchedEmbeddings
+from src.lexical_index import LexicalIndex
+from src.response_cache import response_cache
+from src.vector_store import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Same file pattern PyPDFDirectoryLoader uses by default
+PDF_GLOB = "**/[!.]*.pdf"
+
+
+def _scan_pdf_files(data_path: str) -> dict[str, Path]:
+    """
+    Lists the visible PDF files under the data directory.
+
+    Returns:
+        A dictionary mapping each file's source string (as stored in chunk metadata) to its path,
+        in a stable, sorted order.
+    """
+    root = Path(data_path)
+    files = {}
+    for path in sorted(root.glob(PDF_GLOB)):
+        relative = path.relative_to(root)
+        if path.is_file() and not any(part.startswith(".") for part in PurePath(relative).parts):
+            files[str(path)] = path
+    return files
+
+
+def _file_sha256(path: Path) -> str:
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _chunk_ids(source: str, count: int) -> list[str]:
+    """Returns stable vector store IDs for the chunks of a file."""
+    return [f"{source}#{index}" for index in range(count)]
+
+
+def _swap_chunks(vector_store_instance: NumpyVectorStore, stale_ids: list[str],
+                 new_chunks: list[Document], new_ids: list[str],
+                 lexical_index_instance: Optional[LexicalIndex] = None) -> None:
+    """
+    Replaces stale chunks with new ones in a single step.
+
+    The new chunks are embedded first, then the stale chunks are deleted and the new ones
+    added under the store's write lock, so searches never see a half-updated index.
+    The lexical index is updated on a separate thread while the embeddings are computed.
+    """
+    texts = [chunk.page_content for chunk in new_chunks]
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        lexical_update = None
+        if lexical_index_instance is not None:
+            lexical_update = executor.submit(lexical_index_instance.update, texts, new_ids, stale_ids)
+        vectors = vector_store_instance.embeddings.embed_documents(texts)
+        vector_store_instance.add_vectors(new_chunks, vectors, ids=new_ids, delete_ids=stale_ids)
+        if lexical_update is not None:
+            lexical_update.result()
+
+
+def _sync_into(vector_store_instance: NumpyVectorStore, manifest: dict, data_path: str,
+               lexical_index_instance: Optional[LexicalIndex] = None) -> dict:
+    """
+    Brings the vector store in line with the PDF files on disk.
+
+    A file is considered unchanged when its size and modification time match the manifest,
+    or when its content hash does. Only new and changed files are re-loaded and re-split,
+    and the chunks of changed and removed files are deleted from the store.
+    Changed files are parsed and split in parallel worker processes.
+
+    Args:
+        vector_store_instance: The vector store to update.
+        manifest: The manifest of the files currently indexed in the store. Updated in place.
+        data_path: The directory holding the PDF files.
+        lexical_index_instance: The lexical index to keep in line with the store, if any.
+
+    Returns:
+        A summary with the lists of added, updated and removed files.
+    """
+    summary = {"added": [], "updated": [], "removed": []}
+    stale_ids, new_chunks, new_ids = [], [], []
+    new_entries = {}
+    to_load = []
+
+    on_disk = _scan_pdf_files(data_path)
+    for source, path in on_disk.items():
+        stat = path.stat()
+        entry = manifest.get(source)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+
+        sha256 = _file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            # Touched but not edited: just remember the new modification time
+            entry["mtime"] = stat.st_mtime
+            continue
+
+        if entry:
+            stale_ids.extend(entry["chunk_ids"])
+            summary["updated"].append(source)
+        else:
+            summary["added"].append(source)
+        new_entries[source] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+        to_load.append(source)
+
+    for source, chunks in load_and_split_files(to_load):
+        ids = _chunk_ids(source, len(chunks))
+        new_chunks.extend(chunks)
+        new_ids.extend(ids)
+        new_entries[source]["chunk_ids"] = ids
+
+    for source in [source for source in manifest if source not in on_disk]:
+        stale_ids.extend(manifest[source]["chunk_ids"])
+        summary["removed"].append(source)
+
+    if stale_ids or new_chunks:
+        _swap_chunks(vector_store_instance, stale_ids, new_chunks, new_ids, lexical_index_instance)
+        for source in summary["removed"]:
+            del manifest[source]
+        manifest.update(new_entries)
+
+    return summary
+
+
+def _attach_ann_index(vector_store_instance: NumpyVectorStore) -> None:
+    """
+    Attaches the IVF index to the store when it is enabled and the corpus is large enough.
+    A saved index is loaded from ANN_INDEX_FILE; otherwise a new one is trained and saved.
+    """
+    if not ANN_INDEX_ENABLED or vector_store_instance.ann_index is not None:
+        return
+    if len(vector_store_instance) < ANN_MIN_VECTORS:
+        return
+
+    if ANN_INDEX_FILE.exists():
+        try:
+            vector_store_instance.set_ann_index(IVFIndex.load(ANN_INDEX_FILE))
+            logger.info("ANN index loaded from %s.", ANN_INDEX_FILE)
+            return
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not use the ANN index in %s (%s). Rebuilding it.", ANN_INDEX_FILE, e)
+
+    ann_index = vector_store_instance.build_ann_index(default_n_lists(len(vector_store_instance)))
+    ann_index.save(ANN_INDEX_FILE, vector_store_instance.ann_assignments())
+    logger.info("ANN index with %d lists built and saved to %s.", ann_index.n_lists, ANN_INDEX_FILE)
+
+
+def index_documents(vector_store_instance: NumpyVectorStore,
+                    lexical_index_instance: Optional[LexicalIndex] = None) -> dict:
     """
     Loads PDF documents from a specified directory, splits them into chunks,
     and indexes them into the provided vector store.
 
     Args:
-        vector_store_instance: An initialized InMemoryVectorStore instance.
+        vector_store_instance: An initialized NumpyVectorStore instance.
+        lexical_index_instance: An optional lexical index to build alongside the vector store.
+                                Chunks it already holds (e.g. loaded from disk) are not re-tokenized.
+
+    Returns:
+        The manifest of the indexed files, to be passed to later incremental syncs.
+    """
+    logger.info("Loading and splitting documents from %s...", PDF_DATA_PATH)
+    manifest = {}
+    summary = _sync_into(vector_store_instance, manifest, PDF_DATA_PATH, lexical_index_instance)
+
+    if lexical_index_instance is not None:
+        # Drop chunks of files that were removed while the bot was down
+        lexical_index_instance.retain({doc_id for entry in manifest.values() for doc_id in entry["chunk_ids"]})
+        lexical_index_instance.save(LEXICAL_INDEX_FILE)
+
+    logger.info("Indexed %d chunks from %d files.", len(vector_store_instance), len(summary['added']))
+    embeddings = vector_store_instance.embeddings
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.info("Embeddings reused from cache: %d, newly embedded: %d", embeddings.hits, embeddings.misses)
+    _attach_ann_index(vector_store_instance)
+    logger.info("Document indexing complete.")
+    return manifest
+
+
+# Global instances of the vector store and the lexical index, created on first use (see get_vector_store())
+_vector_store: Optional[NumpyVectorStore] = None
+_lexical_index: Optional[LexicalIndex] = None
+_stores_lock = threading.Lock()
+_manifest: dict = {}
+# Serializes the initial indexing and incremental syncs (on-demand calls and the background thread)
+_sync_lock = threading.Lock()
+# Set once the PDFs are indexed; until then the vector store is empty
+index_ready = threading.Event()
+_indexing_thread: Optional[threading.Thread] = None
+_indexing_thread_lock = threading.Lock()
+# Why the last indexing attempt failed, reported to the callers that waited for it
+_indexing_error: Optional[Exception] = None
+
+
+class IndexingError(Exception):
+    """Raised by wait_for_index() when indexing the documents failed."""
+
+
+def _create_stores() -> None:
+    global _vector_store, _lexical_index
+    with _stores_lock:
+        if _vector_store is None:
+            # The in-memory store is indexed once, in the background (see start_indexing()); later changes are
+            # synced incrementally. Chunk embeddings are served from the on-disk cache, so a restart only embeds
+            # new chunks, and those are sent to the model in concurrent, retried batches.
+            _vector_store = NumpyVectorStore(build_cached_embeddings(BatchedEmbeddings(get_embeddings())),
+                                             nprobe=ANN_NPROBE, ann_min_vectors=ANN_MIN_VECTORS)
+            # BM25 index over the same chunks, saved next to the PDFs so a restart only tokenizes changed chunks
+            _lexical_index = LexicalIndex.load(LEXICAL_INDEX_FILE)
+
+
+def get_vector_store() -> NumpyVectorStore:
+    """Returns the global vector store, creating it (empty until indexed) on first use."""
+    _create_stores()
+    return _vector_store
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Returns the global BM25 index, loading the saved one on first use."""
+    _create_stores()
+    return _lexical_index
+
+
+def __getattr__(name: str):
+    # `vector_store` and `lexical_index` are created on first access rather than at import
+    if name == "vector_store":
+        return get_vector_store()
+    if name == "lexical_index":
+        return get_lexical_index()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _run_indexing() -> None:
+    global _indexing_thread, _indexing_error
+    start = time.perf_counter()
+    try:
+        with _sync_lock:
+            if not index_ready.is_set():
+                _manifest.update(index_documents(get_vector_store(), get_lexical_index()))
+                index_ready.set()
+        _indexing_error = None
+        logger.info("Document index ready after %.1fs.", time.perf_counter() - start)
+    except Exception as e:
+        logger.exception("Indexing the documents failed: %s. It will be retried on the next request.", e)
+        with _indexing_thread_lock:
+            _indexing_error = e
+            _indexing_thread = None
+
+
+def start_indexing() -> Optional[threading.Thread]:
+    """
+    Indexes PDF_DATA_PATH into the global vector store in a background thread, unless that
+    was already started. Returns immediately; index_ready is set once the index is built.
+
+    Returns:
+        The indexing thread, or None if the index is already built.
+    """
+    global _indexing_thread
+    with _indexing_thread_lock:
+        if _indexing_thread is None and not index_ready.is_set():
+            _indexing_thread = threading.Thread(target=_run_indexing, name="document-indexing", daemon=True)
+            _indexing_thread.start()
+        return _indexing_thread
+
+
+def wait_for_index(timeout: Optional[float] = None) -> bool:
+    """
+    Starts indexing if needed and waits until the index is built. A failed attempt is
+    retried by the next call.
+
+    Args:
+        timeout: The maximum number of seconds to wait, or None to wait without limit.
+
+    Returns:
+        True if the index is ready, False if the timeout passed first.
+
+    Raises:
+        IndexingError: If the indexing attempt waited for failed.
+    """
+    if index_ready.is_set():
+        return True
+    thread = start_indexing()
+    if thread is not None:
+        thread.join(timeout)
+    if index_ready.is_set():
+        return True
+    if thread is not None and not thread.is_alive():
+        error = _indexing_error
+        raise IndexingError(f"Indexing the documents failed: {error}") from error
+    return False
+
+
+def sync_documents() -> dict:
+    """
+    Incrementally re-indexes PDF_DATA_PATH into the global vector store, without restarting.
+    Safe to call while queries are being answered. Waits for the initial indexing first.
+
+    Returns:
+        A summary with the lists of added, updated and removed files.
+    """
+    wait_for_index()
+    vector_store, lexical_index = get_vector_store(), get_lexical_index()
+    with _sync_lock:
+        summary = _sync_into(vector_store, _manifest, PDF_DATA_PATH, lexical_index)
+        _attach_ann_index(vector_store)
+        if any(summary.values()):
+            lexical_index.save(LEXICAL_INDEX_FILE)
+            # Cached answers may be based on documents that just changed
+            response_cache.clear()
+    if any(summary.values()):
+        logger.info("Document index synced: %d added, %d updated, %d removed.",
+                    len(summary['added']), len(summary['updated']), len(summary['removed']))
+    return summary
+
+
+def start_background_sync(interval_seconds: float = REINDEX_INTERVAL_SECONDS) -> threading.Event:
     """
-    print(f"Loading documents from {PDF_DATA_PATH}...")
-    loader = PyPDFDirectoryLoader(PDF_DATA_PATH)
-    docs = loader.load()
+    Starts a daemon thread that calls sync_documents() every interval_seconds.
 
-    print(f"Splitting {len(docs)} documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-    all_splits = text_splitter.split_documents(docs)
+    Args:
+        interval_seconds: The time to wait between two syncs.
+
+    Returns:
+        An Event that stops the background thread when set.
+    """
+    stop_event = threading.Event()
 
-    print(f"Adding {len(all_splits)} chunks to the vector store...")
-    vector_store_instance.add_documents(documents=all_splits)
-    print("Document indexing complete.")
+    def _run():
+        while not stop_event.wait(interval_seconds):
+            try:
+                sync_documents()
+            except Exception as e:
+                logger.exception("Background document sync failed: %s", e)
 
-# Global instance of vector store (initialized once)
-# For InMemoryVectorStore, it needs to be initialized and indexed only once.
-vector_store = InMemoryVectorStore(EMBEDDINGS_MODEL)
-index_documents(vector_store)
+    threading.Thread(target=_run, name="document-sync", daemon=True).start()
+    return stop_event
@@ -0,0 +1,204 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from pydantic import BaseModel, ValidationError
+
+from src.tools import AddVendorSchema, UpdateUserSchema
+
+# Field names as users write them, in Hebrew and English. Longer names come first, so that
+# e.g. "כתובת המייל" (email address) is not taken for "כתובת" (address).
+_FIELD_NAMES = {
+    "email": ["email address", "e-mail address", "email", "e-mail", "mail",
+              "כתובת המייל", "כתובת האימייל", "כתובת הדוא\"ל", "המייל", "האימייל", "הדוא\"ל", "מייל", "אימייל", "דוא\"ל"],
+    "phone": ["phone number", "telephone number", "phone", "telephone",
+              "מספר הטלפון", "מספר טלפון", "הטלפון", "טלפון"],
+    "address": ["address", "הכתובת", "כתובת"],
+    "name": ["full name", "name", "השם המלא", "השם", "שם"],
+}
+_FIELD_BY_NAME = {name: field for field, names in _FIELD_NAMES.items() for name in names}
+_FIELD = "|".join(re.escape(name) for name in sorted(_FIELD_BY_NAME, key=len, reverse=True))
+
+_USER_EN = r"(?:user|customer|client)\s*(?:id\s*)?(?:#|no\.?\s*|number\s*)?(?P<user>\d+)"
+_USER_HE = r"(?:ה)?(?:משתמש|לקוח)\s*(?:מספר\s*|#)?(?P<user>\d+)"
+_QUOTE = "['\"`׳״]?"
+_END = r"\s*[.!]?\s*$"
+
+_ADD_VENDOR_PATTERNS = [
+    # "Add vendor ABC to user 123", "Please add the supplier 'Acme' for customer 7"
+    re.compile(rf"^\s*(?:please\s+)?add\s+(?:the\s+|a\s+)?(?:new\s+)?(?:vendor|supplier)\s+(?:named\s+|called\s+)?"
+               rf"{_QUOTE}(?P<vendor>[^'\"`׳״?]+?){_QUOTE}\s+(?:to|for)\s+(?:the\s+)?{_USER_EN}{_END}", re.IGNORECASE),
+    # "הוסף את ספק 'ABC' למשתמש 123", "תוסיף ספק חדש בשם אלפא ללקוח 8"
+    re.compile(rf"^\s*(?:בבקשה\s+)?(?:הוסף|תוסיף|הוסיפו|תוסיפו|להוסיף)\s+(?:את\s+)?(?:ה)?ספק\s+(?:חדש\s+)?(?:בשם\s+)?"
+               rf"{_QUOTE}(?P<vendor>[^'\"`׳״?]+?){_QUOTE}\s+ל-?{_USER_HE}{_END}"),
+]
+
+_UPDATE_PATTERNS = [
+    # "Update user 1's email to new.email@example.com", "Change customer 3's phone to ... and name to ..."
+    re.compile(rf"^\s*(?:please\s+)?(?:update|change|set)\s+(?:the\s+)?{_USER_EN}'s\s+(?P<changes>.+?){_END}",
+               re.IGNORECASE),
+    # "Change the phone number of user 3 to 052-9876543"
+    re.compile(rf"^\s*(?:please\s+)?(?:update|change|set)\s+(?:the\s+)?(?P<first_field>{_FIELD})\s+(?:of|for)\s+"
+               rf"(?:the\s+)?{_USER_EN}\s+(?P<changes>to\s+.+?){_END}", re.IGNORECASE),
+    # "עדכן את כתובת המייל של משתמש 1 ל-new.email@example.com", "שנה את השם של משתמש 2 לדני כהן"
+    re.compile(rf"^\s*(?:בבקשה\s+)?(?:עדכן|תעדכן|עדכנו|תעדכנו|שנה|תשנה|שנו|תשנו)\s+(?:את\s+)?"
+               rf"(?P<first_field>{_FIELD})\s+של\s+{_USER_HE}\s+(?P<changes>ל.+?){_END}"),
+]
+
+# Splits "phone to X and name to Y" / "ל-X ואת השם ל-Y" into one change per field; a split is
+# only made where the next change starts with a field name, so values may contain "and"
+_NEXT_CHANGE_EN = re.compile(rf"\s*(?:,|\band\b)\s*(?:the\s+)?(?=(?:{_FIELD})\s+to\s)", re.IGNORECASE)
+_NEXT_CHANGE_HE = re.compile(rf"\s*(?:,\s*)?\s+ו(?:את\s+)?(?=(?:{_FIELD})\s+ל)")
+_CHANGE_EN = re.compile(rf"^(?:(?:the\s+)?(?P<field>{_FIELD})\s+)?to\s+(?P<value>.+)$", re.IGNORECASE)
+_CHANGE_HE = re.compile(rf"^(?:(?P<field>{_FIELD})\s+)?ל-?(?P<value>.+)$")
+
+# A value is used only when it looks like a value of its field
+_VALID_VALUE = {
+    "email": re.compile(r"^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$"),
+    "phone": re.compile(r"^\+?\d[\d\s-]{6,16}\d$"),
+    "address": re.compile(r"^[^?@]{3,100}$"),
+    "name": re.compile(r"^[^\W\d_]+(?:[\s'.-]+[^\W\d_]+){0,3}\.?$"),
+}
+_VALID_VENDOR = re.compile(r"^[\w&.,'\- ]{1,60}$")
+
+
+@dataclass
+class ToolCommand:
+    """A tool call parsed from a message, with its arguments in the tool's args schema."""
+    tool_name: str  # "add_vendor_to_user" or "update_user_details"
+    args: BaseModel  # An AddVendorSchema or UpdateUserSchema
+
+
+def _strip_value(value: str) -> str:
+    return value.strip().strip("'\"`׳״").strip()
+
+
+def _parse_changes(first_field: Optional[str], changes: str, hebrew: bool) -> Optional[dict]:
+    """Parses "email to X and phone to Y" (or its Hebrew form) into {"email": X, "phone": Y}."""
+    splitter, change_pattern = (_NEXT_CHANGE_HE, _CHANGE_HE) if hebrew else (_NEXT_CHANGE_EN, _CHANGE_EN)
+    fields = {}
+    for i, part in enumerate(splitter.split(changes)):
+        match = change_pattern.match(part.strip())
+        if match is None:
+            return None
+        name = match.group("field") or (first_field if i == 0 else None)
+        if name is None:
+            return None
+        field = _FIELD_BY_NAME.get(name.lower(), _FIELD_BY_NAME.get(name))
+        value = _strip_value(match.group("value"))
+        if field is None or field in fields or not _VALID_VALUE[field].match(value):
+            return None
+        fields[field] = value
+    return fields
+
+
+def parse_tool_command(text: str) -> Optional[ToolCommand]:
+    """
+    Parses the common phrasings of the two tool commands, in Hebrew and English.
+
+    Only a message that is entirely one command, with values that look right for their
+    fields, is parsed; anything else (extra requests, questions, unusual values) returns
+    None and is left to the tool-calling agent.
+
+    Args:
+        text: The user's message.
+
+    Returns:
+        The parsed command, or None when the message is not confidently one of them.
+    """
+    text = text.strip()
+    try:
+        for pattern in _ADD_VENDOR_PATTERNS:
+            match = pattern.match(text)
+            if match:
+                vendor_name = _strip_value(match.group("vendor"))
+                if not _VALID_VENDOR.match(vendor_name):
+                    return None
+                return ToolCommand("add_vendor_to_user",
+                                   AddVendorSchema(user_id=int(match.group("user")), vendor_name=vendor_name))
+
+        for pattern in _UPDATE_PATTERNS:
+            match = pattern.match(text)
+            if match:
+                first_field = match.groupdict().get("first_field")
+                hebrew = not text[:1].isascii()
+                fields = _parse_changes(first_field, match.group("changes"), hebrew)
+                if not fields:
+                    return None
+                return ToolCommand("update_user_details",
+                                   UpdateUserSchema(user_id=int(match.group("user")), **fields))
+    except ValidationError:
+        return None
+    return None
+
+
+_FIELD_LABELS = {
+    "Hebrew": {"name": "השם", "phone": "מספר הטלפון", "address": "הכתובת", "email": "כתובת המייל"},
+    "English": {"name": "name", "phone": "phone number", "address": "address", "email": "email address"},
+}
+_REPLY_TEMPLATES = {
+    "Hebrew": {
+        "vendor_added": "הספק '{vendor_name}' נוסף בהצלחה למשתמש {user_id}.",
+        "vendor_exists": "הספק '{vendor_name}' כבר קיים אצל משתמש {user_id}.",
+        "user_updated": "עודכנו בהצלחה הפרטים של משתמש {user_id}: {fields}.",
+        "user_not_found": "לא נמצא משתמש עם המספר {user_id}.",
+    },
+    "English": {
+        "vendor_added": "Vendor '{vendor_name}' was added to user {user_id}.",
+        "vendor_exists": "User {user_id} already has vendor '{vendor_name}'.",
+        "user_updated": "The {fields} of user {user_id} were updated.",
+        "user_not_found": "There is no user with ID {user_id}.",
+    },
+}
+
+
+def format_tool_reply(command: ToolCommand, result: str, language: str) -> str:
+    """
+    Writes the reply to a command that was run directly, in the user's language.
+
+    Args:
+        command: The command that was run.
+        result: The message the tool returned.
+        language: The language of the reply (Hebrew or English; others get the tool's message).
+
+    Returns:
+        The reply text.
+    """
+    if "successfully added" in result:
+        outcome = "vendor_added"
+    elif "already exists" in result:
+        outcome = "vendor_exists"
+    elif "successfully updated" in result:
+        outcome = "user_updated"
+    elif "not found" in result:
+        outcome = "user_not_found"
+    else:
+        return result
+    templates, labels = _REPLY_TEMPLATES.get(language), _FIELD_LABELS.get(language)
+    if templates is None:
+        return result
+    args = command.args.model_dump(exclude_none=True)
+    fields = ", ".join(labels[field] for field in args if field in labels)
+    return templates[outcome].format(fields=fields, **args)
+
+
+# --- Coverage and accuracy on the router's labelled examples ---
+if __name__ == "__main__":
+    import time
+
+    from src.router import RETRIEVE_EXAMPLES, TOOL_EXAMPLES
+
+    parsed = 0
+    for text in TOOL_EXAMPLES:
+        command = parse_tool_command(text)
+        parsed += command is not None
+        print(f"{text!r} -> {command.tool_name + ' ' + str(command.args.model_dump(exclude_none=True)) if command else None}")
+    false_positives = [text for text in RETRIEVE_EXAMPLES if parse_tool_command(text) is not None]
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for text in TOOL_EXAMPLES + RETRIEVE_EXAMPLES:
+            parse_tool_command(text)
+    per_message_ms = (time.perf_counter() - start) / (1000 * len(TOOL_EXAMPLES + RETRIEVE_EXAMPLES)) * 1000
+    print(f"Parsed {parsed}/{len(TOOL_EXAMPLES)} tool commands; questions parsed as commands: {false_positives}; "
+          f"{per_message_ms:.3f} ms per message")
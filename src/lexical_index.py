@@ -0,0 +1,301 @@
+import hashlib
+import logging
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Deleted documents are purged from the postings lists once they make up this share of the index
+_COMPACTION_RATIO = 0.25
+_FORMAT_VERSION = 1
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+_HEBREW_NIQQUD = re.compile(r"[\u0591-\u05C7]")
+# One-letter Hebrew prefixes (and, the, in, to, from, that, as) that attach to the next word
+_HEBREW_PREFIXES = "ובהלמשכ"
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits Hebrew/English text into lowercase index terms.
+
+    Hebrew niqqud is removed, and for Hebrew words that start with one or two prefix letters
+    the stripped forms are emitted as well, so "והספק" also matches "ספק".
+    Numbers and codes (e.g. form numbers) are kept as terms.
+
+    Args:
+        text: The text to tokenize.
+
+    Returns:
+        The list of terms, in order, with repetitions.
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall(_HEBREW_NIQQUD.sub("", text).casefold()):
+        terms.append(token)
+        if "\u05D0" <= token[0] <= "\u05EA":
+            stripped = token
+            for _ in range(2):
+                if len(stripped) > 3 and stripped[0] in _HEBREW_PREFIXES:
+                    stripped = stripped[1:]
+                    terms.append(stripped)
+                else:
+                    break
+    return terms
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """
+    Merges several ranked lists of IDs with reciprocal-rank fusion (score = sum of 1 / (k + rank)).
+
+    Args:
+        rankings: The ranked lists of IDs, best first.
+        k: The RRF damping constant.
+
+    Returns:
+        All IDs, ordered by fused score.
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class LexicalIndex:
+    """
+    An in-memory inverted index with BM25 scoring.
+
+    Documents are numbered internally; each term's postings list is a pair of compact arrays
+    (document numbers as uint32, term frequencies as uint16). Deleted documents are tombstoned
+    and purged from the postings lists in a periodic compaction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._doc_ids: list[Optional[str]] = []  # document number -> ID (None once deleted)
+        self._doc_numbers: dict[str, int] = {}
+        self._doc_hashes: dict[str, str] = {}
+        self._doc_lengths = array("I")
+        self._postings: dict[str, tuple[array, array]] = {}
+        self._total_length = 0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    # --- Writes ---
+
+    def _delete_unlocked(self, doc_id: str) -> None:
+        number = self._doc_numbers.pop(doc_id, None)
+        if number is None:
+            return
+        self._doc_hashes.pop(doc_id, None)
+        self._doc_ids[number] = None
+        self._total_length -= self._doc_lengths[number]
+        self._deleted += 1
+
+    def _compact_unlocked(self) -> None:
+        """Drops deleted documents from the postings lists and renumbers the remaining ones."""
+        renumber = {}
+        doc_ids, doc_lengths = [], array("I")
+        for number, doc_id in enumerate(self._doc_ids):
+            if doc_id is not None:
+                renumber[number] = len(doc_ids)
+                doc_ids.append(doc_id)
+                doc_lengths.append(self._doc_lengths[number])
+
+        postings = {}
+        for term, (docs, freqs) in self._postings.items():
+            new_docs, new_freqs = array("I"), array("H")
+            for number, freq in zip(docs, freqs):
+                if number in renumber:
+                    new_docs.append(renumber[number])
+                    new_freqs.append(freq)
+            if new_docs:
+                postings[term] = (new_docs, new_freqs)
+
+        self._doc_ids, self._doc_lengths, self._postings = doc_ids, doc_lengths, postings
+        self._doc_numbers = {doc_id: number for number, doc_id in enumerate(doc_ids)}
+        self._deleted = 0
+
+    def update(self, texts: list[str], ids: list[str], delete_ids: Optional[list[str]] = None) -> None:
+        """
+        Deletes and adds documents. A document whose ID is already indexed with the same text
+        is left untouched, so re-adding an unchanged corpus after a restart is cheap.
+
+        Args:
+            texts: The texts of the documents to add.
+            ids: The IDs of the documents to add.
+            delete_ids: The IDs of documents to remove first. Those re-added with the same text are kept.
+        """
+        hashes = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+        # Tokenize outside the lock; searches keep running meanwhile
+        tokens = [tokenize(text) if self._doc_hashes.get(doc_id) != digest else None
+                  for text, doc_id, digest in zip(texts, ids, hashes)]
+
+        with self._lock:
+            # Checked again under the lock, as a concurrent update may have changed a document since
+            unchanged = {doc_id for doc_id, digest in zip(ids, hashes) if self._doc_hashes.get(doc_id) == digest}
+            # A re-added document keeps its ID (e.g. the chunks of an edited file), so it is not deleted if unchanged
+            for doc_id in delete_ids or []:
+                if doc_id not in unchanged:
+                    self._delete_unlocked(doc_id)
+            for text, doc_id, digest, terms in zip(texts, ids, hashes, tokens):
+                if doc_id in unchanged:
+                    continue
+                if terms is None:
+                    terms = tokenize(text)  # Changed by a concurrent update since it was tokenized
+                self._delete_unlocked(doc_id)
+                number = len(self._doc_ids)
+                self._doc_ids.append(doc_id)
+                self._doc_numbers[doc_id] = number
+                self._doc_hashes[doc_id] = digest
+                self._doc_lengths.append(len(terms))
+                self._total_length += len(terms)
+
+                for term, freq in Counter(terms).items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(number)
+                    postings[1].append(freq if freq < 0xFFFF else 0xFFFF)
+
+            if self._deleted > _COMPACTION_RATIO * max(1, len(self._doc_ids)):
+                self._compact_unlocked()
+
+    def retain(self, ids: set[str]) -> None:
+        """Deletes every document whose ID is not in `ids`."""
+        with self._lock:
+            for doc_id in [doc_id for doc_id in self._doc_numbers if doc_id not in ids]:
+                self._delete_unlocked(doc_id)
+            if self._deleted:
+                self._compact_unlocked()
+
+    # --- Reads ---
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """
+        Ranks the documents against a query with BM25.
+
+        Args:
+            query: The query text.
+            k: The maximum number of results.
+
+        Returns:
+            Up to k (document ID, score) pairs, best first. Documents sharing no term with
+            the query are not returned.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            live_docs = len(self._doc_numbers)
+            if not live_docs or not terms:
+                return []
+            lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32).astype(np.float32)
+            length_norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self._total_length / live_docs))
+            scores = np.zeros(len(self._doc_ids), dtype=np.float32)
+
+            for term in terms:
+                if term not in self._postings:
+                    continue
+                docs_array, freqs_array = self._postings[term]
+                docs = np.frombuffer(docs_array, dtype=np.uint32)
+                freqs = np.frombuffer(freqs_array, dtype=np.uint16).astype(np.float32)
+                idf = np.log(1 + (live_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                scores[docs] += idf * freqs * (BM25_K1 + 1) / (freqs + length_norm[docs])
+
+            matched = np.flatnonzero(scores > 0)
+            if self._deleted:
+                matched = np.array([number for number in matched if self._doc_ids[number] is not None], dtype=np.int64)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            matched = matched[np.argsort(-scores[matched])]
+            return [(self._doc_ids[number], float(scores[number])) for number in matched]
+
+    # --- Persistence ---
+
+    def save(self, path: Path) -> None:
+        """Saves the index to a file, replacing it atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            state = {
+                "version": _FORMAT_VERSION,
+                "doc_ids": self._doc_ids,
+                "doc_hashes": self._doc_hashes,
+                "doc_lengths": self._doc_lengths,
+                "postings": self._postings,
+            }
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        """
+        Loads an index saved with save(). Returns an empty index if the file is missing,
+        unreadable or from another format version.
+        """
+        index = cls()
+        path = Path(path)
+        if not path.exists():
+            return index
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning("Could not load the lexical index from %s (%s). Starting with an empty index.", path, e)
+            return index
+        if state.get("version") != _FORMAT_VERSION:
+            return index
+
+        index._doc_ids = state["doc_ids"]
+        index._doc_hashes = state["doc_hashes"]
+        index._doc_lengths = state["doc_lengths"]
+        index._postings = state["postings"]
+        index._doc_numbers = {doc_id: n for n, doc_id in enumerate(index._doc_ids) if doc_id is not None}
+        index._total_length = sum(index._doc_lengths[n] for n in index._doc_numbers.values())
+        index._deleted = len(index._doc_ids) - len(index._doc_numbers)
+        return index
+
+
+# --- Build and query timings on a synthetic corpus ---
+if __name__ == "__main__":
+    import random
+    import time
+
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(20_000)] + ["ספק", "משתמש", "טופס", "הצהרה", "לקוח"]
+    texts = [" ".join(rng.choices(vocabulary, k=180)) + f" form-{i}" for i in range(20_000)]
+
+    index = LexicalIndex()
+    start = time.perf_counter()
+    index.update(texts, [str(i) for i in range(len(texts))])
+    print(f"Indexed {len(texts)} chunks in {time.perf_counter() - start:.2f}s")
+
+    queries = ["form 1234", "והספק של המשתמש", "term17 term912 term15000"] * 100
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, k=20)
+    print(f"Query latency: {(time.perf_counter() - start) / len(queries) * 1000:.2f} ms")
+    print(f"Top hit for 'form 1234': {index.search('form 1234', k=1)}")
+
+    # Re-sync of an edited file: its chunks keep their positional IDs, and only the changed one is re-indexed
+    edited = LexicalIndex()
+    edited.update(["acme supplies price list", "warranty terms for devices"], ["manual.pdf#0", "manual.pdf#1"])
+    edited.update(["acme supplies price list", "warranty terms for all devices"], ["manual.pdf#0", "manual.pdf#1"],
+                  delete_ids=["manual.pdf#0", "manual.pdf#1"])
+    print(f"After editing manual.pdf: {len(edited)} chunks, unchanged chunk found: "
+          f"{[doc_id for doc_id, _ in edited.search('acme')] == ['manual.pdf#0']}, "
+          f"edited chunk found: {[doc_id for doc_id, _ in edited.search('all')] == ['manual.pdf#1']}")
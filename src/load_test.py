@@ -0,0 +1,175 @@
+"""
+Load test of the async request path (aask_for_help -> compiled_rag_graph.ainvoke) against
+stub models with a fixed latency, so it runs offline and measures only this process.
+
+Usage: python -m src.load_test [concurrent sessions ...]
+
+Each session sends a few questions one after the other, as a Slack user would; the sessions
+themselves run concurrently on one event loop. With the synchronous path a single worker
+would serve one message at a time, so throughput would stay flat as sessions are added.
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, Optional
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import src.config as config
+
+LLM_LATENCY_SECONDS = 0.5
+EMBEDDING_LATENCY_SECONDS = 0.1
+TURNS_PER_SESSION = 3
+
+
+class StubChatModel(BaseChatModel):
+    """
+    A chat model that answers after a fixed delay, without blocking the event loop when awaited.
+    When streamed, the answer arrives word by word, spread over the same delay.
+    """
+    latency_seconds: float = LLM_LATENCY_SECONDS
+    answer: Optional[str] = None  # A fixed answer; by default the last message is echoed
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _answer(self, messages: list[BaseMessage]) -> str:
+        return self.answer if self.answer is not None else f"Stub answer to: {messages[-1].content}"
+
+    def _result(self, messages: list[BaseMessage]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    def _tokens(self, messages: list[BaseMessage]) -> list[str]:
+        words = self._answer(messages).split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages)
+        for token in tokens:
+            time.sleep(self.latency_seconds / len(tokens))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._tokens(messages)
+        for token in tokens:
+            await asyncio.sleep(self.latency_seconds / len(tokens))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return self._result(messages)
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def get_num_tokens_from_messages(self, messages, tools=None) -> int:
+        return sum(len(str(message.content)) // 4 + 1 for message in messages)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    A chat model that returns prepared messages in order, e.g. AIMessages with tool_calls
+    followed by a final answer, to drive the tool-calling agent without an LLM.
+    """
+    responses: list[AIMessage]
+    latency_seconds: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _next_result(self) -> ChatResult:
+        message = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        return self._next_result()
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency_seconds)
+        return self._next_result()
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class StubEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic embeddings with a fixed delay per request (query or batch), like a remote embeddings API."""
+    latency_seconds: float = EMBEDDING_LATENCY_SECONDS
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency_seconds)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency_seconds)
+        return super().embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency_seconds)
+        return super().embed_query(text)
+
+
+def install_stub_models(llm: Optional[BaseChatModel] = None, embeddings: Optional[StubEmbeddings] = None) -> None:
+    """
+    Swaps the stubs into src.config. Must run before the chatbot modules are imported, as they
+    read the file paths at import time. The embedding cache and the conversation checkpoints go to
+    a temporary directory, so stub vectors and test conversations never reach the real files.
+    """
+    config.LLM = llm or StubChatModel()
+    config.EMBEDDINGS_MODEL = embeddings or StubEmbeddings(size=256)
+    config.EMBEDDINGS_MODEL_NAME = "load-test-stub"
+    scratch_dir = Path(tempfile.mkdtemp())
+    config.EMBEDDINGS_CACHE_FILE = scratch_dir / "embeddings_cache.sqlite"
+    config.CHECKPOINT_DB_FILE = scratch_dir / "checkpoints.sqlite"
+
+
+async def run_session(session_index: int, latencies: list[float]) -> None:
+    for turn in range(TURNS_PER_SESSION):
+        start = time.perf_counter()
+        await aask_for_help(f"What does section {turn} say about topic {session_index}?",
+                            session_id=f"load-test-{session_index}", language="English")
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_load(sessions: int) -> None:
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(i, latencies) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    print(f"{sessions:>4} sessions: {len(latencies) / elapsed:7.1f} messages/s, "
+          f"latency p50 {np.percentile(latencies, 50):.2f}s p95 {np.percentile(latencies, 95):.2f}s")
+
+
+if __name__ == "__main__":
+    install_stub_models()
+
+    from src.main import aask_for_help
+    from src.response_cache import response_cache
+
+    response_cache.enabled = False  # Every message should run the full pipeline
+    concurrency_levels = [int(arg) for arg in sys.argv[1:]] or [1, 10, 50, 200]
+    print(f"Stub LLM latency {LLM_LATENCY_SECONDS}s, embedding latency {EMBEDDING_LATENCY_SECONDS}s, "
+          f"{TURNS_PER_SESSION} turns per session")
+    for sessions in concurrency_levels:
+        asyncio.run(run_load(sessions))
@@ -0,0 +1,43 @@
+import logging
+import random
+
+from src.config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE
+
+# Pass as `extra=SAMPLED` on records logged for every message or request; below WARNING, only
+# LOG_SAMPLE_RATE of them are kept
+SAMPLED = {"sampled": True}
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random share of the records marked as sampled; warnings, errors and other records all pass."""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+def configure_logging(level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE) -> None:
+    """
+    Logs to stderr at the given level, with per-message records sampled. Called by the entry
+    points (the Slack apps and the command-line chat); calling it again has no effect.
+
+    Args:
+        level: The minimum level logged (e.g. "INFO" or "DEBUG").
+        sample_rate: The share of the records marked as sampled that are logged.
+    """
+    root = logging.getLogger()
+    if any(isinstance(f, SamplingFilter) for handler in root.handlers for f in handler.filters):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(handler)
+    root.setLevel(level)
+    # The HTTP clients log every request at INFO
+    for name in ("httpx", "httpcore", "openai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
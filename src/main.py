@@ -1,33 +1,33 @@
-from langchain_core.messages import HumanMessage, AIMessage
-from src.graph_builder import compiled_rag_graph  # Import the compiled graph
+import inspect
+from typing import Callable, Optional
+
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
+from src.graph_builder import get_compiled_graph  # The compiled graph, built on first use
 from src.models import State  # Import State for type hinting
 from src.global_queue import get_current_global_queue_size, peek_global_queue # Import global queue functions for testing
+from src.metrics import REQUEST_SECONDS, metrics_callback
 
 
-def ask_for_help(query: str, session_id: str = "default_thread", language: str = "Hebrew") -> str:
-    """
-    Main function to interact with the RAG chatbot.
-
-    Args:
-        query: The user's input query.
-        session_id: A unique identifier for the conversation thread (e.g., Slack channel ID).
-        language: The desired language for the chatbot's response.
-
-    Returns:
-        The content of the chatbot's response.
-    """
-    initial_input: State = {
+def _initial_input(query: str, session_id: str, language: str) -> State:
+    """Builds the graph input for one user message."""
+    return {
         "messages": [HumanMessage(content=query)],
         "language": language,
         "context": [],  # Context is populated by the retrieve node
         "session_id": session_id, # Add session_id to the state for global queue access
+        "cache_hit": False,  # Set by the cache_lookup node
+        "route": "",  # Set by the route node in speculative retrieval mode
+        "cache_generation": -1,  # Set by the retrieve node
     }
 
-    output = compiled_rag_graph.invoke(
-        initial_input,
-        config={"configurable": {"thread_id": session_id}},
-    )
 
+def _run_config(session_id: str) -> dict:
+    """The graph run's config; the metrics callback in it is inherited by every LLM and tool call of the run."""
+    return {"configurable": {"thread_id": session_id}, "callbacks": [metrics_callback]}
+
+
+def _response_text(output: dict) -> str:
+    """Extracts the chatbot's reply from the graph output."""
     if output and "messages" in output and len(output["messages"]) > 0:
         last_message_from_graph = output["messages"][-1]
         if isinstance(last_message_from_graph, AIMessage):
@@ -38,7 +38,100 @@ def ask_for_help(query: str, session_id: str = "default_thread", language: str =
         return "Error: No response or invalid response structure from the model."
 
 
+# Graph nodes whose LLM output is the answer shown to the user (routing calls are not)
+_ANSWER_NODES = ("generate", "tool_agent")
+
+
+class _PartialAnswer:
+    """Accumulates streamed answer tokens; a new LLM call (e.g. the agent's next step) starts over."""
+
+    def __init__(self):
+        self.message_id = None
+        self.text = ""
+
+    def add(self, chunk, metadata: dict) -> bool:
+        """Adds a streamed chunk. Returns True if the partial answer changed."""
+        if not isinstance(chunk, AIMessageChunk) or metadata.get("langgraph_node") not in _ANSWER_NODES:
+            return False
+        if not isinstance(chunk.content, str) or not chunk.content:
+            return False
+        if chunk.id != self.message_id:
+            self.message_id, self.text = chunk.id, ""
+        self.text += chunk.content
+        return True
+
+
+def ask_for_help(query: str, session_id: str = "default_thread", language: str = "Hebrew",
+                 on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Main function to interact with the RAG chatbot.
+
+    Args:
+        query: The user's input query.
+        session_id: A unique identifier for the conversation thread (e.g., Slack channel ID).
+        language: The desired language for the chatbot's response.
+        on_token: If given, the graph is streamed and this is called with the answer text
+                  so far every time the LLM produces a token.
+
+    Returns:
+        The content of the chatbot's response. This is the final text, which can differ from
+        the streamed one (e.g. when the question was escalated to the human service queue).
+    """
+    graph_input = _initial_input(query, session_id, language)
+    config = _run_config(session_id)
+    with REQUEST_SECONDS.time():
+        if on_token is None:
+            return _response_text(get_compiled_graph().invoke(graph_input, config=config))
+
+        output, partial = None, _PartialAnswer()
+        for mode, payload in get_compiled_graph().stream(graph_input, config=config, stream_mode=["messages", "values"]):
+            if mode == "values":
+                output = payload
+            elif partial.add(*payload):
+                on_token(partial.text)
+        return _response_text(output)
+
+
+async def aask_for_help(query: str, session_id: str = "default_thread", language: str = "Hebrew",
+                        on_token: Optional[Callable] = None) -> str:
+    """
+    Async version of ask_for_help(). The graph runs with ainvoke(), so many conversations
+    can be in flight on one event loop while their LLM and embedding calls are awaited.
+
+    Args:
+        query: The user's input query.
+        session_id: A unique identifier for the conversation thread (e.g., Slack channel ID).
+        language: The desired language for the chatbot's response.
+        on_token: If given, the graph is streamed and this (sync or async) callable is called
+                  with the answer text so far every time the LLM produces a token.
+
+    Returns:
+        The content of the chatbot's final response.
+    """
+    graph_input = _initial_input(query, session_id, language)
+    config = _run_config(session_id)
+    with REQUEST_SECONDS.time():
+        if on_token is None:
+            return _response_text(await get_compiled_graph().ainvoke(graph_input, config=config))
+
+        output, partial = None, _PartialAnswer()
+        async for mode, payload in get_compiled_graph().astream(graph_input, config=config,
+                                                                stream_mode=["messages", "values"]):
+            if mode == "values":
+                output = payload
+            elif partial.add(*payload):
+                result = on_token(partial.text)
+                if inspect.isawaitable(result):
+                    await result
+        return _response_text(output)
+
+
 if __name__ == "__main__":
+    from src.logging_config import configure_logging
+    from src.warm_up import start_warm_up
+
+    configure_logging()
+    start_warm_up()
     print("Chatbot started. Type 'exit' to quit.")
 
     # For testing, you can use different session_ids
@@ -16,8 +16,16 @@ class State(TypedDict):
         context: A list of Document objects retrieved from the vector store,
                  providing relevant context for the LLM.
         session_id: The user chat id
+        cache_hit: Whether the answer of this turn was served from the response cache.
+        route: The route chosen for this turn ("tool_agent" or "retrieve"), set by the
+               route node when speculative retrieval is enabled.
+        cache_generation: The response cache generation when the context was retrieved; the
+                          answer is only cached if the cache was not cleared since.
     """
     messages: Annotated[Sequence[BaseMessage], add_messages]
     language: str
     context: List[Document]
     session_id: str
+    cache_hit: bool
+    route: str
+    cache_generation: int
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+from src.config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_MAX_MEMORY_BYTES,
+)
+
+
+@dataclass
+class _CacheEntry:
+    slot: int
+    language: str
+    response: str
+    created_at: float
+    size_bytes: int
+    generation: int  # The cache generation the answer was stored in (see SemanticResponseCache.clear())
+
+
+class SemanticResponseCache:
+    """
+    Caches generated answers by the embedding of the question that produced them.
+
+    A lookup returns a cached answer when a question in the same language was embedded with a
+    cosine similarity of at least `similarity_threshold`. All cached embeddings live in one
+    preallocated matrix, so a lookup is a single matrix-vector product. Entries are evicted
+    least-recently-used first when the entry or memory limit is reached, and expire after
+    `ttl_seconds`.
+
+    Every clear() starts a new generation. An answer generated from documents retrieved before a
+    clear() is stored with the older generation and rejected, so it cannot outlive the change.
+    """
+
+    def __init__(self, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_memory_bytes: int = RESPONSE_CACHE_MAX_MEMORY_BYTES,
+                 enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, _CacheEntry] = OrderedDict()  # slot -> entry, least recently used first
+        self._matrix: Optional[np.ndarray] = None
+        self._languages = np.full(max_entries, -1, dtype=np.int32)  # language code per slot, -1 when free
+        self._language_codes: dict[str, int] = {}
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._memory_bytes = 0
+        self.generation = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _evict_unlocked(self, slot: int) -> None:
+        entry = self._entries.pop(slot)
+        self._languages[slot] = -1
+        self._free_slots.append(slot)
+        self._memory_bytes -= entry.size_bytes
+
+    def lookup(self, embedding: Sequence[float], language: str) -> Optional[str]:
+        """
+        Returns the cached answer to the most similar question, or None on a miss.
+
+        Args:
+            embedding: The embedding of the question.
+            language: The language the answer must be in.
+        """
+        if not self.enabled:
+            return None
+        query = self._normalize(embedding)
+        with self._lock:
+            language_code = self._language_codes.get(language)
+            if language_code is None or not self._entries or self._matrix is None:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ query
+            scores[self._languages != language_code] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[slot]
+            if time.monotonic() - entry.created_at > self.ttl_seconds:
+                self._evict_unlocked(slot)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return entry.response
+
+    def store(self, embedding: Sequence[float], language: str, response: str,
+              generation: Optional[int] = None) -> None:
+        """
+        Caches an answer under the embedding of its question.
+
+        Args:
+            embedding: The embedding of the question.
+            language: The language of the answer.
+            response: The answer text.
+            generation: The cache generation read before the answer's documents were retrieved.
+                        The answer is not stored if the cache was cleared since then.
+        """
+        if not self.enabled or self.max_entries <= 0:
+            return
+        vector = self._normalize(embedding)
+        size_bytes = vector.nbytes + len(response.encode("utf-8"))
+        if size_bytes > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            while self._entries and (not self._free_slots or self._memory_bytes + size_bytes > self.max_memory_bytes):
+                self._evict_unlocked(next(iter(self._entries)))
+
+            slot = self._free_slots.pop()
+            language_code = self._language_codes.setdefault(language, len(self._language_codes))
+            self._matrix[slot] = vector
+            self._languages[slot] = language_code
+            self._entries[slot] = _CacheEntry(slot, language, response, time.monotonic(), size_bytes, self.generation)
+            self._memory_bytes += size_bytes
+
+    def clear(self) -> None:
+        """Drops every cached answer, e.g. after the document index changed, and starts a new generation."""
+        with self._lock:
+            self.generation += 1
+            for slot in list(self._entries):
+                self._evict_unlocked(slot)
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+            }
+
+
+# Global response cache in front of the RAG generate node
+response_cache = SemanticResponseCache()
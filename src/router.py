@@ -0,0 +1,293 @@
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+
+import numpy as np
+from langchain_core.prompts import PromptTemplate
+
+from src.config import get_llm, ROUTER_EMBEDDING_MARGIN
+from src.metrics import metrics_callback
+
+tool_routing_prompt = PromptTemplate.from_template(
+    """Decide whether the following user message requires using tools (e.g., updating user details, adding vendors)
+or if it's a general question that can be answered based on existing documents.
+
+Respond only with one word: "tool" or "retrieve".
+
+User message:
+{message}
+"""
+)
+
+# Labelled example messages for the embedding-similarity signal
+TOOL_EXAMPLES = [
+    "Add vendor ABC to user 123",
+    "Please add the supplier Acme to customer 7",
+    "Update user 1's email to new.email@example.com",
+    "Change the phone number of user 3 to 052-9876543",
+    "Set the address of customer 12 to Herzl 5, Tel Aviv",
+    "Change my name to Jane Doe, I'm user 4",
+    "הוסף את ספק ABC למשתמש 123",
+    "תוסיף ספק חדש בשם אלפא ללקוח 8",
+    "עדכן את כתובת המייל של משתמש 1 ל-new.email@example.com",
+    "שנה את מספר הטלפון של לקוח 3 ל-052-9876543",
+    "עדכן את הכתובת של משתמש 5 לרחוב הרצל 10",
+    "שנה את השם של משתמש 2 לדני כהן",
+]
+RETRIEVE_EXAMPLES = [
+    "What is the refund policy?",
+    "How do I register as a new vendor?",
+    "What documents are needed to open an account?",
+    "Which vendors are approved for office supplies?",
+    "When is the monthly report due?",
+    "Can I change my delivery date?",
+    "מה מדיניות ההחזרים?",
+    "איך נרשמים כספק חדש?",
+    "אילו מסמכים צריך כדי לפתוח חשבון?",
+    "מתי צריך להגיש את הדוח החודשי?",
+    "מה שעות הפעילות של מוקד השירות?",
+    "האם אפשר לשנות את מועד המשלוח?",
+]
+
+_ACTION = re.compile(
+    r"\b(add|update|change|set|modify|edit|replace|attach)\b"
+    r"|(?:^|\s)(הוסף|תוסיף|להוסיף|הוסיפו|עדכן|תעדכן|לעדכן|עדכנו|שנה|תשנה|לשנות|שנו|החלף|תחליף)(?:\s|$)",
+    re.IGNORECASE,
+)
+_ENTITY = re.compile(
+    r"\b(vendors?|suppliers?|users?|customers?|clients?|phone|e-?mail|address|name)\b"
+    r"|(ספק|משתמש|לקוח|טלפון|מייל|אימייל|דוא\"ל|כתובת|שם)",
+    re.IGNORECASE,
+)
+_RECORD_ID = re.compile(r"\b(user|customer|client)\s*(id\s*)?#?\s*\d+|(משתמש|לקוח)\s*(מספר\s*)?\d+", re.IGNORECASE)
+_NEW_VALUE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+|\b0\d{1,2}-?\d{7}\b|\bto\s+\S+|\s[לכ]-?\S+", re.IGNORECASE)
+_QUESTION = re.compile(
+    r"\?\s*$|^\s*(what|how|why|when|where|which|who|can|could|is|are|does|do|should)\b"
+    r"|^\s*(מה|איך|כיצד|למה|מדוע|מתי|איפה|היכן|אילו|איזה|האם|כמה|מי)(?:\s|$)",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RouteDecision:
+    """The outcome of the local router. `route` is None when the router is not confident."""
+    route: Optional[str]  # "tool_agent", "retrieve" or None
+    method: str  # "keywords", "embeddings" or "undecided"
+    confidence: float
+
+
+class LocalRouter:
+    """
+    Decides locally whether a message needs the tool agent or the RAG pipeline.
+
+    Keyword and regex signals for Hebrew and English tool intents decide clear cases in
+    microseconds. The remaining messages are compared (by embedding similarity) with labelled
+    examples of both kinds. When neither signal is confident the caller falls back to the LLM.
+    """
+
+    def __init__(self, embed_query: Callable[[str], list[float]],
+                 embed_documents: Callable[[list[str]], list[list[float]]],
+                 margin: float = ROUTER_EMBEDDING_MARGIN):
+        self._embed_query = embed_query
+        self._embed_documents = embed_documents
+        self.margin = margin
+        self._examples: Optional[tuple[np.ndarray, np.ndarray]] = None
+        self._lock = threading.Lock()
+        # Separate from _lock, so that counting a decision never waits for the examples to be embedded
+        self._decisions_lock = threading.Lock()
+        self.decisions = {"keywords": 0, "embeddings": 0, "undecided": 0}
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def load_examples(self) -> None:
+        """Embeds the labelled examples now, e.g. during warm-up, instead of on the first message."""
+        self._example_matrices()
+
+    def _example_matrices(self) -> tuple[np.ndarray, np.ndarray]:
+        """Embeds the labelled examples once, on first use."""
+        with self._lock:
+            if self._examples is None:
+                vectors = self._normalize(self._embed_documents(TOOL_EXAMPLES + RETRIEVE_EXAMPLES))
+                self._examples = (vectors[:len(TOOL_EXAMPLES)], vectors[len(TOOL_EXAMPLES):])
+            return self._examples
+
+    @staticmethod
+    def keyword_route(text: str) -> Optional[str]:
+        """
+        Routes clear cases with keyword and regex signals only.
+
+        Returns:
+            "tool_agent" for an action on a specific record (e.g. "update user 3's phone to ..."),
+            "retrieve" for messages with no action verb and no record ID, or None when unsure.
+        """
+        if not _ACTION.search(text):
+            # No action verb: a question, unless it points at a specific record
+            return None if _RECORD_ID.search(text) else "retrieve"
+        if _QUESTION.search(text):
+            # "How do I add a vendor?" talks about an action without asking for it
+            return None
+        if _ENTITY.search(text) and _RECORD_ID.search(text) and _NEW_VALUE.search(text):
+            return "tool_agent"
+        return None
+
+    def embedding_route(self, text: str) -> tuple[Optional[str], float]:
+        """
+        Compares the message with the labelled examples.
+
+        Returns:
+            The route of the closer example group (or None when the two groups are within
+            `margin` of each other) and the similarity margin.
+        """
+        tool_vectors, retrieve_vectors = self._example_matrices()
+        query = self._normalize(self._embed_query(text))
+        tool_score = float(np.max(tool_vectors @ query))
+        retrieve_score = float(np.max(retrieve_vectors @ query))
+        difference = tool_score - retrieve_score
+        if abs(difference) < self.margin:
+            return None, abs(difference)
+        return ("tool_agent" if difference > 0 else "retrieve"), abs(difference)
+
+    def route(self, text: str) -> RouteDecision:
+        """Routes a message, trying the keyword signals first and the embeddings second."""
+        route = self.keyword_route(text)
+        if route is not None:
+            decision = RouteDecision(route, "keywords", 1.0)
+        else:
+            route, margin = self.embedding_route(text)
+            decision = RouteDecision(route, "embeddings" if route else "undecided", margin)
+        # Graph threads (and route_batch()) route messages concurrently
+        with self._decisions_lock:
+            self.decisions[decision.method] += 1
+        return decision
+
+
+def _route_from_answer(answer: str) -> str:
+    """Maps the routing LLM's one-word answer to a route."""
+    if "tool" in answer.strip().lower():
+        return "tool_agent"
+    return "retrieve"
+
+
+def llm_route(text: str) -> str:
+    """
+    Asks the LLM whether a message needs the tool agent or the RAG pipeline.
+
+    Returns:
+        "tool_agent" or "retrieve".
+    """
+    routing_prompt = tool_routing_prompt.invoke({"message": text})
+    return _route_from_answer(get_llm().invoke(routing_prompt, config={"run_name": "route"}).content)
+
+
+async def allm_route(text: str) -> str:
+    """Async version of llm_route()."""
+    routing_prompt = tool_routing_prompt.invoke({"message": text})
+    return _route_from_answer((await get_llm().ainvoke(routing_prompt, config={"run_name": "route"})).content)
+
+
+def llm_route_batch(texts: list[str], max_concurrency: int) -> list[Union[str, Exception]]:
+    """
+    Batch version of llm_route(): the routing prompts go through the chat model's batch
+    interface, with at most `max_concurrency` calls in flight.
+
+    Returns:
+        Per message, "tool_agent" or "retrieve", or the exception its LLM call raised.
+    """
+    if not texts:
+        return []
+    prompts = [tool_routing_prompt.invoke({"message": text}) for text in texts]
+    config = {"run_name": "route", "max_concurrency": max_concurrency, "callbacks": [metrics_callback]}
+    answers = get_llm().batch(prompts, config=config, return_exceptions=True)
+    return [answer if isinstance(answer, Exception) else _route_from_answer(answer.content) for answer in answers]
+
+
+# --- Offline evaluation against the LLM router ---
+if __name__ == "__main__":
+    # Usage: python -m src.router [messages.jsonl]
+    # Each line holds {"text": ...} and optionally the LLM router's recorded answer as
+    # {"llm_route": "tool_agent" | "retrieve", "llm_latency_ms": ...}. Missing answers are
+    # requested from the LLM. Without a file, the held-out messages below are used; they are
+    # labelled by hand and none of them is one of the router's own examples.
+    import json
+    import sys
+
+    from src.config import get_embeddings
+
+    HELD_OUT_TOOL_MESSAGES = [
+        "Please attach vendor Delta Logistics to user 42",
+        "user 9 needs the supplier Omega added",
+        "Modify the email of customer 15 to dana@example.org",
+        "Replace the phone of user 21 with 054-1112233",
+        "I'm user 30, my new address is Jabotinsky 7, Ramat Gan",
+        "Can you update user 8's name to Moshe Levi?",
+        "תוסיף למשתמש 14 את הספק גמא",
+        "משתמש 6 צריך את הספק דלתא",
+        "עדכנו את הטלפון של לקוח 22 ל-050-4445566",
+        "תחליף את המייל של משתמש 17 ל-yossi@example.com",
+        "אני משתמש 11, הכתובת החדשה שלי היא רחוב ביאליק 3",
+        "אפשר לשנות את השם של לקוח 19 לרונית?",
+    ]
+    HELD_OUT_RETRIEVE_MESSAGES = [
+        "How do I add a new vendor to my account?",
+        "What is the process for changing my email address?",
+        "Who approves new suppliers?",
+        "Is there a fee for late payments?",
+        "Where can I find the vendor registration form?",
+        "Tell me about the warranty terms",
+        "איך מוסיפים ספק חדש לחשבון?",
+        "מה התהליך לעדכון כתובת המייל?",
+        "מי מאשר ספקים חדשים?",
+        "יש עמלה על תשלום באיחור?",
+        "איפה נמצא טופס ההרשמה לספקים?",
+        "ספר לי על תנאי האחריות",
+    ]
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        rows = [{"text": text, "llm_route": "tool_agent"} for text in HELD_OUT_TOOL_MESSAGES]
+        rows += [{"text": text, "llm_route": "retrieve"} for text in HELD_OUT_RETRIEVE_MESSAGES]
+    assert not {row["text"] for row in rows} & set(TOOL_EXAMPLES + RETRIEVE_EXAMPLES), \
+        "Evaluation messages must not be among the router's own examples"
+
+    embeddings = get_embeddings()
+    router = LocalRouter(embeddings.embed_query, embeddings.embed_documents)
+    router.load_examples()  # Exclude the one-time example embedding from the timings
+
+    agreed = decided = 0
+    local_ms, llm_ms = [], []
+    for row in rows:
+        if "llm_route" not in row:
+            start = time.perf_counter()
+            row["llm_route"] = llm_route(row["text"])
+            row["llm_latency_ms"] = (time.perf_counter() - start) * 1000
+        if "llm_latency_ms" in row:
+            llm_ms.append(row["llm_latency_ms"])
+
+        start = time.perf_counter()
+        decision = router.route(row["text"])
+        local_ms.append((time.perf_counter() - start) * 1000)
+        if decision.route is not None:
+            decided += 1
+            agreed += decision.route == row["llm_route"]
+        else:
+            print(f"  undecided: {row['text']}")
+        if decision.route not in (None, row["llm_route"]):
+            print(f"  disagreement ({decision.method}): {row['text']!r} -> {decision.route}, expected: {row['llm_route']}")
+
+    print(f"Messages: {len(rows)}, decided locally: {decided} ({decided / len(rows):.0%}), "
+          f"by method: {router.decisions}")
+    reference = "the LLM router" if len(sys.argv) > 1 else "the hand labels"
+    print(f"Agreement with {reference} on locally decided messages: {agreed / max(decided, 1):.1%}")
+    print(f"Local router latency: mean {np.mean(local_ms):.3f} ms, p99 {np.percentile(local_ms, 99):.3f} ms")
+    if llm_ms:
+        saved = np.mean(llm_ms) * decided / len(rows)
+        print(f"LLM router latency: mean {np.mean(llm_ms):.0f} ms; estimated saving {saved:.0f} ms per message")
@@ -0,0 +1,153 @@
+import logging
+import time
+from typing import Optional
+
+from src.config import SLACK_STREAM_UPDATE_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Posted as soon as a turn starts and then edited as the answer streams in
+PLACEHOLDER_TEXT = "רגע, אני בודק..."
+
+
+class SlackMessageStreamer:
+    """
+    Streams an answer into a single Slack message.
+
+    start() posts a placeholder, update() edits it with the answer so far (at most once per
+    `min_interval_seconds`, to stay within Slack's chat.update rate limits) and finish()
+    always writes the final text, which may differ from the streamed one.
+    """
+
+    def __init__(self, client, channel: str,
+                 min_interval_seconds: float = SLACK_STREAM_UPDATE_INTERVAL_SECONDS,
+                 placeholder: str = PLACEHOLDER_TEXT):
+        """
+        Args:
+            client: A slack_sdk WebClient (or anything with chat_postMessage and chat_update).
+            channel: The channel to post the answer to.
+            min_interval_seconds: The minimum time between two edits of the message.
+            placeholder: The text shown until the first tokens arrive.
+        """
+        self.client = client
+        self.channel = channel
+        self.min_interval_seconds = min_interval_seconds
+        self.placeholder = placeholder
+        self.ts: Optional[str] = None
+        self.updates = 0
+        self._shown_text = ""
+        self._last_update = 0.0
+
+    def start(self) -> None:
+        """Posts the placeholder message."""
+        if self.ts is None:
+            response = self.client.chat_postMessage(channel=self.channel, text=self.placeholder)
+            self.ts = response["ts"]
+            self._shown_text = self.placeholder
+            self._last_update = time.monotonic()
+
+    def _edit(self, text: str) -> None:
+        try:
+            self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+        except Exception as e:
+            # E.g. rate limited: the next update (or finish) sends the text again
+            logger.warning("Could not update the Slack message (%s).", e)
+            return
+        self.updates += 1
+        self._shown_text = text
+        self._last_update = time.monotonic()
+
+    def update(self, text: str) -> None:
+        """Shows the answer so far, unless the message was edited too recently."""
+        if self.ts is None:
+            self.start()
+        if text != self._shown_text and time.monotonic() - self._last_update >= self.min_interval_seconds:
+            self._edit(text)
+
+    def finish(self, text: str) -> None:
+        """Shows the final answer."""
+        if self.ts is None:
+            self.client.chat_postMessage(channel=self.channel, text=text)
+            self._shown_text = text
+        elif text != self._shown_text:
+            self._edit(text)
+
+
+class AsyncSlackMessageStreamer(SlackMessageStreamer):
+    """SlackMessageStreamer for a slack_sdk AsyncWebClient."""
+
+    async def start(self) -> None:
+        if self.ts is None:
+            response = await self.client.chat_postMessage(channel=self.channel, text=self.placeholder)
+            self.ts = response["ts"]
+            self._shown_text = self.placeholder
+            self._last_update = time.monotonic()
+
+    async def _edit(self, text: str) -> None:
+        try:
+            await self.client.chat_update(channel=self.channel, ts=self.ts, text=text)
+        except Exception as e:
+            logger.warning("Could not update the Slack message (%s).", e)
+            return
+        self.updates += 1
+        self._shown_text = text
+        self._last_update = time.monotonic()
+
+    async def update(self, text: str) -> None:
+        if self.ts is None:
+            await self.start()
+        if text != self._shown_text and time.monotonic() - self._last_update >= self.min_interval_seconds:
+            await self._edit(text)
+
+    async def finish(self, text: str) -> None:
+        if self.ts is None:
+            await self.client.chat_postMessage(channel=self.channel, text=text)
+            self._shown_text = text
+        elif text != self._shown_text:
+            await self._edit(text)
+
+
+# --- Streaming against a stub Slack Web API and a fake streaming chat model ---
+if __name__ == "__main__":
+    from src.load_test import StubChatModel, install_stub_models
+
+    class StubSlackClient:
+        """Records chat.postMessage and chat.update calls with the time they were made."""
+
+        def __init__(self):
+            self.start = time.monotonic()
+            self.calls = []
+
+        def chat_postMessage(self, channel, text):
+            self.calls.append((time.monotonic() - self.start, "postMessage", text))
+            return {"ts": "1.0"}
+
+        def chat_update(self, channel, ts, text):
+            self.calls.append((time.monotonic() - self.start, "update", text))
+            return {"ts": ts}
+
+    answer = " ".join(f"word{i}" for i in range(60))
+    stub_llm = StubChatModel(latency_seconds=3.0)
+    install_stub_models(stub_llm)
+    import src.graph_builder as graph_builder
+    from src.main import ask_for_help
+
+    escalated = []
+    graph_builder.add_user_to_global_queue = escalated.append  # Keep the real queue untouched
+
+    cases = (
+        ("What is the refund policy?", answer, answer),
+        ("What is the warranty period?", "I don't know the answer to that " + answer, graph_builder._ESCALATION_MESSAGE),
+    )
+    for question, llm_answer, expected in cases:
+        stub_llm.answer = llm_answer
+        client = StubSlackClient()
+        streamer = SlackMessageStreamer(client, "C1", min_interval_seconds=0.5)
+        streamer.start()
+        final_text = ask_for_help(question, session_id="streaming-demo", on_token=streamer.update)
+        streamer.finish(final_text)
+
+        first_update = next(t for t, kind, _ in client.calls if kind == "update")
+        print(f"{question} Placeholder after {client.calls[0][0]:.2f}s, first partial answer after "
+              f"{first_update:.2f}s, final answer after {client.calls[-1][0]:.2f}s, {streamer.updates} edits")
+        print(f"  Final message is the expected one: {client.calls[-1][2] == expected}, escalated: {escalated}")
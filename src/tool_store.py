@@ -0,0 +1,390 @@
+import atexit
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from src.config import TOOLS_DB_FILE, TOOLS_STORE_MAX_BATCH, USERS_DATA_FILE, USER_VENDORS_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def _read_json_file(file_path: Path) -> dict:
+    """
+    Reads content from a JSON file and returns a dictionary.
+    If the file does not exist, an empty dictionary is returned.
+    If the file content is not valid JSON, a warning is printed and an empty dictionary is returned.
+
+    :param file_path: The path to the JSON file.
+    :return: A dictionary representing the JSON content, or an empty dictionary if the file is
+             missing or invalid.
+    """
+    if not file_path.exists():
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        logger.warning("File %s is not a valid JSON format. An empty dictionary will be returned.", file_path)
+        return {}
+
+
+class _WriteRequest:
+    """A write waiting for the writer thread, and its outcome."""
+
+    def __init__(self, operation: Callable[[sqlite3.Connection], Any]):
+        self.operation = operation
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+_STOP = None  # Queued by close() to stop the writer thread
+# The write group of the calling tool call, if it runs as part of one
+_current_group: ContextVar[Optional["WriteGroup"]] = ContextVar("tool_store_write_group", default=None)
+
+
+class WriteGroup:
+    """
+    Commits the writes of several concurrent calls, e.g. the tool calls of one agent turn, in
+    one transaction per store. Each call runs inside participant(); the group hands the writes
+    to the stores' writer threads together, once every call that is still running is waiting
+    for a write.
+    """
+
+    def __init__(self, participants: int):
+        """
+        :param participants: The number of calls whose writes are committed together.
+        """
+        self._lock = threading.Lock()
+        self._running = participants
+        self._pending: dict[ToolDataStore, list[_WriteRequest]] = {}
+
+    def _flush_if_ready(self):
+        if self._pending and sum(map(len, self._pending.values())) >= self._running:
+            for store, requests in self._pending.items():
+                store._requests.put(requests)
+            self._pending = {}
+
+    def add(self, store: "ToolDataStore", request: _WriteRequest):
+        with self._lock:
+            self._pending.setdefault(store, []).append(request)
+            self._flush_if_ready()
+
+    @contextmanager
+    def participant(self):
+        """Runs one of the group's calls: the writes made inside are committed with the others'."""
+        token = _current_group.set(self)
+        try:
+            yield
+        finally:
+            _current_group.reset(token)
+            with self._lock:
+                # A call that ends without writing no longer holds back the others' writes
+                self._running -= 1
+                self._flush_if_ready()
+
+
+class ToolDataStore:
+    """
+    The users' details and vendors that the agent's tools read and change, kept in SQLite.
+
+    Every tool call touches a single user, so lookups go through the primary key and each
+    update is a single statement that changes one record, instead of reading and rewriting the
+    whole JSON file. Writes are applied by one writer thread with group commit: the writes that
+    arrive while a transaction is being committed are applied together in the next one, so
+    concurrent tool calls share the cost of flushing to disk. A call returns only once its
+    write is committed. Calls made within a WriteGroup are always committed together.
+    """
+
+    def __init__(self, db_file: Path = TOOLS_DB_FILE, vendors_file: Path = USER_VENDORS_FILE,
+                 users_file: Path = USERS_DATA_FILE, max_batch: int = TOOLS_STORE_MAX_BATCH):
+        """
+        :param db_file: The path of the SQLite database.
+        :param vendors_file: The old users_vendors.json, imported once into a new database.
+        :param users_file: The old users_data.json, imported once into a new database.
+        :param max_batch: The maximum number of writes committed in one transaction.
+        """
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.max_batch = max_batch
+        self.commits = 0
+        self.writes = 0
+        self._local = threading.local()  # One read connection per thread
+
+        self._conn = self._connect()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, details TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_vendors ("
+                "user_id TEXT NOT NULL, vendor_name TEXT NOT NULL, "
+                "PRIMARY KEY (user_id, vendor_name))"
+            )
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+                self._migrate(Path(vendors_file), Path(users_file))
+                self._conn.execute("PRAGMA user_version = 1")
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        self._requests: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="tool-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode: transactions are started explicitly; FULL syncs every commit to disk
+        conn = sqlite3.connect(str(self.db_file), timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _migrate(self, vendors_file: Path, users_file: Path):
+        """Copies the data of the JSON files that the tools used before into the new database."""
+        users = _read_json_file(users_file).get("users", {})
+        vendors = _read_json_file(vendors_file).get("vendors", {})
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, details) VALUES (?, ?)",
+            [(user_id, json.dumps(details, ensure_ascii=False)) for user_id, details in users.items()],
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO user_vendors (user_id, vendor_name) VALUES (?, ?)",
+            [(user_id, vendor_name) for user_id, names in vendors.items() for vendor_name in names],
+        )
+        if users or vendors:
+            logger.info("Imported %d users and the vendors of %d users into %s.", len(users), len(vendors), self.db_file)
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _write_loop(self):
+        while True:
+            # Each queued item is a list of writes that must be committed together
+            item, batch, stop = self._requests.get(), [], False
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.extend(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: list[_WriteRequest]):
+        """Applies a batch of writes in one transaction; a failing write is rolled back on its own."""
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for request in batch:
+                self._conn.execute("SAVEPOINT tool_write")
+                try:
+                    request.result = request.operation(self._conn)
+                    self._conn.execute("RELEASE tool_write")
+                except Exception as e:
+                    self._conn.execute("ROLLBACK TO tool_write")
+                    self._conn.execute("RELEASE tool_write")
+                    request.error = e
+            self._conn.execute("COMMIT")
+            self.commits += 1
+            self.writes += len(batch)
+        except Exception as e:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            for request in batch:
+                request.error = request.error or e
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def _write(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Queues a write for the writer thread (or the caller's write group) and waits until it is committed."""
+        request = _WriteRequest(operation)
+        group = _current_group.get()
+        if group is not None:
+            group.add(self, request)
+        else:
+            self._requests.put([request])
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def get_user(self, user_id: int | str) -> Optional[dict]:
+        """
+        :param user_id: The ID of the user.
+        :return: The user's details, or None if there is no such user.
+        """
+        row = self._reader().execute("SELECT details FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_vendors(self, user_id: int | str) -> list[str]:
+        """
+        :param user_id: The ID of the user.
+        :return: The names of the user's vendors, in the order they were added.
+        """
+        rows = self._reader().execute(
+            "SELECT vendor_name FROM user_vendors WHERE user_id = ? ORDER BY rowid", (str(user_id),)
+        )
+        return [vendor_name for (vendor_name,) in rows]
+
+    def put_user(self, user_id: int | str, details: dict):
+        """
+        Creates a user, or replaces all of their details.
+
+        :param user_id: The ID of the user.
+        :param details: The user's details (name, phone, address, email).
+        """
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, details) VALUES (?, ?)",
+            (str(user_id), json.dumps(details, ensure_ascii=False)),
+        ))
+
+    def update_user(self, user_id: int | str, fields: dict) -> bool:
+        """
+        Changes some of a user's details, leaving the others as they are.
+
+        :param user_id: The ID of the user.
+        :param fields: The details to change, e.g. {"email": "new.email@example.com"}.
+        :return: True if the user was updated, False if there is no such user.
+        """
+        if not fields:
+            return self.get_user(user_id) is not None
+        paths = ", ".join("?, ?" for _ in fields)
+        params = []
+        for field, value in fields.items():
+            params += [f'$."{field}"', value]
+        return self._write(lambda conn: conn.execute(
+            f"UPDATE users SET details = json_set(details, {paths}) WHERE user_id = ?",
+            (*params, str(user_id)),
+        ).rowcount == 1)
+
+    def add_vendor(self, user_id: int | str, vendor_name: str) -> bool:
+        """
+        :param user_id: The ID of the user.
+        :param vendor_name: The name of the vendor to add.
+        :return: True if the vendor was added, False if the user already had it.
+        """
+        return self._write(lambda conn: conn.execute(
+            "INSERT OR IGNORE INTO user_vendors (user_id, vendor_name) VALUES (?, ?)",
+            (str(user_id), vendor_name),
+        ).rowcount == 1)
+
+    def close(self):
+        """Commits the queued writes and stops the writer thread."""
+        if self._writer.is_alive():
+            self._requests.put(_STOP)
+            self._writer.join()
+
+
+_tool_store: Optional[ToolDataStore] = None
+_tool_store_lock = threading.Lock()
+
+
+def get_tool_store() -> ToolDataStore:
+    """Returns the tool data store, opening it (and importing the legacy JSON files) on first use."""
+    global _tool_store
+    with _tool_store_lock:
+        if _tool_store is None:
+            _tool_store = ToolDataStore()
+        return _tool_store
+
+
+def set_tool_store(store: ToolDataStore) -> None:
+    """Makes the tools use another store, e.g. a scratch one in a benchmark."""
+    global _tool_store
+    with _tool_store_lock:
+        _tool_store = store
+
+
+def __getattr__(name: str):
+    # `tool_store` is opened on first access rather than at import
+    if name == "tool_store":
+        return get_tool_store()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# --- Lost updates under concurrent tool calls, and tool-call latency as the user table grows ---
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    scratch_dir = Path(tempfile.mkdtemp())
+    no_file = scratch_dir / "missing.json"
+
+    def json_add_vendor(json_file: Path, user_id: int, vendor_name: str):
+        """The previous implementation: read the whole file, change one key, rewrite it."""
+        data = _read_json_file(json_file)
+        vendors = data.setdefault("vendors", {}).setdefault(str(user_id), [])
+        if vendor_name not in vendors:
+            vendors.append(vendor_name)
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def json_update_user(json_file: Path, user_id: int, email: str):
+        data = _read_json_file(json_file)
+        data["users"][str(user_id)]["email"] = email
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # 16 agent calls at a time, each adding vendors to the same user
+    threads, vendors_per_thread = 16, 25
+    expected = threads * vendors_per_thread
+    store = ToolDataStore(scratch_dir / "concurrency.sqlite", no_file, no_file)
+    json_file = scratch_dir / "users_vendors.json"
+    for name, add in (("SQLite store", store.add_vendor),
+                      ("JSON rewrite", lambda user_id, vendor: json_add_vendor(json_file, user_id, vendor))):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(lambda t: [add(1, f"vendor-{t}-{v}") for v in range(vendors_per_thread)], range(threads)))
+        elapsed = time.perf_counter() - start
+        stored = len(store.get_vendors(1)) if name == "SQLite store" else \
+            len(_read_json_file(json_file).get("vendors", {}).get("1", []))
+        print(f"{name}: {stored}/{expected} vendors kept after {expected} concurrent adds ({elapsed:.2f}s)")
+    print(f"  SQLite store: {store.writes} writes in {store.commits} commits")
+
+    # Latency of one update_user_details call as the user table grows
+    for users in (1_000, 10_000, 100_000):
+        details = {"name": "John Doe", "phone": "050-1234567", "address": "Main St 1", "email": "john@example.com"}
+        json_file = scratch_dir / f"users_data_{users}.json"
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump({"users": {str(i): details for i in range(users)}}, f, indent=2)
+        store = ToolDataStore(scratch_dir / f"latency_{users}.sqlite", no_file, json_file)
+
+        latencies = {}
+        for name, update in (("SQLite store", lambda i: store.update_user(i, {"email": f"user{i}@example.com"})),
+                             ("JSON rewrite", lambda i: json_update_user(json_file, i, f"user{i}@example.com"))):
+            samples = []
+            for i in range(20):
+                start = time.perf_counter()
+                update(i * (users // 20))
+                samples.append(time.perf_counter() - start)
+            latencies[name] = np.percentile(samples, 50) * 1000
+        print(f"{users:>7} users: update_user_details p50 {latencies['SQLite store']:.2f} ms with the SQLite store, "
+              f"{latencies['JSON rewrite']:.2f} ms rewriting the JSON file")
+        store.close()
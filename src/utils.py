@@ -1,13 +1,189 @@
-from langchain_core.messages import trim_messages
+import json
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Sequence
+
+import tiktoken
+from langchain_core.messages import BaseMessage, AIMessage, SystemMessage, trim_messages
+from langchain_core.runnables import RunnableLambda
 from src.config import MAX_TOKENS_TRIMMER, TRIMMER_STRATEGY, TRIMMER_INCLUDE_SYSTEM, TRIMMER_ALLOW_PARTIAL, TRIMMER_START_ON
-from src.config import LLM
+from src.config import TRIMMER_ENCODING
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds to every message (role and separators), as counted by OpenAI
+_TOKENS_PER_MESSAGE = 4
+_MESSAGE_TOKEN_CACHE_SIZE = 100_000
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    """
+    Loads a tiktoken encoding once. Returns None when the encoding files are not available
+    locally and cannot be downloaded (e.g. when running offline).
+    """
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning("Could not load tokenizer '%s' (%s). Using an approximate token count.", encoding_name, e)
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """
+    Counts the tokens of a text with a local tokenizer.
+
+    Args:
+        text: The text to count.
+        encoding_name: The tiktoken encoding to use.
+
+    Returns:
+        The number of tokens, or an estimate of about four UTF-8 bytes per token
+        if the tokenizer is unavailable.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return len(text.encode("utf-8")) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# Token counts of recent messages, keyed by message ID (messages are immutable once added to the
+# state, but are deserialized into new objects from the checkpoint on every turn)
+_message_tokens: OrderedDict[str, int] = OrderedDict()
+_message_tokens_lock = threading.Lock()
+
+
+def _message_text(message: BaseMessage) -> str:
+    """The text of a message that reaches the model: its content and any tool calls."""
+    if isinstance(message.content, str):
+        text = message.content
+    else:
+        text = "".join(part if isinstance(part, str) else str(part.get("text", "")) for part in message.content)
+    if isinstance(message, AIMessage) and message.tool_calls:
+        text += json.dumps(message.tool_calls, ensure_ascii=False, default=str)
+    return text
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """
+    Returns the number of tokens of a message, counting it only the first time its ID is seen.
+
+    Args:
+        message: The message to count.
+
+    Returns:
+        The token count of the message, including the per-message formatting overhead.
+    """
+    if message.id is not None:
+        with _message_tokens_lock:
+            cached = _message_tokens.get(message.id)
+            if cached is not None:
+                _message_tokens.move_to_end(message.id)
+                return cached
+
+    tokens = count_tokens(_message_text(message), TRIMMER_ENCODING) + _TOKENS_PER_MESSAGE
+    if message.id is not None:
+        with _message_tokens_lock:
+            _message_tokens[message.id] = tokens
+            if len(_message_tokens) > _MESSAGE_TOKEN_CACHE_SIZE:
+                _message_tokens.popitem(last=False)
+    return tokens
+
+
+def count_message_tokens(messages: Sequence[BaseMessage]) -> int:
+    """A token_counter for trim_messages() that uses the cached per-message counts."""
+    return sum(message_tokens(message) for message in messages)
+
+
+def trim_history(messages: Sequence[BaseMessage], max_tokens: int = MAX_TOKENS_TRIMMER) -> list[BaseMessage]:
+    """
+    Keeps the most recent messages that fit in `max_tokens`, like trim_messages() with the
+    "last" strategy, but by walking the cached per-message counts backwards from the newest
+    message. Only the messages in the window (plus one) are counted, so the cost does not
+    grow with the length of the conversation.
+
+    Args:
+        messages: The chat history, oldest first.
+        max_tokens: The token budget of the window.
+
+    Returns:
+        The trimmed history. It keeps a leading system message if TRIMMER_INCLUDE_SYSTEM is set
+        and starts on a message of type TRIMMER_START_ON.
+    """
+    window_start = 0
+    budget = max_tokens
+    if TRIMMER_INCLUDE_SYSTEM and messages and isinstance(messages[0], SystemMessage):
+        window_start = 1
+        budget = max(0, budget - message_tokens(messages[0]))
+
+    start = len(messages)
+    while start > window_start:
+        tokens = message_tokens(messages[start - 1])
+        if tokens > budget:
+            break
+        budget -= tokens
+        start -= 1
+
+    # Never start the window in the middle of an exchange (e.g. on an AI or tool message)
+    if TRIMMER_START_ON:
+        while start < len(messages) and messages[start].type != TRIMMER_START_ON:
+            start += 1
+
+    return list(messages[:window_start]) + list(messages[start:])
+
 
 # Initialize the message trimmer for managing chat history length
-trimmer = trim_messages(
-    max_tokens=MAX_TOKENS_TRIMMER,
-    strategy=TRIMMER_STRATEGY,
-    token_counter=LLM,
-    include_system=TRIMMER_INCLUDE_SYSTEM,
-    allow_partial=TRIMMER_ALLOW_PARTIAL,
-    start_on=TRIMMER_START_ON,
-)
+if TRIMMER_STRATEGY == "last" and not TRIMMER_ALLOW_PARTIAL:
+    trimmer = RunnableLambda(trim_history)
+else:
+    trimmer = trim_messages(
+        max_tokens=MAX_TOKENS_TRIMMER,
+        strategy=TRIMMER_STRATEGY,
+        token_counter=count_message_tokens,
+        include_system=TRIMMER_INCLUDE_SYSTEM,
+        allow_partial=TRIMMER_ALLOW_PARTIAL,
+        start_on=TRIMMER_START_ON,
+    )
+
+
+# --- Trimming cost on long threads: trim_messages() recounting everything vs cached counts ---
+if __name__ == "__main__":
+    import time
+    import uuid
+
+    from langchain_core.messages import HumanMessage
+
+    def uncached_counter(messages: Sequence[BaseMessage]) -> int:
+        """What counting with the LLM did: every message is re-tokenized on every call."""
+        return sum(count_tokens(_message_text(message), TRIMMER_ENCODING) + _TOKENS_PER_MESSAGE
+                   for message in messages)
+
+    previous_trimmer = trim_messages(
+        max_tokens=MAX_TOKENS_TRIMMER, strategy="last", token_counter=uncached_counter,
+        include_system=TRIMMER_INCLUDE_SYSTEM, allow_partial=False, start_on=TRIMMER_START_ON,
+    )
+
+    for thread_length in (10, 100, 1_000, 10_000):
+        history = []
+        for i in range(thread_length // 2):
+            history.append(HumanMessage(content=f"שאלה מספר {i} לגבי הספק והחשבון שלי " * 3, id=str(uuid.uuid4())))
+            history.append(AIMessage(content=f"Answer {i}: the vendor account details are as follows. " * 6,
+                                     id=str(uuid.uuid4())))
+
+        turns = 20
+        start = time.perf_counter()
+        for _ in range(turns):
+            expected = previous_trimmer.invoke(history)
+        before_ms = (time.perf_counter() - start) / turns * 1000
+
+        trim_history(history)  # The first turn counts the window once
+        start = time.perf_counter()
+        for _ in range(turns):
+            trimmed = trim_history(history)
+        after_ms = (time.perf_counter() - start) / turns * 1000
+
+        same = [m.id for m in trimmed] == [m.id for m in expected]
+        print(f"{thread_length:>6} messages: trim_messages {before_ms:8.2f} ms/turn, "
+              f"cached walk {after_ms:6.3f} ms/turn, same window: {same}")
@@ -0,0 +1,442 @@
+import hashlib
+import threading
+from typing import Any, Callable, Iterable, Optional, Sequence
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from src.ann_index import IVFIndex
+
+# Number of rows allocated when the first vectors are added
+_INITIAL_CAPACITY = 1024
+# Query-by-row scores computed at once by a batch search (128 MB of float32)
+_BATCH_SCORES_MAX_ELEMENTS = 32 * 1024 * 1024
+
+
+class _ReadWriteLock:
+    """
+    A small readers-writer lock: any number of searches may run at once,
+    while adding or deleting vectors waits for them and runs alone.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if self._readers == 0:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+def _content_key(text: str) -> str:
+    """Identifies a chunk by its text, which determines its vector (unlike its ID, kept when the chunk is edited)."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length, leaving all-zero rows unchanged."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    A drop-in replacement for InMemoryVectorStore that keeps all embeddings in one contiguous,
+    pre-normalized float32 matrix.
+
+    A query is scored with a single matrix-vector product followed by an argpartition top-k.
+    The matrix grows by doubling its capacity, and deleting a vector moves the last row into
+    its place, so neither operation copies the whole matrix.
+
+    For large corpora an optional IVF index (see src/ann_index.py) restricts each query to the
+    rows of its `nprobe` nearest clusters once the store holds at least `ann_min_vectors` rows.
+    """
+
+    def __init__(self, embedding: Embeddings, nprobe: int = 0, ann_min_vectors: int = 0):
+        self.embedding = embedding
+        self.ann_index: Optional[IVFIndex] = None
+        self.nprobe = nprobe
+        self.ann_min_vectors = ann_min_vectors
+        self._matrix: Optional[np.ndarray] = None
+        # Cluster of each row, plus the rows grouped by cluster (order/offsets), when ann_index is set
+        self._lists: Optional[np.ndarray] = None
+        self._list_order: Optional[np.ndarray] = None
+        self._list_offsets: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: list[str] = []
+        self._documents: list[Document] = []
+        self._rows: dict[str, int] = {}
+        self._lock = _ReadWriteLock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return self._size
+
+    # --- Writes ---
+
+    def _ensure_capacity(self, rows: int, dim: int) -> None:
+        """Grows the matrix (by doubling) so it can hold `rows` vectors of size `dim`."""
+        if self._matrix is None:
+            self._matrix = np.empty((max(_INITIAL_CAPACITY, rows), dim), dtype=np.float32)
+            self._lists = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            return
+        if self._matrix.shape[1] != dim:
+            raise ValueError(f"Expected vectors of size {self._matrix.shape[1]}, got {dim}.")
+        if rows > self._matrix.shape[0]:
+            capacity = self._matrix.shape[0]
+            while capacity < rows:
+                capacity *= 2
+            grown = np.empty((capacity, dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            grown_lists = np.zeros(capacity, dtype=np.int32)
+            grown_lists[:self._size] = self._lists[:self._size]
+            self._lists = grown_lists
+
+    def _delete_unlocked(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                continue
+            last = self._size - 1
+            if row != last:
+                # Move the last row into the freed slot
+                self._matrix[row] = self._matrix[last]
+                self._lists[row] = self._lists[last]
+                self._ids[row] = self._ids[last]
+                self._documents[row] = self._documents[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._documents.pop()
+            self._size = last
+
+    def _add_unlocked(self, documents: list[Document], vectors: np.ndarray, ids: list[str]) -> None:
+        self._ensure_capacity(self._size + len(documents), vectors.shape[1])
+        lists = self.ann_index.assign(vectors) if self.ann_index is not None else None
+        for document, vector, doc_id in zip(documents, vectors, ids):
+            stored = Document(id=doc_id, page_content=document.page_content, metadata=document.metadata)
+            row = self._rows.get(doc_id)
+            if row is None:
+                row = self._size
+                self._rows[doc_id] = row
+                self._ids.append(doc_id)
+                self._documents.append(stored)
+                self._size += 1
+            else:
+                self._documents[row] = stored
+            self._matrix[row] = vector
+        if lists is not None:
+            self._lists[[self._rows[doc_id] for doc_id in ids]] = lists
+
+    def _rebuild_lists_unlocked(self) -> None:
+        """Regroups the rows by cluster after the rows or the index changed."""
+        if self.ann_index is None:
+            return
+        lists = self._lists[:self._size]
+        self._list_order = np.argsort(lists, kind="stable").astype(np.int32)
+        self._list_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(lists, minlength=self.ann_index.n_lists)))
+        )
+
+    def add_vectors(self, documents: list[Document], vectors: Sequence[Sequence[float]],
+                    ids: Optional[list[str]] = None, delete_ids: Optional[Iterable[str]] = None) -> list[str]:
+        """
+        Adds documents with precomputed embeddings, optionally deleting other documents
+        in the same step. Searches never observe the store between the deletion and the addition.
+
+        Args:
+            documents: The documents to add. Existing IDs are overwritten.
+            vectors: The embeddings of the documents.
+            ids: The IDs of the documents. Defaults to each document's id, or a new UUID.
+            delete_ids: The IDs of documents to remove before adding.
+
+        Returns:
+            The IDs of the added documents.
+        """
+        if len(vectors) != len(documents):
+            raise ValueError(f"Got {len(documents)} documents and {len(vectors)} vectors.")
+        if ids is None:
+            ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+        elif len(ids) != len(documents):
+            raise ValueError(f"ids must be the same length as documents. Got {len(ids)} ids and {len(documents)} documents.")
+
+        matrix = _normalize(np.asarray(vectors, dtype=np.float32)) if documents else None
+        self._lock.acquire_write()
+        try:
+            if delete_ids:
+                self._delete_unlocked(delete_ids)
+            if documents:
+                self._add_unlocked(documents, matrix, ids)
+            self._rebuild_lists_unlocked()
+        finally:
+            self._lock.release_write()
+        return list(ids)
+
+    def add_documents(self, documents: list[Document], ids: Optional[list[str]] = None, **kwargs: Any) -> list[str]:
+        """Embeds and adds documents to the store."""
+        vectors = self.embedding.embed_documents([doc.page_content for doc in documents])
+        return self.add_vectors(documents, vectors, ids=ids)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[list[dict]] = None,
+                  *, ids: Optional[list[str]] = None, **kwargs: Any) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        return self.add_documents(documents, ids=ids)
+
+    def delete(self, ids: Optional[Sequence[str]] = None, **kwargs: Any) -> None:
+        if not ids:
+            return
+        self._lock.acquire_write()
+        try:
+            self._delete_unlocked(ids)
+            self._rebuild_lists_unlocked()
+        finally:
+            self._lock.release_write()
+
+    def set_ann_index(self, ann_index: Optional[IVFIndex]) -> None:
+        """
+        Attaches an IVF index (or detaches it with None) and assigns every stored row to a cluster.
+        Rows whose text is in the index's saved assignments keep their saved cluster, so only the
+        vectors of chunks added or edited since the index was saved are compared with the centroids.
+        """
+        self._lock.acquire_write()
+        try:
+            if ann_index is not None and self._matrix is not None and ann_index.dim != self._matrix.shape[1]:
+                raise ValueError(f"ANN index has dimension {ann_index.dim}, "
+                                 f"but the store holds vectors of size {self._matrix.shape[1]}.")
+            self.ann_index = ann_index
+            if ann_index is not None and self._size:
+                lists = self._lists[:self._size]
+                missing = np.arange(self._size)
+                if ann_index.assignments is not None:
+                    saved_keys, saved_lists = ann_index.assignments
+                    saved = dict(zip(saved_keys, np.asarray(saved_lists).tolist()))
+                    known = np.array([saved.get(_content_key(document.page_content), -1)
+                                      for document in self._documents], dtype=np.int64)
+                    known[known >= ann_index.n_lists] = -1
+                    lists[known >= 0] = known[known >= 0]
+                    missing = np.flatnonzero(known < 0)
+                    ann_index.assignments = None  # Only needed once; the store keeps the clusters from now on
+                if len(missing):
+                    lists[missing] = ann_index.assign(self._matrix[missing])
+            self._rebuild_lists_unlocked()
+        finally:
+            self._lock.release_write()
+
+    def ann_assignments(self) -> tuple[list[str], np.ndarray]:
+        """Returns the content key and the IVF cluster of every stored row, e.g. to be saved with IVFIndex.save()."""
+        self._lock.acquire_read()
+        try:
+            return [_content_key(document.page_content) for document in self._documents], self._lists[:self._size].copy()
+        finally:
+            self._lock.release_read()
+
+    def build_ann_index(self, n_lists: int) -> IVFIndex:
+        """
+        Trains an IVF index on the stored vectors and attaches it.
+
+        Args:
+            n_lists: The number of clusters.
+
+        Returns:
+            The trained index, e.g. to be saved with IVFIndex.save().
+        """
+        self._lock.acquire_read()
+        try:
+            if not self._size:
+                raise ValueError("Cannot build an ANN index on an empty store.")
+            ann_index = IVFIndex.train(self._matrix[:self._size], n_lists)
+        finally:
+            self._lock.release_read()
+        self.set_ann_index(ann_index)
+        return ann_index
+
+    # --- Reads ---
+
+    def get_by_ids(self, ids: Sequence[str], /) -> list[Document]:
+        self._lock.acquire_read()
+        try:
+            return [self._documents[self._rows[doc_id]] for doc_id in ids if doc_id in self._rows]
+        finally:
+            self._lock.release_read()
+
+    def get_with_vectors(self, ids: Sequence[str]) -> tuple[list[Document], np.ndarray]:
+        """
+        Returns stored documents together with their (unit-length) embeddings.
+
+        Args:
+            ids: The IDs of the documents. IDs that are not in the store are skipped.
+
+        Returns:
+            The documents, in the order of `ids`, and a matrix with the embedding of each one per row.
+        """
+        self._lock.acquire_read()
+        try:
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+            if not rows:
+                return [], np.empty((0, 0 if self._matrix is None else self._matrix.shape[1]), dtype=np.float32)
+            return [self._documents[row] for row in rows], self._matrix[rows]
+        finally:
+            self._lock.release_read()
+
+    def similarity_search_with_score_by_vector(self, embedding: Sequence[float], k: int = 4,
+                                               nprobe: Optional[int] = None,
+                                               **kwargs: Any) -> list[tuple[Document, float]]:
+        """
+        Returns the k documents most similar to an embedding, with their cosine similarity.
+
+        Args:
+            embedding: The query embedding.
+            k: The number of documents to return.
+            nprobe: The number of IVF clusters to search. Defaults to the store's nprobe;
+                    0 forces an exact search.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        nprobe = self.nprobe if nprobe is None else nprobe
+
+        self._lock.acquire_read()
+        try:
+            if self._size == 0 or k <= 0:
+                return []
+            if self.ann_index is not None and nprobe > 0 and self._size >= self.ann_min_vectors:
+                probed = self.ann_index.probe(query, nprobe)
+                rows = np.concatenate([
+                    self._list_order[self._list_offsets[cluster]:self._list_offsets[cluster + 1]]
+                    for cluster in probed
+                ])
+                scores = self._matrix[rows] @ query
+            else:
+                rows = None
+                scores = self._matrix[:self._size] @ query
+
+            if k < len(scores):
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            else:
+                top = np.argsort(-scores)
+            return [(self._documents[row if rows is None else rows[row]], float(scores[row])) for row in top]
+        finally:
+            self._lock.release_read()
+
+    def similarity_search_by_vectors(self, embeddings: Sequence[Sequence[float]], k: int = 4,
+                                     nprobe: Optional[int] = None) -> list[list[Document]]:
+        """
+        Batch version of similarity_search_by_vector(): an exact search scores a block of queries
+        with one matrix product. With an IVF index, each query is searched on its own.
+
+        Args:
+            embeddings: The query embeddings.
+            k: The number of documents to return per query.
+            nprobe: As in similarity_search_with_score_by_vector().
+
+        Returns:
+            The k most similar documents of each query, best first.
+        """
+        nprobe = self.nprobe if nprobe is None else nprobe
+        if self.ann_index is not None and nprobe > 0 and self._size >= self.ann_min_vectors:
+            return [self.similarity_search_by_vector(embedding, k, nprobe=nprobe) for embedding in embeddings]
+        if not len(embeddings):
+            return []
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+
+        self._lock.acquire_read()
+        try:
+            if self._size == 0 or k <= 0:
+                return [[] for _ in range(len(queries))]
+            results = []
+            # Bounds the score matrix of a block to about _BATCH_SCORES_MAX_ELEMENTS floats
+            block_size = max(1, _BATCH_SCORES_MAX_ELEMENTS // self._size)
+            for block_start in range(0, len(queries), block_size):
+                scores = queries[block_start:block_start + block_size] @ self._matrix[:self._size].T
+                if k < self._size:
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+                    top = np.take_along_axis(top, order, axis=1)
+                else:
+                    top = np.argsort(-scores, axis=1)
+                results.extend([self._documents[row] for row in rows] for rows in top)
+            return results
+        finally:
+            self._lock.release_read()
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts: list[str], embedding: Embeddings, metadatas: Optional[list[dict]] = None,
+                   *, ids: Optional[list[str]] = None, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+
+# --- Comparison with InMemoryVectorStore on a synthetic corpus ---
+if __name__ == "__main__":
+    import time
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.vectorstores import InMemoryVectorStore
+
+    embedding = DeterministicFakeEmbedding(size=3072)
+    queries = [f"question {i}" for i in range(20)]
+
+    for corpus_size in (1_000, 5_000):
+        texts = [f"chunk {i}" for i in range(corpus_size)]
+        vectors = embedding.embed_documents(texts)
+        documents = [Document(page_content=text) for text in texts]
+        ids = [str(i) for i in range(corpus_size)]
+
+        numpy_store = NumpyVectorStore(embedding)
+        numpy_store.add_vectors(documents, vectors, ids=ids)
+        reference_store = InMemoryVectorStore(embedding)
+        for doc_id, text, vector in zip(ids, texts, vectors):
+            reference_store.store[doc_id] = {"id": doc_id, "vector": vector, "text": text, "metadata": {}}
+
+        for name, store in (("InMemoryVectorStore", reference_store), ("NumpyVectorStore", numpy_store)):
+            start = time.perf_counter()
+            results = [[doc.id for doc in store.similarity_search(query, k=4)] for query in queries]
+            per_query = (time.perf_counter() - start) / len(queries) * 1000
+            print(f"{corpus_size} chunks, {name}: {per_query:.2f} ms/query")
+            if store is reference_store:
+                expected = results
+        print(f"  same top-4 results: {results == expected}")
@@ -0,0 +1,125 @@
+"""
+Background warm-up of the chatbot, so the Slack bot can connect as soon as the modules are
+imported instead of after the documents are indexed and the graph is built.
+
+Usage: python -m src.warm_up
+
+Until the index is ready, tool requests are answered as usual and questions wait up to
+INDEX_WAIT_SECONDS for it (and are then told the bot is still starting).
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# The chatbot modules are imported when the warm-up starts rather than here, so that the
+# harness below can swap in the stub models before they are loaded
+
+# Seconds spent on each warm-up step, and "ready" (from the start_warm_up() origin), once done
+warm_up_timings: dict[str, float] = {}
+_warm_up_thread: Optional[threading.Thread] = None
+_warm_up_lock = threading.Lock()
+_warm_up_done = threading.Event()
+
+
+def _warm_up(started_at: float) -> None:
+    from src.agent import get_agent_executor
+    from src.graph_builder import get_compiled_graph, local_router
+    from src.ingester import wait_for_index
+
+    steps = [
+        ("graph", get_compiled_graph),
+        ("agent", get_agent_executor),
+        ("router_examples", local_router.load_examples),
+        ("index", wait_for_index),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # The step is retried lazily on the first request that needs it
+            logger.warning("Warm-up step '%s' failed: %s", name, e)
+            continue
+        warm_up_timings[name] = time.perf_counter() - start
+    warm_up_timings["ready"] = time.perf_counter() - started_at
+    _warm_up_done.set()
+    steps_summary = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in warm_up_timings.items() if name != "ready")
+    logger.info("Warm-up done, ready %.1fs after start (%s).", warm_up_timings["ready"], steps_summary)
+
+
+def start_warm_up(started_at: Optional[float] = None) -> threading.Thread:
+    """
+    Starts indexing the documents and building the graph, the agent and the router examples
+    in background threads, unless that was already started. Returns immediately.
+
+    Args:
+        started_at: The time.perf_counter() value to measure the time to ready from, e.g. the
+            process start; defaults to now.
+
+    Returns:
+        The warm-up thread.
+    """
+    global _warm_up_thread
+    from src.ingester import start_indexing
+
+    started_at = time.perf_counter() if started_at is None else started_at
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            # The longest step; it runs in its own thread alongside the rest of the warm-up
+            start_indexing()
+            _warm_up_thread = threading.Thread(target=_warm_up, args=(started_at,), name="warm-up", daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def is_ready() -> bool:
+    """Returns True once the warm-up has finished and questions are answered from the documents."""
+    from src.ingester import index_ready
+
+    return _warm_up_done.is_set() and index_ready.is_set()
+
+
+# --- Time to import, time to ready, and requests served during the warm-up (offline, stub models) ---
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    from langchain_core.messages import AIMessage
+
+    import src.config as config
+    from src.load_test import ScriptedChatModel, install_stub_models
+    from src.logging_config import configure_logging
+
+    configure_logging()
+    install_stub_models(ScriptedChatModel(responses=[AIMessage(content="retrieve")], latency_seconds=0.2))
+    # Keep the test vendor, conversations and escalations out of the real databases
+    scratch_dir = Path(tempfile.mkdtemp())
+    config.CHECKPOINT_DB_FILE = scratch_dir / "checkpoints.sqlite"
+    config.QUEUE_DB_FILE = str(scratch_dir / "global_service_queue.sqlite")
+    config.QUEUE_FILE = str(scratch_dir / "global_service_queue.json")
+    config.QUEUE_LOG_FILE = str(scratch_dir / "global_service_queue.log")
+
+    start = time.perf_counter()
+    from src.ingester import index_ready
+    from src.main import ask_for_help
+    print(f"Imported src.main in {time.perf_counter() - start:.2f}s")
+
+    from src.tool_store import ToolDataStore, set_tool_store
+    no_file = scratch_dir / "missing.json"
+    set_tool_store(ToolDataStore(scratch_dir / "tools_data.sqlite", no_file, no_file))
+
+    start_warm_up(start)
+    answer_start = time.perf_counter()
+    answer = ask_for_help("Add vendor 'Warmup Supplies' to user 1", session_id="warm-up-tool", language="English")
+    print(f"Tool request during warm-up ({'index ready' if index_ready.is_set() else 'index not ready'}): "
+          f"{answer!r} in {time.perf_counter() - answer_start:.2f}s")
+    answer_start = time.perf_counter()
+    answer = ask_for_help("What does the handbook say about vacation days?", session_id="warm-up-question",
+                          language="English")
+    print(f"Question during warm-up: {answer!r} in {time.perf_counter() - answer_start:.2f}s")
+
+    _warm_up_thread.join()
+    print(f"Ready: {is_ready()}, timings: { {name: round(seconds, 3) for name, seconds in warm_up_timings.items()} }")